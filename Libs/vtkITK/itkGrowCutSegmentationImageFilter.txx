@@ -592,6 +592,7 @@ GrowCutSegmentationImageFilter<TInputImage, TOutputImage, TWeightPixelType>
   singleIteration->SetSeedStrength( this->GetSeedStrength());
   singleIteration->SetMaxIterations( this->GetMaxIterations());
   singleIteration->SetObjectRadius(this->GetObjectRadius() );
+  singleIteration->SetNumberOfThreads(this->GetNumberOfThreads() );
 
   singleIteration->SetROIStart( this->GetROIStart() );
   singleIteration->SetROIEnd( this->GetROIEnd() );
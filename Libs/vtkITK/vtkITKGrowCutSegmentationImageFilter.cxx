@@ -62,6 +62,7 @@ void vtkITKImageGrowCutExecute3D(vtkImageData *inData,
   OT *output, double &ObjectSize,
   double &contrastNoiseRatio,
   double &priorSegmentStrength,
+  int numberOfThreads,
   itk::CStyleCommand::Pointer progressCommand)
 {
   typedef itk::Image<IT1, 3> InImageType;
@@ -224,6 +225,10 @@ void vtkITKImageGrowCutExecute3D(vtkImageData *inData,
   typename FilterType::Pointer filter = FilterType::New();
 
   filter->AddObserver(itk::ProgressEvent(), progressCommand );
+  if (numberOfThreads > 0)
+    {
+    filter->SetNumberOfThreads(numberOfThreads);
+    }
 
   typename InImageType::IndexType istart;
   typename InImageType::SizeType isize;
@@ -328,6 +333,7 @@ vtkITKGrowCutSegmentationImageFilter::vtkITKGrowCutSegmentationImageFilter()
   this->ObjectSize = 20;
   this->ContrastNoiseRatio = 1.0;
   this->PriorSegmentConfidence = 0.003;
+  this->NumberOfThreads = 0;
   this->SetNumberOfInputPorts(3);
   this->SetNumberOfOutputPorts(1);
 }
@@ -438,7 +444,7 @@ void ExecuteGrowCut( vtkITKGrowCutSegmentationImageFilter *self,
           (IT1*)(inPtr1), (short*)(inPtr2), (short*) (inPtr3),
           (short*)(outPtr),
           self->ObjectSize, self->ContrastNoiseRatio,
-          self->PriorSegmentConfidence,
+          self->PriorSegmentConfidence, self->NumberOfThreads,
           progressCommand);
         imageCaster1->Delete();
         }
@@ -460,7 +466,7 @@ void ExecuteGrowCut( vtkITKGrowCutSegmentationImageFilter *self,
             (IT1*)(inPtr1), (unsigned short*)(inPtr2), (unsigned short*) (inPtr3),
             (unsigned short*)(outPtr),
             self->ObjectSize, self->ContrastNoiseRatio,
-            self->PriorSegmentConfidence,
+            self->PriorSegmentConfidence, self->NumberOfThreads,
             progressCommand);
           }
         else if (input2->GetScalarType() == VTK_SHORT)
@@ -469,7 +475,7 @@ void ExecuteGrowCut( vtkITKGrowCutSegmentationImageFilter *self,
             (IT1*)(inPtr1), (short*)(inPtr2), (short*) (inPtr3),
             (short*)(outPtr),
             self->ObjectSize, self->ContrastNoiseRatio,
-            self->PriorSegmentConfidence,
+            self->PriorSegmentConfidence, self->NumberOfThreads,
             progressCommand);
           }
         else if(input2->GetScalarType() == VTK_UNSIGNED_CHAR)
@@ -478,7 +484,7 @@ void ExecuteGrowCut( vtkITKGrowCutSegmentationImageFilter *self,
             (IT1*)(inPtr1), (unsigned char*)(inPtr2), (unsigned char*) (inPtr3),
             (unsigned char*)(outPtr),
             self->ObjectSize, self->ContrastNoiseRatio,
-            self->PriorSegmentConfidence,
+            self->PriorSegmentConfidence, self->NumberOfThreads,
             progressCommand);
           }
         else if(input2->GetScalarType() == VTK_CHAR)
@@ -487,7 +493,7 @@ void ExecuteGrowCut( vtkITKGrowCutSegmentationImageFilter *self,
             (IT1*)(inPtr1), (char*)(inPtr2), (char*) (inPtr3),
             (char*)(outPtr),
             self->ObjectSize, self->ContrastNoiseRatio,
-            self->PriorSegmentConfidence,
+            self->PriorSegmentConfidence, self->NumberOfThreads,
             progressCommand);
           }
         else if(input2->GetScalarType() == VTK_UNSIGNED_LONG)
@@ -496,7 +502,7 @@ void ExecuteGrowCut( vtkITKGrowCutSegmentationImageFilter *self,
             (IT1*)(inPtr1), (unsigned long*)(inPtr2), (unsigned long*) (inPtr3),
             (unsigned long*)(outPtr),
             self->ObjectSize, self->ContrastNoiseRatio,
-            self->PriorSegmentConfidence,
+            self->PriorSegmentConfidence, self->NumberOfThreads,
             progressCommand);
           }
         else if(input2->GetScalarType() == VTK_LONG)
@@ -505,7 +511,7 @@ void ExecuteGrowCut( vtkITKGrowCutSegmentationImageFilter *self,
             (IT1*)(inPtr1), (long*)(inPtr2), (long*) (inPtr3),
             (long*)(outPtr),
             self->ObjectSize, self->ContrastNoiseRatio,
-            self->PriorSegmentConfidence,
+            self->PriorSegmentConfidence, self->NumberOfThreads,
             progressCommand);
           }
         }
@@ -549,7 +555,7 @@ void ExecuteGrowCut( vtkITKGrowCutSegmentationImageFilter *self,
         (IT1*)(inPtr1), (short*)(inPtr2), (short*) (inPtr3),
         (short*)(outPtr),
         self->ObjectSize, self->ContrastNoiseRatio,
-        self->PriorSegmentConfidence,
+        self->PriorSegmentConfidence, self->NumberOfThreads,
         progressCommand);
 
       imageCaster1->Delete();
@@ -571,7 +577,7 @@ void ExecuteGrowCut( vtkITKGrowCutSegmentationImageFilter *self,
           (IT1*)(inPtr1), (unsigned short*)(inPtr2), (unsigned short*) (inPtr3),
           (unsigned short*)(outPtr),
           self->ObjectSize, self->ContrastNoiseRatio,
-          self->PriorSegmentConfidence,
+          self->PriorSegmentConfidence, self->NumberOfThreads,
           progressCommand);
         }
       else if (input2->GetScalarType() == VTK_SHORT)
@@ -580,7 +586,7 @@ void ExecuteGrowCut( vtkITKGrowCutSegmentationImageFilter *self,
           (IT1*)(inPtr1), (short*)(inPtr2), (short*) (inPtr3),
           (short*)(outPtr),
           self->ObjectSize, self->ContrastNoiseRatio,
-          self->PriorSegmentConfidence,
+          self->PriorSegmentConfidence, self->NumberOfThreads,
           progressCommand);
         }
       else if(input2->GetScalarType() == VTK_UNSIGNED_CHAR)
@@ -589,7 +595,7 @@ void ExecuteGrowCut( vtkITKGrowCutSegmentationImageFilter *self,
           (IT1*)(inPtr1), (unsigned char*)(inPtr2), (unsigned char*) (inPtr3),
           (unsigned char*)(outPtr),
           self->ObjectSize, self->ContrastNoiseRatio,
-          self->PriorSegmentConfidence,
+          self->PriorSegmentConfidence, self->NumberOfThreads,
           progressCommand);
         }
       else if(input2->GetScalarType() == VTK_CHAR)
@@ -598,7 +604,7 @@ void ExecuteGrowCut( vtkITKGrowCutSegmentationImageFilter *self,
           (IT1*)(inPtr1), (char*)(inPtr2), (char*) (inPtr3),
           (char*)(outPtr),
           self->ObjectSize, self->ContrastNoiseRatio,
-          self->PriorSegmentConfidence,
+          self->PriorSegmentConfidence, self->NumberOfThreads,
           progressCommand);
         }
       else if(input2->GetScalarType() == VTK_UNSIGNED_LONG)
@@ -607,7 +613,7 @@ void ExecuteGrowCut( vtkITKGrowCutSegmentationImageFilter *self,
         (IT1*)(inPtr1), (unsigned long*)(inPtr2), (unsigned long*) (inPtr3),
         (unsigned long*)(outPtr),
         self->ObjectSize, self->ContrastNoiseRatio,
-        self->PriorSegmentConfidence,
+        self->PriorSegmentConfidence, self->NumberOfThreads,
         progressCommand);
       }
       else if(input2->GetScalarType() == VTK_LONG)
@@ -616,7 +622,7 @@ void ExecuteGrowCut( vtkITKGrowCutSegmentationImageFilter *self,
           (IT1*)(inPtr1), (long*)(inPtr2), (long*) (inPtr3),
           (long*)(outPtr),
           self->ObjectSize, self->ContrastNoiseRatio,
-          self->PriorSegmentConfidence,
+          self->PriorSegmentConfidence, self->NumberOfThreads,
           progressCommand);
         }
       }
@@ -675,4 +681,5 @@ void vtkITKGrowCutSegmentationImageFilter::PrintSelf(ostream& os, vtkIndent inde
 
   os << indent << "Object Size : " << this->ObjectSize << std::endl;
   os << indent << "ContrastNoiseRatio : " << this->ContrastNoiseRatio << std::endl;
+  os << indent << "NumberOfThreads : " << this->NumberOfThreads << std::endl;
 }
@@ -44,10 +44,16 @@ public:
   vtkSetMacro(PriorSegmentConfidence, double);
   vtkGetMacro(PriorSegmentConfidence, double);
 
+  /// Methods to set/get the number of threads of the itk filter,
+  /// 0 (the default) uses the itk default
+  vtkSetMacro(NumberOfThreads, int);
+  vtkGetMacro(NumberOfThreads, int);
+
 public:
   double ObjectSize;
   double PriorSegmentConfidence;
   double ContrastNoiseRatio;
+  int NumberOfThreads;
 
 
 protected:
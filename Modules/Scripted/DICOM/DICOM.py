@@ -83,6 +83,21 @@ This work is supported by NA-MIC, NAC, BIRN, NCIGT, and the Slicer Community. Se
     # set the dicom pre-cache tags once all plugin classes have been initialized
     qt.QTimer.singleShot(0, DICOM.setDatabasePrecacheTags)
 
+    # Add the send test to the SelfTest module's list for discovery when the module
+    # is created.  Since this module may be discovered before SelfTests itself,
+    # create the list if it doesn't already exist.
+    try:
+      slicer.selfTests
+    except AttributeError:
+      slicer.selfTests = {}
+    slicer.selfTests['DICOMSend'] = self.runSendTest
+
+  def runSendTest(self):
+    """Send the sample data to the testing server in batches of files
+    over parallel associations"""
+    if not DICOMSendTest():
+      raise Exception("DICOMSendTest failed")
+
   def addMenu(self):
     """Add an action to the File menu that will go into
     the DICOM module by selecting the module.  Note that
@@ -439,19 +454,32 @@ class DICOMWidget:
 
   def onContextMenuTriggered(self,action):
     if action == self.deleteAction:
+      if self.detailsPopup.isExamining():
+        # a plugin examining the series to delete is processing events
+        self.messageBox('Wait for the examination of the series to finish before deleting')
+        return
       typeRole = self.selection.data(self.dicomModelTypeRole)
       role = self.dicomModelTypes[typeRole]
       uid = self.selection.data(self.dicomModelUIDRole)
       if self.okayCancel('This will remove references from the database\n(Files will not be deleted)\n\nDelete %s?' % role):
         # TODO: add delete option to ctkDICOMDatabase
         if role == "Patient":
+          studies = slicer.dicomDatabase.studiesForPatient(uid)
+          series = [s for study in studies for s in slicer.dicomDatabase.seriesForStudy(study)]
           removeWorked = slicer.dicomDatabase.removePatient(uid)
         elif role == "Study":
+          series = slicer.dicomDatabase.seriesForStudy(uid)
           removeWorked = slicer.dicomDatabase.removeStudy(uid)
         elif role == "Series":
+          series = [uid]
           removeWorked = slicer.dicomDatabase.removeSeries(uid)
         if not removeWorked:
           self.messageBox(self,"Could not remove %s" % role,title='DICOM')
+        else:
+          # the examination results of the removed series are stale
+          loadableCache = DICOMLib.DICOMLoadableCache()
+          for seriesUID in series:
+            loadableCache.invalidateSeries(seriesUID)
     elif action == self.exportAction:
       self.onExportClicked()
 
@@ -526,12 +554,16 @@ class DICOMWidget:
     """
 
   def onListenerAddedFile(self):
-    """Called after the listener has added a file.
+    """Called after the listener has added a batch of files.
     Restore and refresh the app model
     """
     newFile = slicer.dicomListener.lastFileAdded
     if newFile:
-      slicer.util.showStatusMessage("Loaded: %s" % newFile, 1000)
+      count = slicer.dicomListener.filesAddedCount
+      if count > 1:
+        slicer.util.showStatusMessage("Loaded %d files, last: %s" % (count, newFile), 1000)
+      else:
+        slicer.util.showStatusMessage("Loaded: %s" % newFile, 1000)
 
   def onToggleServer(self):
     if self.testingServer and self.testingServer.qrRunning():
@@ -597,13 +629,34 @@ def DICOMTest():
   print("DICOMTest Passed!")
   return True
 
+def DICOMSendTest(filesPerAssociation=20,associations=4):
+  """Send the sample data to the testing server in batches
+  and report the throughput"""
+  w = slicer.modules.dicom.widgetRepresentation()
+  if not (w.testingServer and w.testingServer.qrRunning()):
+    w.onToggleServer()
+  files = glob.glob(w.dataDir+'/*.dcm')
+  if not files:
+    print("DICOMSendTest: no sample data in %s" % w.dataDir)
+    return False
+  messages = []
+  sender = DICOMLib.DICOMSender(files, 'localhost', 11112, progressCallback=messages.append,
+                                filesPerAssociation=filesPerAssociation, associations=associations,
+                                aeTitle='CTK_AE', callingAETitle='CTK_AE')
+  if sender.sentCount != len(files):
+    print("DICOMSendTest: sent %d of %d files" % (sender.sentCount, len(files)))
+    return False
+  print(messages[-1])
+  print("DICOMSendTest Passed! (%.1f instances/s, %.2f MB/s)" % (sender.instancesPerSecond, sender.megabytesPerSecond))
+  return True
+
 def DICOMDemo():
   pass
 
 if __name__ == "__main__":
   import sys
   if '--test' in sys.argv:
-    if DICOMTest():
+    if DICOMTest() and DICOMSendTest():
       exit(0)
     exit(1)
   if '--demo' in sys.argv:
@@ -0,0 +1,223 @@
+import time
+import threading
+import Queue
+from __main__ import qt
+from __main__ import slicer
+
+#########################################################
+#
+#
+comment = """
+
+DICOMExamineScheduler runs the examination of file lists by
+the dicom plugins in small steps so that the browser stays
+responsive and the results can be shown as they come.
+
+# TODO :
+"""
+#
+#########################################################
+
+class DICOMExamineCanceled(Exception):
+  """Raised by DICOMPlugin.checkCanceled when the examination
+  has been canceled"""
+  pass
+
+class DICOMExamineScheduler(object):
+  """Examine file lists with a set of plugins, one series at a time.
+
+  The work is split in units: one per series for the plugins that
+  examine series independently (see
+  DICOMPlugin.examinesSeriesIndependently) and one for all the file
+  lists for the other plugins.  The tag tables of the units are
+  prefetched from the database by worker threads while the units
+  run one after the other on the main thread (plugins use the dicom
+  database and the scene, which can only be used from there).
+
+  Use start() to run the units from the qt event loop, or run()
+  to wait for them all.  The plugins call checkCanceled while
+  examining, which keeps the application responsive and stops the
+  examination within a series once cancel() has been called.
+
+  The tag tables of the units are pinned in their plugin until the
+  unit has run so that the plugin does not drop them before
+  examining.  The plugins are shared by all the schedulers: while
+  one of them examines (and processes events from checkCanceled),
+  the others started from the event loop wait.  run() cannot wait
+  for an examination further down the stack, it examines with its
+  own cancel check and gives the plugin back the interrupted one.
+  """
+
+  # the scheduler whose plugin is examining, if any
+  examining = None
+
+  # number of threads prefetching tag tables
+  workerCount = 4
+
+  # seconds between processing events while a plugin examines files
+  eventInterval = 0.1
+
+  def __init__(self,plugins,fileLists,onLoadables=None,onProgress=None,onFinished=None):
+    """plugins is a list of (pluginClass, plugin instance) pairs.
+    onLoadables(loadablesByPlugin) is called after every unit with
+    new loadables, onProgress(done,total,text) before every unit and
+    onFinished(scheduler) once when all is done or canceled."""
+    self.plugins = plugins
+    self.fileLists = fileLists
+    self.onLoadables = onLoadables
+    self.onProgress = onProgress
+    self.onFinished = onFinished
+    self.loadablesByPlugin = {}
+    # (pluginClass, error) of the plugins that raised an exception
+    self.failures = []
+    self.canceled = False
+    self.running = False
+    self.finished = False
+    self.lastEventTime = 0
+    # [pluginClass, plugin, fileLists, tag table being prefetched or None]
+    self.units = []
+    self.prefetching = set()
+    self.prefetchQueue = Queue.Queue()
+
+    for pluginClass, plugin in plugins:
+      self.loadablesByPlugin[plugin] = []
+    # series by series, so that all the options of the first series
+    # are offered first
+    for files in fileLists:
+      for pluginClass, plugin in plugins:
+        if plugin.examinesSeriesIndependently:
+          self.units.append([pluginClass, plugin, [files], None])
+    for pluginClass, plugin in plugins:
+      if not plugin.examinesSeriesIndependently:
+        self.units.append([pluginClass, plugin, fileLists, None])
+    self.unitCount = len(self.units)
+
+  def prefetch(self):
+    """Create the tag tables of the units and queue them for the workers"""
+    for unit in self.units:
+      pluginClass, plugin, fileLists, table = unit
+      if not plugin.examinesSeriesIndependently or not plugin.tags or not fileLists[0]:
+        continue
+      table = plugin.tagTable(fileLists[0],plugin.examineTagNames,prefetch=False)
+      plugin.pinTagTable(table)
+      unit[3] = table
+      if table.prefetched:
+        continue
+      if table not in self.prefetching:
+        self.prefetching.add(table)
+        self.prefetchQueue.put((table, table.databasePaths()))
+    for n in xrange(min(self.workerCount, self.prefetchQueue.qsize())):
+      worker = threading.Thread(target=self.prefetchWorker)
+      worker.daemon = True
+      worker.start()
+
+  def prefetchWorker(self):
+    while not self.canceled:
+      try:
+        table, paths = self.prefetchQueue.get_nowait()
+      except Queue.Empty:
+        return
+      try:
+        if paths:
+          table.prefetch(paths)
+      finally:
+        self.prefetching.discard(table)
+
+  def isReady(self,unit):
+    """True if the tag table of the unit is not being prefetched"""
+    return unit[3] not in self.prefetching
+
+  def start(self):
+    """Examine from the event loop, returns immediately"""
+    self.running = True
+    self.prefetch()
+    qt.QTimer.singleShot(0, self.onTimer)
+
+  def run(self):
+    """Examine everything before returning"""
+    self.running = True
+    self.prefetch()
+    while self.step(wait=True):
+      slicer.app.processEvents()
+
+  def onTimer(self):
+    if self.step():
+      qt.QTimer.singleShot(0, self.onTimer)
+
+  def cancel(self):
+    self.canceled = True
+
+  def checkCanceled(self):
+    """Called by the plugins while examining: process events now
+    and then, return True if the examination was canceled"""
+    now = time.time()
+    if now - self.lastEventTime > self.eventInterval:
+      self.lastEventTime = now
+      slicer.app.processEvents()
+    return self.canceled
+
+  def step(self,wait=False):
+    """Examine the first unit that is ready, return True if
+    there is more to do.  Nothing is examined while another
+    scheduler is examining, unless wait is True"""
+    if self.finished:
+      return False
+    if self.canceled or not self.units:
+      self.finish()
+      return False
+    if DICOMExamineScheduler.examining and not wait:
+      # another scheduler is examining and processing events
+      return True
+    ready = [unit for unit in self.units if self.isReady(unit)]
+    if not ready:
+      # waiting for the workers
+      time.sleep(0.01)
+      return True
+    unit = ready[0]
+    self.units.remove(unit)
+    pluginClass, plugin, fileLists, table = unit
+    if self.onProgress:
+      self.onProgress(self.unitCount - len(self.units) - 1, self.unitCount, pluginClass)
+    if pluginClass in [failure[0] for failure in self.failures]:
+      if table:
+        plugin.unpinTagTable(table)
+      return True
+    interruptedScheduler = DICOMExamineScheduler.examining
+    interruptedCheck = plugin.cancelCheck
+    DICOMExamineScheduler.examining = self
+    plugin.cancelCheck = self.checkCanceled
+    try:
+      try:
+        loadables = plugin.examine(fileLists)
+      finally:
+        plugin.cancelCheck = interruptedCheck
+        DICOMExamineScheduler.examining = interruptedScheduler
+        if table:
+          plugin.unpinTagTable(table)
+    except DICOMExamineCanceled:
+      self.canceled = True
+      return True
+    except Exception,e:
+      import traceback
+      traceback.print_exc()
+      print("DICOM Plugin failed: %s" % str(e))
+      self.failures.append((pluginClass, str(e)))
+      self.loadablesByPlugin[plugin] = []
+      return True
+    if loadables:
+      pluginLoadables = self.loadablesByPlugin[plugin]
+      pluginLoadables += loadables
+      if hasattr(plugin,'seriesSorter'):
+        pluginLoadables.sort(lambda x,y: plugin.seriesSorter(x,y))
+      if self.onLoadables:
+        self.onLoadables(self.loadablesByPlugin)
+    return True
+
+  def finish(self):
+    self.finished = True
+    self.running = False
+    for pluginClass, plugin, fileLists, table in self.units:
+      if table:
+        plugin.unpinTagTable(table)
+    if self.onFinished:
+      self.onFinished(self)
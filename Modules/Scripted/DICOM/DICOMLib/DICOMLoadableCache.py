@@ -0,0 +1,190 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+from __main__ import slicer
+import DICOMLib
+
+#########################################################
+#
+#
+comment = """
+
+DICOMLoadableCache keeps the results of plugin examination
+on disk next to the dicom database so that a series examined
+in an earlier session does not need to be examined again.
+
+# TODO :
+"""
+#
+#########################################################
+
+class DICOMLoadableCache(object):
+  """Persistent store of the loadables returned by the plugins
+  for a list of files, in an sqlite file in the directory of the
+  dicom database.
+
+  An entry is keyed by the plugin, the series instance UID, the
+  number of files and a signature of the file paths and their
+  modification times, so editing or replacing a file misses the
+  cache.  The number of instances the database had indexed for the
+  series is stored with the entry: when the database has indexed
+  new instances of the series since, all the entries of that
+  series are dropped.
+
+  Only plain DICOMLoadable instances whose attributes can be
+  written as json are stored.
+  """
+
+  fileName = 'DICOMLoadableCache.sql'
+
+  # oldest entries are dropped beyond this count
+  maximumEntries = 5000
+
+  def __init__(self,dicomDatabase=None):
+    self.dicomDatabase = dicomDatabase if dicomDatabase else slicer.dicomDatabase
+
+  def databasePath(self):
+    """Return the path of the dicom database, or None if it is not on disk"""
+    try:
+      databasePath = self.dicomDatabase.databaseFilename
+    except AttributeError:
+      return None
+    if not databasePath or not os.path.exists(databasePath):
+      return None
+    return databasePath
+
+  def cachePath(self):
+    databasePath = self.databasePath()
+    if not databasePath:
+      return None
+    return os.path.join(os.path.dirname(databasePath), self.fileName)
+
+  def connect(self):
+    """Open the cache, creating its table if needed"""
+    connection = sqlite3.connect(self.cachePath())
+    connection.execute("""CREATE TABLE IF NOT EXISTS Loadables (
+                            Plugin TEXT, SeriesInstanceUID TEXT, FileCount INTEGER,
+                            Signature TEXT, IndexedCount INTEGER, Time REAL, Loadables TEXT,
+                            PRIMARY KEY (Plugin, SeriesInstanceUID, FileCount, Signature))""")
+    return connection
+
+  def series(self,files):
+    """Return (seriesInstanceUID, indexedCount) of the first file, where
+    indexedCount is the number of instances of the series in the database,
+    or None if the file is not in the database"""
+    connection = sqlite3.connect(self.databasePath())
+    try:
+      query = ("SELECT SeriesInstanceUID, (SELECT count(*) FROM Images AS Series WHERE Series.SeriesInstanceUID = Images.SeriesInstanceUID) "
+                 "FROM Images WHERE Filename = ?")
+      row = connection.execute(query, (files[0],)).fetchone()
+    finally:
+      connection.close()
+    return row
+
+  def signature(self,files):
+    """Hash of the file paths and modification times"""
+    m = hashlib.md5()
+    for f in files:
+      m.update(f.encode('utf-8') if isinstance(f, unicode) else f)
+      m.update(repr(os.path.getmtime(f)))
+    return m.hexdigest()
+
+  def key(self,plugin,files):
+    """Return (key, indexedCount) for the files, or (None, None) if they
+    cannot be cached"""
+    if not files or not self.databasePath():
+      return None, None
+    series = self.series(files)
+    if not series:
+      return None, None
+    seriesInstanceUID, indexedCount = series
+    return (plugin, seriesInstanceUID, len(files), self.signature(files)), indexedCount
+
+  def loadables(self,plugin,files):
+    """Return the cached loadables of the plugin (a name) for the
+    files, or None if there are none or they are out of date"""
+    try:
+      key, indexedCount = self.key(plugin,files)
+      if not key:
+        return None
+      connection = self.connect()
+      try:
+        row = connection.execute("SELECT IndexedCount, Loadables FROM Loadables WHERE "
+                                 "Plugin = ? AND SeriesInstanceUID = ? AND FileCount = ? AND Signature = ?", key).fetchone()
+        if not row:
+          return None
+        if row[0] != indexedCount:
+          # new instances of the series were indexed
+          connection.execute("DELETE FROM Loadables WHERE SeriesInstanceUID = ?", (key[1],))
+          connection.commit()
+          return None
+      finally:
+        connection.close()
+      return [self.loadableFromDictionary(d) for d in json.loads(row[1])]
+    except (sqlite3.Error, OSError, ValueError) as e:
+      print("Could not read cached loadables: %s" % e)
+      return None
+
+  def store(self,plugin,files,loadables):
+    """Save the loadables of the plugin for the files"""
+    for loadable in loadables:
+      if type(loadable) is not DICOMLib.DICOMLoadable:
+        return
+    try:
+      value = json.dumps([loadable.__dict__ for loadable in loadables])
+    except (TypeError, ValueError):
+      return
+    try:
+      key, indexedCount = self.key(plugin,files)
+      if not key:
+        return
+      connection = self.connect()
+      try:
+        connection.execute("INSERT OR REPLACE INTO Loadables VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           key + (indexedCount, time.time(), value))
+        connection.execute("DELETE FROM Loadables WHERE SeriesInstanceUID = ? AND IndexedCount != ?",
+                           (key[1], indexedCount))
+        connection.execute("DELETE FROM Loadables WHERE rowid NOT IN "
+                           "(SELECT rowid FROM Loadables ORDER BY Time DESC LIMIT ?)", (self.maximumEntries,))
+        connection.commit()
+      finally:
+        connection.close()
+    except (sqlite3.Error, OSError) as e:
+      print("Could not cache loadables: %s" % e)
+
+  def invalidateSeries(self,seriesInstanceUID):
+    """Drop the entries of all the plugins for the series, called
+    when the series is removed from the database"""
+    if not self.databasePath() or not os.path.exists(self.cachePath()):
+      return
+    try:
+      connection = self.connect()
+      try:
+        connection.execute("DELETE FROM Loadables WHERE SeriesInstanceUID = ?", (seriesInstanceUID,))
+        connection.commit()
+      finally:
+        connection.close()
+    except sqlite3.Error as e:
+      print("Could not invalidate cached loadables: %s" % e)
+
+  def loadableFromDictionary(self,dictionary):
+    loadable = DICOMLib.DICOMLoadable()
+    for name, value in dictionary.items():
+      setattr(loadable, str(name), self.plainStrings(value))
+    return loadable
+
+  def plainStrings(self,value):
+    """json gives unicode strings, turn them back into the str
+    values the plugins produced"""
+    if isinstance(value, unicode):
+      try:
+        return str(value)
+      except UnicodeEncodeError:
+        return value.encode('utf-8')
+    if isinstance(value, list):
+      return [self.plainStrings(v) for v in value]
+    if isinstance(value, dict):
+      return dict([(self.plainStrings(k), self.plainStrings(v)) for k, v in value.items()])
+    return value
@@ -94,14 +94,30 @@ class DICOMPlugin(object):
     self.loadType = "Generic DICOM"
     # a dictionary that maps a list of files to a list of loadables
     # (so that subsequent requests for the same info can be
-    #  serviced quickly)
+    #  serviced quickly), backed by a DICOMLoadableCache on disk
+    # that persists across sessions
     self.loadableCache = {}
+    self.persistentLoadableCache = True
     # tags is a dictionary of symbolic name keys mapping to
     # hex tag number values (as in {'pixelData': '7fe0,0010'}).
     # Each subclass should define the tags it will be using in
     # calls to the dicom database so that any needed values
     # can be effiently pre-fetched if possible.
     self.tags = {}
+    # the DICOMTagTables of the file lists examined last, see tagTable
+    self.tagTables = []
+    self.maximumTagTables = 32
+    # tables kept however many are created, see pinTagTable
+    self.pinnedTagTables = []
+    # True if examine(fileLists) returns the loadables of
+    # examine([files]) for each of the file lists, so that
+    # the series can be examined one at a time
+    self.examinesSeriesIndependently = False
+    # names of the tags used by examine (None means all the tags)
+    self.examineTagNames = None
+    # set while examining to a callable returning True
+    # if the user canceled, see checkCanceled
+    self.cancelCheck = None
 
   def hashFiles(self,files):
     """Create a hash key for a list of files"""
@@ -120,6 +136,11 @@ class DICOMPlugin(object):
     key = self.hashFiles(files)
     if self.loadableCache.has_key(key):
       return self.loadableCache[key]
+    if self.persistentLoadableCache:
+      loadables = DICOMLib.DICOMLoadableCache().loadables(self.__class__.__name__,files)
+      if loadables is not None:
+        self.loadableCache[key] = loadables
+      return loadables
     return None
 
   def cacheLoadables(self,files,loadables):
@@ -127,6 +148,50 @@ class DICOMPlugin(object):
     of files for later quick access"""
     key = self.hashFiles(files)
     self.loadableCache[key] = loadables
+    if self.persistentLoadableCache:
+      DICOMLib.DICOMLoadableCache().store(self.__class__.__name__,files,loadables)
+
+  def tagTable(self,files,names=None,prefetch=True):
+    """ Helper method returning a DICOMTagTable with the values
+    of self.tags (or of the given tag names only) for the files.
+    Plugins read tag values from it rather than with one
+    database query per file and tag.
+    The table of an earlier call that covers the files and names
+    is reused, so loading a loadable uses the table built when
+    its series was examined."""
+    if names is None:
+      names = self.tags.keys()
+    for table in self.pinnedTagTables + self.tagTables:
+      if table.hasFiles(files) and set(names).issubset(table.tags):
+        if table not in self.tagTables:
+          self.rememberTagTable(table)
+        return table
+    tags = dict([(name,self.tags[name]) for name in names])
+    table = DICOMLib.DICOMTagTable(files,tags,prefetch=prefetch)
+    self.rememberTagTable(table)
+    return table
+
+  def rememberTagTable(self,table):
+    self.tagTables.append(table)
+    self.tagTables = self.tagTables[-self.maximumTagTables:]
+
+  def pinTagTable(self,table):
+    """ Keep returning the table from tagTable until it is
+    unpinned, even when more than maximumTagTables tables are
+    created in between (as when the tables of many series are
+    prefetched before they are examined)"""
+    self.pinnedTagTables.append(table)
+
+  def unpinTagTable(self,table):
+    if table in self.pinnedTagTables:
+      self.pinnedTagTables.remove(table)
+
+  def checkCanceled(self):
+    """ Helper method for plugins to call regularly while
+    examining files: raises DICOMExamineCanceled if the user
+    canceled the examination"""
+    if self.cancelCheck and self.cancelCheck():
+      raise DICOMLib.DICOMExamineCanceled()
 
   def examine(self,fileList):
     """Look at the list of lists of filenames and return
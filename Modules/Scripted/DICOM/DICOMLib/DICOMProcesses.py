@@ -1,4 +1,7 @@
 import os
+import time
+import collections
+import subprocess
 import slicer
 from __main__ import qt
 from __main__ import ctk
@@ -121,6 +124,14 @@ class DICOMListener(DICOMProcess):
   this task as a QObject callable from PythonQt
   """
 
+  # the received files are indexed from the event loop for at most
+  # indexingSeconds at a time, with indexingInterval milliseconds in
+  # between so the application stays responsive.  The indexer uses
+  # the database connection of the main thread, so it cannot run in
+  # a worker thread.
+  indexingSeconds = 0.1
+  indexingInterval = 20
+
   def __init__(self,database,fileToBeAddedCallback=None,fileAddedCallback=None):
     super(DICOMListener,self).__init__()
     self.dicomDatabase = database
@@ -128,6 +139,13 @@ class DICOMListener(DICOMProcess):
     self.fileToBeAddedCallback = fileToBeAddedCallback
     self.fileAddedCallback = fileAddedCallback
     self.lastFileAdded = None
+    # number of files indexed since the last fileAddedCallback
+    self.filesAddedCount = 0
+    # received files waiting to be indexed
+    self.incomingFiles = collections.deque()
+    self.indexTimer = qt.QTimer()
+    self.indexTimer.singleShot = True
+    self.indexTimer.connect('timeout()', self.indexIncomingFiles)
     settings = qt.QSettings()
 
     dir = settings.value('DatabaseDirectory')
@@ -144,7 +162,6 @@ class DICOMListener(DICOMProcess):
       settings.setValue('StoragePort', '11112')
       self.port = settings.value('StoragePort')
 
-
   def __del__(self):
     super(DICOMListener,self).__del__()
 
@@ -161,49 +178,77 @@ class DICOMListener(DICOMProcess):
 
     self.process.connect('readyReadStandardOutput()', self.readFromListener)
 
-
   def readFromListener(self):
-    print('================ready to read from listener===================')
+    """Queue the files reported by the listener for indexing"""
+    searchTag = '# dcmdump (1/1): '
     while self.process.canReadLine():
       line = str(self.process.readLine())
-      print ("From Listener: %s" % (line) )
-      searchTag = '# dcmdump (1/1): '
       tagStart = line.find(searchTag)
       if tagStart != -1:
-        dicomFilePath = line[tagStart + len(searchTag):].strip()
-        destinationDir = os.path.dirname(self.dicomDatabase.databaseFilename)
-        print()
-        print()
-        print()
-        print ("indexing: %s into %s " % (dicomFilePath, destinationDir) )
-        if self.fileToBeAddedCallback:
-          self.fileToBeAddedCallback()
-        self.indexer.addFile( self.dicomDatabase, dicomFilePath, destinationDir )
-        print ("done indexing")
-        self.lastFileAdded = dicomFilePath
-        if self.fileAddedCallback:
-          print ("calling callback...")
-          self.fileAddedCallback()
-          print ("callback done")
-        else:
-          print ("no callback")
-    stdErr = str(self.process.readAllStandardError())
-    print ("processed stderr")
+        self.incomingFiles.append(line[tagStart + len(searchTag):].strip())
+    self.process.readAllStandardError()
+    if self.incomingFiles and not self.indexTimer.active:
+      self.indexTimer.start(0)
+
+  def indexIncomingFiles(self):
+    """Index queued files for up to indexingSeconds, then notify the
+    callbacks once for the whole batch"""
+    if not self.incomingFiles:
+      return
+    destinationDir = os.path.dirname(self.dicomDatabase.databaseFilename)
+    if self.fileToBeAddedCallback:
+      self.fileToBeAddedCallback()
+    startTime = time.time()
+    batchCount = 0
+    while self.incomingFiles and time.time() - startTime < self.indexingSeconds:
+      dicomFilePath = self.incomingFiles.popleft()
+      self.indexer.addFile( self.dicomDatabase, dicomFilePath, destinationDir )
+      self.lastFileAdded = dicomFilePath
+      batchCount += 1
+    self.filesAddedCount = batchCount
+    print ("indexed %d files into %s (%d waiting)" % (batchCount, destinationDir, len(self.incomingFiles)) )
+    if self.fileAddedCallback:
+      self.fileAddedCallback()
+    if self.incomingFiles:
+      self.indexTimer.start(self.indexingInterval)
 
 class DICOMSender(DICOMProcess):
   """Code to send files to a remote host
   (Uses storescu from dcmtk)
+
+  Files are sent in batches of up to filesPerAssociation files, each
+  batch with one storescu process (one association), and up to
+  associations processes run at the same time.  The progressCallback
+  gets a message after every batch with the throughput so far, which
+  is also available as instancesPerSecond and megabytesPerSecond.
+  With the defaults every file is sent on its own, one at a time.
+  The files are sent from the constructor unless send is False,
+  then call send() (batches() tells how many batches there will be).
   """
 
-  def __init__(self,files,address,port,progressCallback=None):
+  # keep the storescu command lines well below the windows limit
+  maximumArgumentLength = 24000
+
+  def __init__(self,files,address,port,progressCallback=None,
+               filesPerAssociation=1,associations=1,aeTitle="CTK",callingAETitle=None,send=True):
     super(DICOMSender,self).__init__()
     self.files = files
     self.address = address
     self.port = port
+    self.filesPerAssociation = max(1, filesPerAssociation)
+    self.associations = max(1, associations)
+    self.aeTitle = aeTitle
+    self.callingAETitle = callingAETitle
     self.progressCallback = progressCallback
     if not self.progressCallback:
       self.progressCallback = self.defaultProgressCallback
-    self.send()
+    self.sentCount = 0
+    self.sentBytes = 0
+    self.elapsedSeconds = 0.
+    self.instancesPerSecond = 0.
+    self.megabytesPerSecond = 0.
+    if send:
+      self.send()
 
   def __del__(self):
     super(DICOMSender,self).__del__()
@@ -211,27 +256,89 @@ class DICOMSender(DICOMProcess):
   def defaultProgressCallback(self,s):
     print(s)
 
-  def send(self):
-    self.progressCallback("Starting send to %s:%s" % (self.address, self.port))
+  def batches(self):
+    """Split the files in the lists sent on each association"""
+    batches = []
+    batch = []
+    length = 0
     for file in self.files:
-      self.start(file)
-      self.progressCallback("Sent %s to %s:%s" % (file, self.address, self.port))
+      if batch and (len(batch) == self.filesPerAssociation or
+                    length + len(file) + 1 > self.maximumArgumentLength):
+        batches.append(batch)
+        batch = []
+        length = 0
+      batch.append(file)
+      length += len(file) + 1
+    if batch:
+      batches.append(batch)
+    return batches
 
-  def start(self,file):
+  def send(self):
+    self.progressCallback("Starting send to %s:%s" % (self.address, self.port))
     self.storeSCUExecutable = self.exeDir+'/storescu'+self.exeExtension
+    pending = self.batches()
+    pending.reverse()
+    running = []
+    startTime = time.time()
+    try:
+      while pending or running:
+        while pending and len(running) < self.associations:
+          batch = pending.pop()
+          running.append((self.startBatch(batch), batch))
+        # wait for any of the running associations to finish
+        finished = None
+        while not finished:
+          for process, batch in running:
+            # waitForFinished is False for a process that already finished
+            if (process.state() == qt.QProcess.NotRunning or
+                process.waitForFinished(50 if len(running) > 1 else -1)):
+              finished = (process, batch)
+              break
+        running.remove(finished)
+        process, batch = finished
+        self.checkBatch(process, batch)
+        self.sentCount += len(batch)
+        for file in batch:
+          self.sentBytes += os.path.getsize(file)
+        self.elapsedSeconds = max(time.time() - startTime, 1e-6)
+        self.instancesPerSecond = self.sentCount / self.elapsedSeconds
+        self.megabytesPerSecond = self.sentBytes / self.elapsedSeconds / (1024. * 1024.)
+        if len(batch) == 1:
+          sent = batch[0]
+        else:
+          sent = "%d files" % len(batch)
+        self.progressCallback("Sent %s to %s:%s (%d of %d, %.1f instances/s, %.2f MB/s)" %
+                              (sent, self.address, self.port, self.sentCount, len(self.files),
+                               self.instancesPerSecond, self.megabytesPerSecond))
+    finally:
+      for process, batch in running:
+        process.kill()
+        process.waitForFinished()
+
+  def startBatch(self,files):
+    """Start a storescu process sending the files on one association"""
     # run the process!
     ### TODO: maybe use dcmsend (is smarter about the compress/decompress)
-    ### TODO: add option in dialog to set AETitle
-    args = [str(self.address), str(self.port), "-aec", "CTK", file]
-    super(DICOMSender,self).start(self.storeSCUExecutable, args)
-    self.process.waitForFinished()
-    if self.process.ExitStatus() == qt.QProcess.CrashExit or self.process.exitCode() != 0:
-      stdout = self.process.readAllStandardOutput()
-      stderr = self.process.readAllStandardError()
-      print('error code is: %d' % self.process.error())
+    args = [str(self.address), str(self.port), "-aec", self.aeTitle]
+    if self.callingAETitle:
+      args += ["-aet", self.callingAETitle]
+    args += files
+    process = qt.QProcess()
+    print ("Starting %s with %d files" % (self.storeSCUExecutable, len(files)))
+    process.start(self.storeSCUExecutable, args)
+    return process
+
+  def checkBatch(self,process,files):
+    if (process.error() == qt.QProcess.FailedToStart or
+        process.exitStatus() == qt.QProcess.CrashExit or process.exitCode() != 0):
+      stdout = process.readAllStandardOutput()
+      stderr = process.readAllStandardError()
+      print('error code is: %d' % process.error())
       print('standard out is: %s' % stdout)
       print('standard error is: %s' % stderr)
-      raise( UserWarning("Could not send %s to %s:%s" % (file, self.address, self.port)) )
+      if len(files) == 1:
+        raise( UserWarning("Could not send %s to %s:%s" % (files[0], self.address, self.port)) )
+      raise( UserWarning("Could not send %d files (%s...) to %s:%s" % (len(files), files[0], self.address, self.port)) )
 
 class DICOMTestingQRServer(object):
   """helper class to set up the DICOM servers
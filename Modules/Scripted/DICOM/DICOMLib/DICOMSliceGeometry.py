@@ -0,0 +1,157 @@
+import numpy
+
+#########################################################
+#
+#
+comment = """
+
+DICOMSliceGeometry checks how the images of a series are
+laid out in space, from their ImagePositionPatient and
+ImageOrientationPatient values, with numpy.
+
+# TODO :
+"""
+#
+#########################################################
+
+def parseDICOMVectors(values,size):
+  """Parse a list of backslash separated DICOM values (strings, or None
+  for missing values) into an (n,size) float array.
+  Returns the array and a boolean array that is True for the values
+  that are missing or could not be parsed (their rows are nan)."""
+  vectors = numpy.empty((len(values),size))
+  vectors.fill(numpy.nan)
+  missing = numpy.ones(len(values), dtype=bool)
+  for index,value in enumerate(values):
+    if not value:
+      continue
+    components = value.split('\\')
+    if len(components) != size:
+      continue
+    try:
+      vectors[index] = [float(component) for component in components]
+    except ValueError:
+      continue
+    missing[index] = False
+  return vectors, missing
+
+class DICOMSliceGeometry(object):
+  """Sort the images of a series along the scan axis and describe
+  their spacing.
+
+  The scan axis is the normal of the orientation of the first image
+  and distances are measured along it from the position of the first
+  image, as the scalar volume plugin always did.  All the results
+  are computed once in the constructor:
+
+  - order: indices of the images sorted by distance (stable)
+  - distances: sorted distances along the scan axis
+  - spacings: distances between consecutive sorted images
+  - spacing: spacing between the first two sorted images, used to
+    load the volume
+  - spacingErrors: difference of every spacing to 'spacing'
+  - irregularSpacings: indices in spacings that differ from
+    'spacing' by more than epsilon
+  - uniqueSpacings: the distinct spacings (within epsilon)
+  - duplicatePositions: indices in spacings where two images are
+    at the same position
+  - gaps: (index in spacings, number of missing images) where the
+    spacing is a multiple of the usual one
+  - orientationsDiffer: True if some image orientation differs
+    from the first one by more than epsilon
+  - gantryTilt: angle in degrees between the scan axis and the
+    line through the image positions, or 0 when it is not more than
+    tiltTolerance (rounding of the positions drifts a little on long
+    series, so this is an angle and not a distance)
+
+  When positions or orientations are missing, missingGeometry is
+  True and only the missing flags are set.
+  """
+
+  def __init__(self,positions,orientations,epsilon=0.01,tiltTolerance=0.1):
+    """positions and orientations are lists of the DICOM strings
+    of the images (or None where a value is missing)"""
+    self.epsilon = epsilon
+    self.tiltTolerance = tiltTolerance
+    self.count = len(positions)
+    self.positions, self.missingPositions = parseDICOMVectors(positions, 3)
+    self.orientations, self.missingOrientations = parseDICOMVectors(orientations, 6)
+    self.order = numpy.arange(self.count)
+    self.distances = numpy.zeros(self.count)
+    self.spacings = numpy.zeros(0)
+    self.spacing = None
+    self.spacingErrors = numpy.zeros(0)
+    self.irregularSpacings = numpy.zeros(0, dtype=int)
+    self.uniqueSpacings = numpy.zeros(0)
+    self.duplicatePositions = numpy.zeros(0, dtype=int)
+    self.gaps = []
+    self.orientationsDiffer = False
+    self.gantryTilt = 0.
+    self.missingGeometry = (self.count == 0 or self.missingPositions.any()
+                            or self.missingOrientations[0])
+    if not self.missingGeometry:
+      self.computeGeometry()
+
+  def computeGeometry(self):
+    orientation = self.orientations[0]
+    self.scanAxis = numpy.cross(orientation[:3], orientation[3:])
+    offsets = self.positions - self.positions[0]
+    distances = numpy.dot(offsets, self.scanAxis)
+    self.order = numpy.argsort(distances, kind='mergesort')
+    self.distances = distances[self.order]
+
+    known = ~self.missingOrientations
+    self.orientationsDiffer = bool((numpy.abs(self.orientations[known] - orientation) > self.epsilon).any())
+
+    if self.count < 2:
+      return
+    self.spacings = numpy.diff(self.distances)
+    self.spacing = self.spacings[0]
+    self.spacingErrors = self.spacings - self.spacing
+    self.irregularSpacings = numpy.nonzero(numpy.abs(self.spacingErrors) > self.epsilon)[0]
+    self.duplicatePositions = numpy.nonzero(self.spacings < self.epsilon)[0]
+
+    # group the sorted spacings that are within epsilon of each other
+    sortedSpacings = numpy.sort(self.spacings)
+    groupStarts = numpy.concatenate(([0], numpy.nonzero(numpy.diff(sortedSpacings) > self.epsilon)[0] + 1))
+    self.uniqueSpacings = numpy.add.reduceat(sortedSpacings, groupStarts) / numpy.diff(numpy.append(groupStarts, sortedSpacings.size))
+
+    # missing images show as spacings that are a multiple of the median
+    usual = numpy.median(self.spacings)
+    if usual > self.epsilon:
+      ratios = self.spacings / usual
+      for index in numpy.nonzero(ratios > 1.5)[0]:
+        self.gaps.append((int(index), int(round(ratios[index])) - 1))
+
+    # the positions of a tilted acquisition move across the scan axis
+    stack = self.positions[self.order[-1]] - self.positions[self.order[0]]
+    along = numpy.dot(stack, self.scanAxis)
+    across = stack - along * self.scanAxis
+    across = numpy.sqrt(numpy.dot(across, across))
+    tilt = float(numpy.degrees(numpy.arctan2(across, abs(along))))
+    if tilt > self.tiltTolerance:
+      self.gantryTilt = tilt
+
+  def sortedItems(self,items):
+    """Return the items (one per image, e.g. the file names) in sorted order"""
+    return [items[index] for index in self.order]
+
+  def isRegular(self):
+    return not self.missingGeometry and self.irregularSpacings.size == 0
+
+  def summary(self):
+    """Text describing the spacing profile"""
+    if self.missingGeometry:
+      return "Missing geometry information"
+    lines = ["%d images, spacing %s" % (self.count, "%g" % self.spacing if self.spacing is not None else "n/a")]
+    if self.uniqueSpacings.size > 1:
+      lines.append("Spacings: " + ", ".join(["%g" % s for s in self.uniqueSpacings]))
+    if self.duplicatePositions.size:
+      lines.append("%d duplicate positions" % self.duplicatePositions.size)
+    if self.gaps:
+      lines.append("%d missing images in %d gaps" % (sum([gap[1] for gap in self.gaps]), len(self.gaps)))
+    if self.gantryTilt:
+      lines.append("Gantry tilt of %g degrees" % self.gantryTilt)
+    if self.orientationsDiffer:
+      lines.append("Image orientations differ")
+    return "\n".join(lines)
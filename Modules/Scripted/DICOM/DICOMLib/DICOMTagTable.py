@@ -0,0 +1,144 @@
+import os
+import sqlite3
+from __main__ import slicer
+
+#########################################################
+#
+#
+comment = """
+
+DICOMTagTable holds the values of a set of tags for a list
+of files, fetched from the dicom database in bulk so that
+plugins don't need a database lookup per file and per tag.
+
+# TODO :
+"""
+#
+#########################################################
+
+class DICOMTagTable(object):
+  """Values of the tags of a plugin (a dictionary of names to
+  tags, as in DICOMPlugin.tags) for a list of files, stored as one
+  column of values per tag name.
+
+  The values precached by the database on import are read with
+  one query per chunk of files from the database tables (the
+  Images table maps files to instance UIDs, the TagCache table
+  holds the values).  Anything that is not in the tag cache is
+  read through dicomDatabase.fileValue the first time it is
+  needed, so the values are always the ones fileValue returns.
+  """
+
+  # markers used by the database tag cache
+  tagNotInInstance = "__TAG_NOT_IN_INSTANCE__"
+  valueIsEmptyString = "__VALUE_IS_EMPTY_STRING__"
+
+  # number of files or tags per query (sqlite limits the number of
+  # parameters of a statement to 999)
+  chunkSize = 400
+
+  def __init__(self,files,tags,dicomDatabase=None,prefetch=True):
+    self.files = list(files)
+    self.tags = dict(tags)
+    self.dicomDatabase = dicomDatabase if dicomDatabase else slicer.dicomDatabase
+    self.fileIndex = {}
+    for index,file in enumerate(self.files):
+      self.fileIndex[file] = index
+    # tag name -> list of values (None where not fetched yet)
+    self.columns = {}
+    for name in self.tags:
+      self.columns[name] = [None] * len(self.files)
+    # number of values read from the tag cache and one at a time
+    self.prefetchedCount = 0
+    self.fileValueCount = 0
+    # True once the tag cache has been read
+    self.prefetched = False
+    if prefetch:
+      self.prefetch()
+
+  def hasFiles(self,files):
+    """True if the table has values for all the files"""
+    for file in files:
+      if not self.fileIndex.has_key(file):
+        return False
+    return True
+
+  def value(self,file,name):
+    """Return the value of the named tag for the file,
+    same as dicomDatabase.fileValue(file,self.tags[name])"""
+    column = self.columns[name]
+    index = self.fileIndex[file]
+    if column[index] is None:
+      column[index] = self.dicomDatabase.fileValue(file,self.tags[name])
+      self.fileValueCount += 1
+    return column[index]
+
+  def values(self,files,name):
+    """Return the values of the named tag for a list of files"""
+    return [self.value(file,name) for file in files]
+
+  def databasePaths(self):
+    """Return the paths of the sqlite database and of its tag
+    cache, or None if the database is not on disk"""
+    try:
+      databasePath = self.dicomDatabase.databaseFilename
+    except AttributeError:
+      return None
+    if not databasePath or not os.path.exists(databasePath):
+      return None
+    tagCachePath = os.path.join(os.path.dirname(databasePath), 'ctkDICOMTagCache.sql')
+    if not os.path.exists(tagCachePath):
+      return None
+    return databasePath, tagCachePath
+
+  def chunks(self,items):
+    for start in xrange(0, len(items), self.chunkSize):
+      yield items[start:start+self.chunkSize]
+
+  def prefetch(self,paths=None):
+    """Fill the columns with the values in the database tag cache.
+    Only sqlite is used when the paths of databasePaths are given,
+    so this can run in a worker thread"""
+    if paths is None:
+      paths = self.databasePaths()
+    if not paths or not self.files:
+      self.prefetched = True
+      return
+    databasePath, tagCachePath = paths
+    namesByTag = {}
+    for name,tag in self.tags.items():
+      namesByTag.setdefault(tag.upper(), []).append(name)
+    tags = namesByTag.keys()
+    try:
+      connection = sqlite3.connect(databasePath)
+      try:
+        filesByInstance = {}
+        for files in self.chunks(self.files):
+          query = "SELECT SOPInstanceUID, Filename FROM Images WHERE Filename IN (%s)" % ",".join("?" * len(files))
+          for instanceUID, file in connection.execute(query, files):
+            filesByInstance[instanceUID] = file
+      finally:
+        connection.close()
+
+      connection = sqlite3.connect(tagCachePath)
+      try:
+        tagList = ",".join("?" * len(tags))
+        for instances in self.chunks(filesByInstance.keys()):
+          query = ("SELECT SOPInstanceUID, upper(Tag), Value FROM TagCache WHERE SOPInstanceUID IN (%s) AND upper(Tag) IN (%s)"
+                     % (",".join("?" * len(instances)), tagList))
+          for instanceUID, tag, value in connection.execute(query, list(instances) + tags):
+            if value is None or value == "":
+              # not cached, leave it to fileValue
+              continue
+            if value == self.tagNotInInstance or value == self.valueIsEmptyString:
+              value = ""
+            index = self.fileIndex[filesByInstance[instanceUID]]
+            for name in namesByTag[tag]:
+              self.columns[name][index] = value
+              self.prefetchedCount += 1
+      finally:
+        connection.close()
+    except sqlite3.Error as e:
+      # the values will come from fileValue
+      print("Could not prefetch dicom tags: %s" % e)
+    self.prefetched = True
@@ -52,6 +52,13 @@ class DICOMDetailsPopup(object):
     self.popupPositioned = False
     self.pluginInstances = {}
     self.fileLists = []
+    self.loadablesByPlugin = {}
+    self.progress = None
+    # the DICOMExamineScheduler of the examination in progress
+    self.examineScheduler = None
+    # the schedulers started here that have not finished, canceled
+    # ones included: their plugin may still be examining
+    self.examiningSchedulers = []
 
   def create(self,widgetType='window',showHeader=False,showPreview=False):
     """
@@ -280,7 +287,7 @@ class DICOMDetailsPopup(object):
       self.loadableTableFrame.hide()
       self.examineButton.hide()
       self.uncheckAllButton.hide()
-      self.loadButton.enabled = True
+      self.loadButton.enabled = not self.isExamining()
       self.window.adjustSize()
 
   def onHorizontalViewCheckBox(self, direction):
@@ -317,6 +324,7 @@ class DICOMDetailsPopup(object):
     self.window.raise_()
 
   def close(self):
+    self.cancelExamination()
     self.onPopupGeometryChanged()
     self.window.hide()
 
@@ -362,8 +370,9 @@ class DICOMDetailsPopup(object):
   def offerLoadables(self,uidArgument,role):
     """Get all the loadable options at the currently selected level
     and present them in the loadable table"""
+    self.cancelExamination()
     self.loadableTable.setLoadables([])
-    if self.advancedViewButton.checkState() == 2:
+    if self.advancedViewButton.checkState() == 2 or self.isExamining():
       self.loadButton.enabled = False
     self.fileLists = []
     if role == "Series":
@@ -383,15 +392,17 @@ class DICOMDetailsPopup(object):
         for serie in series:
           fileList = slicer.dicomDatabase.filesForSeries(serie)
           self.fileLists.append(fileList)
-    self.examineButton.enabled = len(self.fileLists) != 0
+    self.examineButton.enabled = len(self.fileLists) != 0 and not self.isExamining()
     self.viewMetadataButton.enabled = len(self.fileLists) != 0
 
   def uncheckAllLoadables(self):
     self.loadableTable.uncheckAll()
 
-  def examineForLoading(self):
+  def examineForLoading(self,wait=False):
     """For selected plugins, give user the option
-    of what to load"""
+    of what to load.  The plugins examine the series in the
+    background and the loadable table fills as results come
+    in, unless wait is True"""
     allFileCount = missingFileCount = 0
     for fileList in self.fileLists:
         for filePath in fileList:
@@ -406,50 +417,94 @@ class DICOMDetailsPopup(object):
     if missingFileCount == allFileCount:
       return
 
+    self.cancelExamination()
+
     self.progress = qt.QProgressDialog(self.window)
-    self.progress.modal = True
+    self.progress.modal = wait
     self.progress.minimumDuration = 0
     self.progress.show()
     self.progress.setValue(0)
-    self.progress.setMaximum(len(slicer.modules.dicomPlugins))
-    step = 0
 
-    loadEnabled = False
-    self.loadablesByPlugin = {}
-    plugins = self.pluginSelector.selectedPlugins()
-    for pluginClass in plugins:
+    plugins = []
+    for pluginClass in self.pluginSelector.selectedPlugins():
       if not self.pluginInstances.has_key(pluginClass):
         self.pluginInstances[pluginClass] = slicer.modules.dicomPlugins[pluginClass]()
-      plugin = self.pluginInstances[pluginClass]
-      if self.progress.wasCanceled:
-        break
-      self.progress.labelText = '\nChecking %s' % pluginClass
-      slicer.app.processEvents()
-      self.progress.setValue(step)
-      slicer.app.processEvents()
-      try:
-        self.loadablesByPlugin[plugin] = plugin.examine(self.fileLists)
-        loadEnabled = loadEnabled or self.loadablesByPlugin[plugin] != []
-      except Exception,e:
-        import traceback
-        traceback.print_exc()
-        qt.QMessageBox.warning(self.window,
-            "DICOM", "Warning: Plugin failed: %s\n\nSee python console for error message." % pluginClass)
-        print("DICOM Plugin failed: %s", str(e))
-      step +=1
+      plugins.append((pluginClass,self.pluginInstances[pluginClass]))
+
+    self.examineScheduler = DICOMLib.DICOMExamineScheduler(plugins,self.fileLists,
+                                                           onLoadables=self.onExaminedLoadables,
+                                                           onProgress=self.onExamineProgress,
+                                                           onFinished=self.onExamineFinished)
+    self.examiningSchedulers.append(self.examineScheduler)
+    self.loadablesByPlugin = self.examineScheduler.loadablesByPlugin
+    self.progress.setMaximum(self.examineScheduler.unitCount)
+    self.progress.connect('canceled()', self.examineScheduler.cancel)
+    self.loadableTable.setLoadables([])
+    self.loadButton.enabled = False
+    self.examineButton.enabled = False
+    if wait:
+      self.examineScheduler.run()
+    else:
+      self.examineScheduler.start()
+
+  def isExamining(self):
+    """True while a plugin may be examining for this popup.  The
+    plugins process events while examining, so loading, examining
+    again or removing series from the database is not allowed
+    until they are done, even for a canceled examination"""
+    return len(self.examiningSchedulers) != 0
+
+  def cancelExamination(self):
+    """Stop the examination in progress, if any, without
+    offering its results"""
+    if self.examineScheduler:
+      self.examineScheduler.onFinished = self.onCanceledExamineFinished
+      self.examineScheduler.onLoadables = None
+      self.examineScheduler.onProgress = None
+      self.examineScheduler.cancel()
+      self.examineScheduler = None
+    if self.progress:
+      self.progress.close()
+      self.progress = None
+
+  def onExamineProgress(self,done,total,pluginClass):
+    if self.progress:
+      self.progress.labelText = '\nChecking %s (%d of %d)' % (pluginClass, done+1, total)
+      self.progress.setValue(done)
+
+  def onExaminedLoadables(self,loadablesByPlugin):
+    """Show the loadables found so far"""
+    self.organizeLoadables()
+    self.loadableTable.setLoadables(loadablesByPlugin)
+
+  def onCanceledExamineFinished(self,scheduler):
+    self.examiningSchedulers.remove(scheduler)
+    if not self.isExamining():
+      self.loadButton.enabled = self.advancedViewButton.checkState() == 0
+      self.examineButton.enabled = len(self.fileLists) != 0
 
-    self.loadButton.enabled = loadEnabled
+  def onExamineFinished(self,scheduler):
+    self.examiningSchedulers.remove(scheduler)
+    loadEnabled = False
+    for plugin in self.loadablesByPlugin:
+      loadEnabled = loadEnabled or self.loadablesByPlugin[plugin] != []
+    self.loadButton.enabled = loadEnabled and not self.isExamining()
     #self.viewMetadataButton.enabled = loadEnabled
+    self.examineButton.enabled = len(self.fileLists) != 0 and not self.isExamining()
     self.organizeLoadables()
     self.loadableTable.setLoadables(self.loadablesByPlugin)
     self.progress.close()
     self.progress = None
+    self.examineScheduler = None
+    for pluginClass, error in scheduler.failures:
+      qt.QMessageBox.warning(self.window,
+          "DICOM", "Warning: Plugin failed: %s\n\nSee python console for error message." % pluginClass)
 
   def loadCheckedLoadables(self):
     """Invoke the load method on each plugin for the DICOMLoadable
     instances that are selected"""
     if self.advancedViewButton.checkState() == 0:
-      self.examineForLoading()
+      self.examineForLoading(wait=True)
 
     self.loadableTable.updateSelectedFromCheckstate()
     loadableCount = 0
@@ -642,47 +697,138 @@ class DICOMLoadableTable(object):
       self.loadables[row].name = item.text()
 
 
+class DICOMHeader(object):
+  """The header of a dicom file as listed by the database
+  (headerKeys and headerValue).  The keys and values are read
+  once, when the header is created: other code loads other files
+  in the shared database at any time, so the database only holds
+  this header while it is being read.  The headers of the files
+  viewed last are kept so that going back to a file is
+  immediate, see DICOMHeader.forFile.
+  """
+
+  # file -> DICOMHeader, most recently used last
+  cache = []
+  maximumCachedHeaders = 16
+
+  @classmethod
+  def forFile(cls,file,dicomDatabase=None):
+    for header in cls.cache:
+      if header.file == file:
+        cls.cache.remove(header)
+        cls.cache.append(header)
+        return header
+    header = cls(file,dicomDatabase)
+    cls.cache.append(header)
+    del cls.cache[:-cls.maximumCachedHeaders]
+    return header
+
+  def __init__(self,file,dicomDatabase=None):
+    self.file = file
+    self.dicomDatabase = dicomDatabase if dicomDatabase else slicer.dicomDatabase
+    self.dicomDatabase.loadFileHeader(self.file)
+    self.keys = list(self.dicomDatabase.headerKeys())
+    self.values = [self.parseValue(self.dicomDatabase.headerValue(key)) for key in self.keys]
+    # lower case "key value" strings for searching
+    self.searchText = None
+
+  def parseValue(self,dump):
+    try:
+      return dump[dump.index('[')+1:dump.index(']')]
+    except ValueError:
+      return "Unknown"
+
+  def value(self,row):
+    return self.values[row]
+
+  def search(self,text):
+    """Return the rows whose key or value contains the text
+    (case insensitive), all of them for an empty text"""
+    if not text:
+      return range(len(self.keys))
+    if self.searchText is None:
+      self.searchText = [("%s %s" % (self.keys[row], self.value(row))).lower() for row in xrange(len(self.keys))]
+    text = text.lower()
+    return [row for row, rowText in enumerate(self.searchText) if text in rowText]
+
+class DICOMHeaderModel(qt.QAbstractTableModel):
+  """Table model of the tags and values of a DICOMHeader,
+  restricted to the rows matching a filter text.  The views
+  only ask for the rows they show, so no widget item is made
+  for the others.
+  """
+
+  def __init__(self,parent=None):
+    qt.QAbstractTableModel.__init__(self,parent)
+    self.header = None
+    self.rows = []
+    self.filterText = ""
+
+  def setHeader(self,header):
+    self.beginResetModel()
+    self.header = header
+    self.rows = header.search(self.filterText) if header else []
+    self.endResetModel()
+
+  def setFilterText(self,text):
+    self.beginResetModel()
+    self.filterText = text
+    self.rows = self.header.search(text) if self.header else []
+    self.endResetModel()
+
+  def rowCount(self,parent=None):
+    return len(self.rows)
+
+  def columnCount(self,parent=None):
+    return 2
+
+  def data(self,index,role=0):
+    if not index.isValid() or role not in (qt.Qt.DisplayRole, qt.Qt.ToolTipRole):
+      return None
+    row = self.rows[index.row()]
+    if index.column() == 0:
+      return self.header.keys[row]
+    return self.header.value(row)
+
+  def headerData(self,section,orientation,role=0):
+    if role != qt.Qt.DisplayRole or orientation != qt.Qt.Horizontal:
+      return None
+    return ('Tag','Value')[section]
+
 class DICOMHeaderWidget(object):
   """Implement the Qt code for a table of
-  DICOM header values
+  DICOM header values, with a filter field
   """
   # TODO: move this to ctk and use data dictionary for
   # tag names
 
   def __init__(self,parent):
-    self.widget = qt.QTableWidget(parent,width=350,height=300)
-    self.items = []
+    self.widget = qt.QWidget(parent)
+    self.layout = qt.QVBoxLayout()
+    self.layout.setContentsMargins(0,0,0,0)
+    self.widget.setLayout(self.layout)
+    self.filterEdit = qt.QLineEdit()
+    self.filterEdit.setToolTip('Show the tags or values containing this text')
+    self.layout.addWidget(self.filterEdit)
+    self.model = DICOMHeaderModel()
+    self.view = qt.QTableView()
+    self.view.setMinimumWidth(350)
+    self.view.setMinimumHeight(300)
+    self.view.setModel(self.model)
+    self.view.verticalHeader().hide()
+    self.layout.addWidget(self.view)
+    self.filterEdit.connect('textChanged(QString)', self.model.setFilterText)
     self.setHeader(None)
 
   def setHeader(self,file):
-    """Load the table widget with header values for the file
+    """Show the header values for the file
     """
-    self.widget.clearContents()
-    self.widget.setColumnCount(2)
-    self.widget.setHorizontalHeaderLabels(['Tag','Value'])
-    self.widget.setColumnWidth(0,100)
-    self.widget.setColumnWidth(1,200)
-
-    if not file:
-      return
-
-    slicer.dicomDatabase.loadFileHeader(file)
-    keys = slicer.dicomDatabase.headerKeys()
-    self.widget.setRowCount(len(keys))
-    row = 0
-    for key in keys:
-      item = qt.QTableWidgetItem(key)
-      self.widget.setItem(row,0,item)
-      self.items.append(item)
-      dump = slicer.dicomDatabase.headerValue(key)
-      try:
-        value = dump[dump.index('[')+1:dump.index(']')]
-      except ValueError:
-        value = "Unknown"
-      item = qt.QTableWidgetItem(value)
-      self.widget.setItem(row,1,item)
-      self.items.append(item)
-      row += 1
+    if file:
+      self.model.setHeader(DICOMHeader.forFile(file))
+    else:
+      self.model.setHeader(None)
+    self.view.setColumnWidth(0,100)
+    self.view.setColumnWidth(1,200)
 
 class DICOMRecentActivityWidget(object):
   """Display the recent activity of the slicer DICOM database
@@ -721,6 +867,7 @@ class DICOMRecentActivityWidget(object):
     self.tags = {}
     self.tags['seriesDescription'] = "0008,103e"
     self.tags['patientName'] = "0010,0010"
+    self.resetRecentSeries()
 
   class seriesWithTime(object):
     """helper class to track series and time..."""
@@ -736,14 +883,139 @@ class DICOMRecentActivityWidget(object):
     else:
       return -1
 
+  # series inserted longer ago are not listed
+  recentDays = 30
+
+  def resetRecentSeries(self):
+    """Forget the cached series, the next update queries them all"""
+    # series uid -> (insert timestamp, patient name, series description)
+    self.seriesCache = {}
+    # latest insert timestamp seen so far
+    self.lastInsertTimestamp = None
+    self.cachedDatabasePath = None
+
+  def databasePath(self):
+    try:
+      databasePath = self.dicomDatabase.databaseFilename
+    except AttributeError:
+      return None
+    if not databasePath or not os.path.exists(databasePath):
+      return None
+    return databasePath
+
+  def connectDatabase(self,databasePath):
+    """Read only connection to the database file of ctkDICOMDatabase,
+    its schema belongs to ctk so nothing is written through it"""
+    import sqlite3
+    connection = sqlite3.connect(databasePath)
+    # ignored by sqlite before 3.8, the queries only read anyway
+    connection.execute("PRAGMA query_only = 1")
+    return connection
+
+  def queryRecentInserts(self,databasePath,since):
+    """Return (series uid, first insert timestamp, an instance uid) for
+    the series with instances inserted at or after the since timestamp"""
+    connection = self.connectDatabase(databasePath)
+    try:
+      return connection.execute("SELECT SeriesInstanceUID, MIN(InsertTimestamp), SOPInstanceUID FROM Images "
+                                "WHERE InsertTimestamp >= ? GROUP BY SeriesInstanceUID", (since,)).fetchall()
+    finally:
+      connection.close()
+
+  def existingSeries(self,databasePath,seriesUIDs):
+    """Return the subset of the series uids still in the database"""
+    existing = set()
+    seriesUIDs = list(seriesUIDs)
+    connection = self.connectDatabase(databasePath)
+    try:
+      for start in xrange(0, len(seriesUIDs), 400):
+        chunk = seriesUIDs[start:start+400]
+        query = "SELECT DISTINCT SeriesInstanceUID FROM Images WHERE SeriesInstanceUID IN (%s)" % ",".join("?" * len(chunk))
+        existing.update([row[0] for row in connection.execute(query, chunk)])
+    finally:
+      connection.close()
+    return existing
+
+  def updateSeriesCache(self,now):
+    """Add the series inserted since the last update to the cache and
+    drop the ones that are too old or no longer in the database.
+    Returns False if the database cannot be queried directly"""
+    import sqlite3
+    databasePath = self.databasePath()
+    if not databasePath:
+      return False
+    if databasePath != self.cachedDatabasePath:
+      self.resetRecentSeries()
+      self.cachedDatabasePath = databasePath
+    cutoff = str(now.addDays(-self.recentDays).toString(qt.Qt.ISODate))
+    since = max(self.lastInsertTimestamp, cutoff) if self.lastInsertTimestamp else cutoff
+    try:
+      inserts = self.queryRecentInserts(databasePath, since)
+      for series, timestamp, instance in inserts:
+        if self.seriesCache.has_key(series):
+          cached = self.seriesCache[series]
+          if timestamp < cached[0]:
+            self.seriesCache[series] = (timestamp,) + cached[1:]
+          continue
+        try:
+          patientName = self.dicomDatabase.instanceValue(instance,self.tags['patientName'])
+        except RuntimeError:
+          # this indicates that the particular instance is no longer
+          # accessible to the dicom database, so we should ignore it here
+          continue
+        seriesDescription = self.dicomDatabase.instanceValue(instance,self.tags['seriesDescription'])
+        self.seriesCache[series] = (timestamp, patientName, seriesDescription)
+      for series, timestamp, instance in inserts:
+        if self.lastInsertTimestamp is None or timestamp > self.lastInsertTimestamp:
+          self.lastInsertTimestamp = timestamp
+      existing = self.existingSeries(databasePath, self.seriesCache.keys())
+    except sqlite3.Error as e:
+      print("Could not query recent DICOM inserts: %s" % e)
+      self.resetRecentSeries()
+      return False
+    for series in self.seriesCache.keys():
+      if series not in existing or self.seriesCache[series][0] < cutoff:
+        del self.seriesCache[series]
+    return True
+
+  def timeNote(self,elapsed):
+    secondsPerHour = 60 * 60
+    secondsPerDay = secondsPerHour * 24
+    if elapsed < secondsPerDay:
+      return 'Today'
+    elif elapsed < 7 * secondsPerDay:
+      return 'Past Week'
+    elif elapsed < self.recentDays * secondsPerDay:
+      return 'Past Month'
+    return None
+
   def recentSeriesList(self):
     """Return a list of series sorted by insert time
     (counting backwards from today)
     Assume that first insert time of series is valid
     for entire series (should be close enough for this purpose)
+    Only the series inserted since the previous call are looked up
+    in the database, the others come from a cache
     """
-    recentSeries = []
     now = qt.QDateTime.currentDateTime()
+    if not self.updateSeriesCache(now):
+      return self.scanRecentSeries(now)
+    recentSeries = []
+    for series, (timestamp, patientName, seriesDescription) in self.seriesCache.items():
+      seriesTime = qt.QDateTime.fromString(timestamp, qt.Qt.ISODate)
+      elapsed = seriesTime.secsTo(now)
+      timeNote = self.timeNote(elapsed)
+      if timeNote:
+        text = "%s: %s for %s" % (timeNote, seriesDescription, patientName)
+        recentSeries.append( self.seriesWithTime(series, elapsed, seriesTime, text) )
+    recentSeries.sort(self.compareSeriesTimes)
+    return recentSeries
+
+  def scanRecentSeries(self,now):
+    """Find the recent series by looking at every series of the
+    database, used when the database cannot be queried directly
+    """
+    recentSeries = []
     for patient in self.dicomDatabase.patients():
       for study in self.dicomDatabase.studiesForPatient(patient):
         for series in self.dicomDatabase.seriesForStudy(study):
@@ -751,6 +1023,10 @@ class DICOMRecentActivityWidget(object):
           if len(files) > 0:
             instance = self.dicomDatabase.instanceForFile(files[0])
             seriesTime = self.dicomDatabase.insertDateTimeForInstance(instance)
+            elapsed = seriesTime.secsTo(now)
+            timeNote = self.timeNote(elapsed)
+            if not timeNote:
+              continue
             try:
               patientName = self.dicomDatabase.instanceValue(instance,self.tags['patientName'])
             except RuntimeError:
@@ -758,23 +1034,11 @@ class DICOMRecentActivityWidget(object):
               # accessible to the dicom database, so we should ignore it here
               continue
             seriesDescription = self.dicomDatabase.instanceValue(instance,self.tags['seriesDescription'])
-            elapsed = seriesTime.secsTo(now)
-            secondsPerHour = 60 * 60
-            secondsPerDay = secondsPerHour * 24
-            timeNote = None
-            if elapsed < secondsPerDay:
-              timeNote = 'Today'
-            elif elapsed < 7 * secondsPerDay:
-              timeNote = 'Past Week'
-            elif elapsed < 30 * 7 * secondsPerDay:
-              timeNote = 'Past Month'
-            if timeNote:
-              text = "%s: %s for %s" % (timeNote, seriesDescription, patientName)
-              recentSeries.append( self.seriesWithTime(series, elapsed, seriesTime, text) )
+            text = "%s: %s for %s" % (timeNote, seriesDescription, patientName)
+            recentSeries.append( self.seriesWithTime(series, elapsed, seriesTime, text) )
     recentSeries.sort(self.compareSeriesTimes)
     return recentSeries
 
-
   def update(self):
     """Load the table widget with header values for the file
     """
@@ -904,6 +1168,10 @@ class DICOMSendDialog(object):
   """Implement the Qt dialog for doing a DICOM Send (storage SCU)
   """
 
+  # files are sent in batches over a few parallel associations
+  filesPerAssociation = 100
+  associations = 4
+
   def __init__(self,files):
     self.files = files
     settings = qt.QSettings()
@@ -955,10 +1223,13 @@ class DICOMSendDialog(object):
     settings.setValue('DICOM.sendPort', port)
     self.progress = qt.QProgressDialog(slicer.util.mainWindow())
     self.progress.minimumDuration = 0
-    self.progress.setMaximum(len(self.files))
     self.progressValue = 0
     try:
-      DICOMLib.DICOMSender(self.files, address, port, progressCallback = self.onProgress)
+      sender = DICOMLib.DICOMSender(self.files, address, port, progressCallback = self.onProgress,
+                                    filesPerAssociation = self.filesPerAssociation,
+                                    associations = self.associations, send = False)
+      self.progress.setMaximum(len(sender.batches()) + 1)
+      sender.send()
     except Exception as result:
       qt.QMessageBox.warning(self.dialog, 'DICOM Send', 'Could not send data: %s' % result)
     self.progress.close()
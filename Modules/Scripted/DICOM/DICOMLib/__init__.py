@@ -2,3 +2,7 @@ from DICOMProcesses import *
 from DICOMDataExchange import *
 from DICOMWidgets import *
 from DICOMPlugin import *
+from DICOMTagTable import *
+from DICOMLoadableCache import *
+from DICOMExamineScheduler import *
+from DICOMSliceGeometry import *
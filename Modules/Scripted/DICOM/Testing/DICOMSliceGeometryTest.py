@@ -0,0 +1,109 @@
+import math
+import unittest
+import numpy
+import DICOMLib
+
+class DICOMSliceGeometryTesting(unittest.TestCase):
+
+  axial = '1\\0\\0\\0\\1\\0'
+
+  def runTest(self):
+    self.test_Sorting()
+    self.test_Gaps()
+    self.test_Duplicates()
+    self.test_GantryTilt()
+    self.test_MissingGeometry()
+
+  def positions(self,points):
+    """DICOM strings of the points, rounded like scanners write them"""
+    return ['%.4f\\%.4f\\%.4f' % tuple(point) for point in points]
+
+  def stack(self,distances,origin=(-120.,-130.,40.)):
+    """Positions of axial images at the given distances"""
+    return self.positions([(origin[0], origin[1], origin[2] + distance) for distance in distances])
+
+  def geometry(self,positions,orientations=None):
+    if orientations is None:
+      orientations = [self.axial] * len(positions)
+    return DICOMLib.DICOMSliceGeometry(positions, orientations)
+
+  def test_Sorting(self):
+    """Shuffled images are sorted along the scan axis and the
+    regular spacing is recognized"""
+    distances = [4., 0., 10., 2., 8., 6.]
+    files = ['file%d' % distance for distance in distances]
+    geometry = self.geometry(self.stack(distances))
+    self.assertFalse(geometry.missingGeometry)
+    self.assertEqual(list(geometry.order), [1, 3, 0, 5, 4, 2])
+    self.assertEqual(geometry.sortedItems(files), ['file0', 'file2', 'file4', 'file6', 'file8', 'file10'])
+    # distances are measured from the first image of the list
+    self.assertTrue(numpy.allclose(geometry.distances, [-4., -2., 0., 2., 4., 6.]))
+    self.assertAlmostEqual(geometry.spacing, 2.)
+    self.assertTrue(geometry.isRegular())
+    self.assertEqual(geometry.uniqueSpacings.size, 1)
+    self.assertEqual(geometry.gaps, [])
+    self.assertEqual(geometry.gantryTilt, 0.)
+    self.assertFalse(geometry.orientationsDiffer)
+
+    # a descending stack is sorted the same way
+    geometry = self.geometry(self.stack([0., -2., -4.]))
+    self.assertEqual(list(geometry.order), [2, 1, 0])
+    self.assertAlmostEqual(geometry.spacing, 2.)
+
+  def test_Gaps(self):
+    """Missing images show as gaps with the number of images missing"""
+    geometry = self.geometry(self.stack([0., 1., 2., 5., 6., 8., 9.]))
+    self.assertFalse(geometry.isRegular())
+    self.assertEqual(geometry.gaps, [(2, 2), (4, 1)])
+    self.assertEqual(list(geometry.irregularSpacings), [2, 4])
+    self.assertTrue(numpy.allclose(geometry.uniqueSpacings, [1., 2., 3.]))
+    self.assertEqual(geometry.duplicatePositions.size, 0)
+    self.assertTrue('3 missing images in 2 gaps' in geometry.summary())
+
+  def test_Duplicates(self):
+    """Images at the same position are reported, and sorting keeps
+    their original order"""
+    geometry = self.geometry(self.stack([0., 1., 1., 2., 3.]))
+    self.assertEqual(list(geometry.order), [0, 1, 2, 3, 4])
+    self.assertEqual(list(geometry.duplicatePositions), [1])
+    self.assertEqual(list(geometry.irregularSpacings), [1])
+    self.assertEqual(geometry.gaps, [])
+    self.assertTrue('1 duplicate positions' in geometry.summary())
+
+  def test_GantryTilt(self):
+    """A tilted stack is reported with its angle, rounding of the
+    positions on a long series is not"""
+    # 400 images with positions drifting by the rounding of the last digit
+    drift = 0.0001 * numpy.arange(400) / 2
+    points = [(-120. + d, -130. + d, 40. + 0.625 * k) for k, d in enumerate(drift)]
+    geometry = self.geometry(self.positions(points))
+    self.assertEqual(geometry.gantryTilt, 0.)
+    self.assertTrue(geometry.isRegular())
+
+    # positions moving by tan(15 degrees) across the scan axis
+    angle = 15.
+    shift = math.tan(math.radians(angle))
+    points = [(-120., -130. + shift * 2. * k, 40. + 2. * k) for k in range(20)]
+    geometry = self.geometry(self.positions(points))
+    self.assertAlmostEqual(geometry.gantryTilt, angle, 2)
+    self.assertTrue(geometry.isRegular())
+    self.assertTrue('Gantry tilt' in geometry.summary())
+
+    # the tolerance is an angle
+    points = [(-120., -130. + 0.005 * k, 40. + 5. * k) for k in range(3)]
+    self.assertEqual(self.geometry(self.positions(points)).gantryTilt, 0.)
+    geometry = DICOMLib.DICOMSliceGeometry(self.positions(points), [self.axial] * 3, tiltTolerance=0.01)
+    self.assertAlmostEqual(geometry.gantryTilt, math.degrees(math.atan(0.001)), 4)
+
+  def test_MissingGeometry(self):
+    """Missing or unreadable values, and differing orientations"""
+    positions = self.stack([0., 1., 2.])
+    self.assertTrue(self.geometry([positions[0], None, positions[2]]).missingGeometry)
+    self.assertTrue(self.geometry([positions[0], '1\\2', positions[2]]).missingGeometry)
+    self.assertTrue(self.geometry(positions, [None] * 3).missingGeometry)
+    self.assertEqual(self.geometry(positions, [None] * 3).summary(), "Missing geometry information")
+    self.assertTrue(self.geometry([]).missingGeometry)
+
+    geometry = self.geometry(positions, [self.axial, None, '1\\0\\0\\0\\0.9\\0.1'])
+    self.assertFalse(geometry.missingGeometry)
+    self.assertTrue(geometry.orientationsDiffer)
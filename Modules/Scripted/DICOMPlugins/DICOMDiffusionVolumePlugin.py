@@ -52,6 +52,7 @@ class DICOMDiffusionVolumePluginClass(DICOMPlugin):
         self.tags[tagIndex] = tag
         tagIndex += 1
     self.tags['seriesDescription'] = "0008,103e"
+    self.examinesSeriesIndependently = True
 
   def examine(self,fileLists):
     """ Returns a list of DICOMLoadable instances
@@ -79,16 +80,18 @@ class DICOMDiffusionVolumePluginClass(DICOMPlugin):
     """
 
     # get the series description to use as base for volume name
-    name = slicer.dicomDatabase.fileValue(files[0], self.tags['seriesDescription'])
+    tagTable = self.tagTable(files[:1])
+    name = tagTable.value(files[0], 'seriesDescription')
     if name == "":
       name = "Unknown"
 
     validDWI = False
     vendorName = ""
+    tagNames = dict([(tag, name) for name, tag in self.tags.items()])
     for vendor in self.diffusionTags:
       matchesVendor = True
       for tag in self.diffusionTags[vendor]:
-        value = slicer.dicomDatabase.fileValue(files[0], tag)
+        value = tagTable.value(files[0], tagNames[tag])
         hasTag = value != ""
         matchesVendor &= hasTag
       if matchesVendor:
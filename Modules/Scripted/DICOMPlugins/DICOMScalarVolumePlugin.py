@@ -1,5 +1,7 @@
 import os
+import numpy
 from __main__ import vtk, qt, ctk, slicer
+import DICOMLib
 from DICOMLib import DICOMPlugin
 from DICOMLib import DICOMLoadable
 
@@ -30,6 +32,7 @@ class DICOMScalarVolumePluginClass(DICOMPlugin):
     self.tags['imageOrientationPatient'] = "0020,0037"
     self.tags['numberOfFrames'] = "0028,0008"
     self.tags['instanceUID'] = "0008,0018"
+    self.examinesSeriesIndependently = True
 
 
   def examine(self,fileLists):
@@ -58,11 +61,14 @@ class DICOMScalarVolumePluginClass(DICOMPlugin):
     files parameter.
     """
 
+    # all the tag values of the series are fetched at once
+    tagTable = self.tagTable(files)
+
     # get the series description to use as base for volume name
-    name = slicer.dicomDatabase.fileValue(files[0],self.tags['seriesDescription'])
+    name = tagTable.value(files[0],'seriesDescription')
     if name == "":
       name = "Unknown"
-    num = slicer.dicomDatabase.fileValue(files[0],self.tags['seriesNumber'])
+    num = tagTable.value(files[0],'seriesNumber')
     if num != "":
       name = num + ": " + name
 
@@ -100,18 +106,19 @@ class DICOMScalarVolumePluginClass(DICOMPlugin):
     subseriesFiles = {}
     subseriesValues = {}
     for file in loadable.files:
+      self.checkCanceled()
 
       # save position and orientation
-      positions[file] = slicer.dicomDatabase.fileValue(file,self.tags['position'])
+      positions[file] = tagTable.value(file,'position')
       if positions[file] == "":
         positions[file] = None
-      orientations[file] = slicer.dicomDatabase.fileValue(file,self.tags['orientation'])
+      orientations[file] = tagTable.value(file,'orientation')
       if orientations[file] == "":
         orientations[file] = None
 
       # check for subseries values
       for tag in subseriesTags:
-        value = slicer.dicomDatabase.fileValue(file,self.tags[tag])
+        value = tagTable.value(file,tag)
         if not subseriesValues.has_key(tag):
           subseriesValues[tag] = []
         if not subseriesValues[tag].__contains__(value):
@@ -145,7 +152,7 @@ class DICOMScalarVolumePluginClass(DICOMPlugin):
     for loadable in loadables:
       newFiles = []
       for file in loadable.files:
-        if slicer.dicomDatabase.fileValue(file,self.tags['pixelData'])!='':
+        if tagTable.value(file,'pixelData')!='':
           newFiles.append(file)
       if len(newFiles) > 0:
         loadable.files = newFiles
@@ -164,92 +171,60 @@ class DICOMScalarVolumePluginClass(DICOMPlugin):
     # by position and check for consistency
     #
 
-    # TODO: more consistency checks:
-    # - is there gantry tilt?
-    # - are the orientations the same for all slices?
     for loadable in loadables:
       #
       # use the first file to get the ImageOrientationPatient for the
       # series and calculate the scan direction (assumed to be perpendicular
       # to the acquisition plane)
       #
-      value = slicer.dicomDatabase.fileValue(loadable.files[0], self.tags['numberOfFrames'])
+      value = tagTable.value(loadable.files[0],'numberOfFrames')
       if value != "":
         loadable.warning = "Multi-frame image. If slice orientation or spacing is non-uniform then the image may be displayed incorrectly. Use with caution."
 
       validGeometry = True
-      ref = {}
-      for tag in [self.tags['position'], self.tags['orientation']]:
-        value = slicer.dicomDatabase.fileValue(loadable.files[0], tag)
+      for tag in ['position', 'orientation']:
+        value = tagTable.value(loadable.files[0], tag)
         if not value or value == "":
           loadable.warning = "Reference image in series does not contain geometry information.  Please use caution."
           validGeometry = False
           loadable.confidence = 0.2
           break
-        ref[tag] = value
 
       if not validGeometry:
         continue
 
-      # get the geometry of the scan
-      # with respect to an arbitrary slice
-      sliceAxes = [float(zz) for zz in ref[self.tags['orientation']].split('\\')]
-      x = sliceAxes[:3]
-      y = sliceAxes[3:]
-      scanAxis = self.cross(x,y)
-      scanOrigin = [float(zz) for zz in ref[self.tags['position']].split('\\')]
-
       #
-      # for each file in series, calculate the distance along
-      # the scan axis, sort files by this
+      # sort the files by their distance along the scan axis
+      # and check the consistency of the slices
       #
-      sortList = []
-      missingGeometry = False
-      for file in loadable.files:
-        if not positions[file]:
-          missingGeometry = True
-          break
-        position = [float(zz) for zz in positions[file].split('\\')]
-        vec = self.difference(position, scanOrigin)
-        dist = self.dot(vec, scanAxis)
-        sortList.append((file, dist))
-
-      if missingGeometry:
+      geometry = DICOMLib.DICOMSliceGeometry([positions[file] for file in loadable.files],
+                                             [orientations[file] for file in loadable.files],
+                                             epsilon=self.epsilon)
+      if geometry.missingGeometry:
         loadable.warning = "One or more images is missing geometry information"
-      else:
-        sortedFiles = sorted(sortList, key=lambda x: x[1])
-        distances = {}
-        loadable.files = []
-        for file,dist in sortedFiles:
-          loadable.files.append(file)
-          distances[file] = dist
-
-        #
-        # confirm equal spacing between slices
-        # - use variable 'epsilon' to determine the tolerance
-        #
-        spaceWarnings = 0
-        if len(loadable.files) > 1:
-          file0 = loadable.files[0]
-          file1 = loadable.files[1]
-          dist0 = distances[file0]
-          dist1 = distances[file1]
-          spacing0 = dist1 - dist0
-          n = 1
-          for fileN in loadable.files[1:]:
-            fileNminus1 = loadable.files[n-1]
-            distN = distances[fileN]
-            distNminus1 = distances[fileNminus1]
-            spacingN = distN - distNminus1
-            spaceError = spacingN - spacing0
-            if abs(spaceError) > self.epsilon:
-              spaceWarnings += 1
-              loadable.warning = "Images are not equally spaced (a difference of %g in spacings was detected).  Slicer will load this series as if it had a spacing of %g.  Please use caution." % (spaceError, spacing0)
-              break
-            n += 1
-
-        if spaceWarnings != 0:
-          print("Geometric issues were found with %d of the series.  Please use caution." % spaceWarnings)
+        continue
+
+      loadable.files = geometry.sortedItems(loadable.files)
+
+      #
+      # confirm equal spacing between slices
+      # - use variable 'epsilon' to determine the tolerance
+      #
+      warnings = []
+      if geometry.irregularSpacings.size:
+        spaceError = geometry.spacingErrors[geometry.irregularSpacings[0]]
+        warnings.append("Images are not equally spaced (a difference of %g in spacings was detected).  Slicer will load this series as if it had a spacing of %g.  Please use caution." % (spaceError, geometry.spacing))
+        if geometry.duplicatePositions.size:
+          warnings.append("%d images have the same position as another image." % geometry.duplicatePositions.size)
+        if geometry.gaps:
+          warnings.append("About %d images are missing in %d gaps." % (sum([gap[1] for gap in geometry.gaps]), len(geometry.gaps)))
+      if geometry.gantryTilt:
+        warnings.append("The images are tilted by %.3g degrees with respect to the scan axis (gantry tilt).  Slicer will load them without correction.  Please use caution." % geometry.gantryTilt)
+      if geometry.orientationsDiffer:
+        warnings.append("The images do not all have the same orientation.  Please use caution.")
+      if warnings:
+        loadable.warning = "  ".join(warnings)
+        print("Geometric issues were found with series %s:\n%s" % (loadable.name, geometry.summary()))
 
     return loadables
 
@@ -269,21 +244,6 @@ class DICOMScalarVolumePluginClass(DICOMPlugin):
     cmp = xNumber - yNumber
     return cmp
 
-  #
-  # math utilities for processing dicom volumes
-  # TODO: there must be good replacements for these
-  #
-  def cross(self, x, y):
-    return [x[1] * y[2] - x[2] * y[1],
-            x[2] * y[0] - x[0] * y[2],
-            x[0] * y[1] - x[1] * y[0]]
-
-  def difference(self, x, y):
-    return [x[0] - y[0], x[1] - y[1], x[2] - y[2]]
-
-  def dot(self, x, y):
-    return x[0] * y[0] + x[1] * y[1] + x[2] * y[2]
-
   def loadFilesWithArchetype(self,files,name):
     """Load files in the traditional Slicer manner
     using the volume logic helper class
@@ -296,10 +256,189 @@ class DICOMScalarVolumePluginClass(DICOMPlugin):
     volumesLogic = slicer.modules.volumes.logic()
     return(volumesLogic.AddArchetypeScalarVolume(files[0],name,0,fileList))
 
+  # transfer syntaxes of the pixel data the multi-frame path reads
+  # itself, with whether their VR is explicit
+  uncompressedTransferSyntaxes = {
+    '1.2.840.10008.1.2' : False,    # implicit VR little endian
+    '1.2.840.10008.1.2.1' : True,   # explicit VR little endian
+    }
+
+  def frameAttribute(self,dataset,frame,sequenceName,attributeName):
+    """Value of an attribute of a functional group of an enhanced
+    multi-frame dataset, from the per-frame groups of the frame or
+    else from the shared groups (None if it is in neither)"""
+    for groupsName, index in (('PerFrameFunctionalGroupsSequence',frame),('SharedFunctionalGroupsSequence',0)):
+      groups = getattr(dataset, groupsName, None)
+      if not groups or index >= len(groups):
+        continue
+      sequence = getattr(groups[index], sequenceName, None)
+      if sequence:
+        value = getattr(sequence[0], attributeName, None)
+        if value is not None:
+          return value
+    return None
+
+  def pixelDataOffset(self,fp,pixelBytes,explicitVR):
+    """Return the offset of the pixel data value in the open file,
+    which must be the last element of the file, or None"""
+    fp.seek(0, os.SEEK_END)
+    fileSize = fp.tell()
+    for padding in (0, 1):
+      offset = fileSize - pixelBytes - padding
+      headerSize = 12 if explicitVR else 8
+      if offset < headerSize:
+        continue
+      fp.seek(offset - headerSize)
+      header = numpy.fromstring(fp.read(headerSize), dtype=numpy.uint8)
+      tag = header[:4].tostring()
+      length = int(header[-4:].view('<u4')[0])
+      if tag == '\xe0\x7f\x10\x00' and length == pixelBytes + padding:
+        return offset
+    return None
+
+  def loadMultiFrame(self,loadable):
+    """Load an uncompressed enhanced multi-frame object: the per-frame
+    functional groups are read once with pydicom to sort the frames and
+    build the geometry, then the pixel data is read with one sequential
+    read into the buffer of the volume.  Returns None if the object
+    needs the archetype reader (pydicom not available, compressed or
+    unusual pixel data, frames that are not an evenly spaced stack).
+    """
+    try:
+      import dicom
+    except ImportError:
+      return None
+    path = loadable.files[0]
+    try:
+      dataset = dicom.read_file(path, stop_before_pixels=True)
+    except Exception as e:
+      print("Could not read %s as a multi-frame object: %s" % (path, e))
+      return None
+    transferSyntax = str(dataset.file_meta.get('TransferSyntaxUID', ''))
+    if not self.uncompressedTransferSyntaxes.has_key(transferSyntax):
+      return None
+    explicitVR = self.uncompressedTransferSyntaxes[transferSyntax]
+    if int(getattr(dataset, 'SamplesPerPixel', 1)) != 1:
+      return None
+    signed = int(getattr(dataset, 'PixelRepresentation', 0)) == 1
+    bitsAllocated = int(getattr(dataset, 'BitsAllocated', 0))
+    if bitsAllocated not in (8, 16, 32):
+      return None
+    dtype = numpy.dtype('<%s%d' % ('i' if signed else 'u', bitsAllocated / 8))
+    frames = int(getattr(dataset, 'NumberOfFrames', 1))
+    rows, columns = int(dataset.Rows), int(dataset.Columns)
+
+    #
+    # geometry of the frames, from the functional groups
+    #
+    positions = []
+    orientations = []
+    rescales = set()
+    for frame in xrange(frames):
+      position = self.frameAttribute(dataset, frame, 'PlanePositionSequence', 'ImagePositionPatient')
+      orientation = self.frameAttribute(dataset, frame, 'PlaneOrientationSequence', 'ImageOrientationPatient')
+      if position is None or orientation is None:
+        return None
+      positions.append('\\'.join([str(v) for v in position]))
+      orientations.append('\\'.join([str(v) for v in orientation]))
+      slope = self.frameAttribute(dataset, frame, 'PixelValueTransformationSequence', 'RescaleSlope')
+      intercept = self.frameAttribute(dataset, frame, 'PixelValueTransformationSequence', 'RescaleIntercept')
+      rescales.add((float(slope) if slope is not None else 1., float(intercept) if intercept is not None else 0.))
+    if len(rescales) != 1:
+      return None
+    slope, intercept = rescales.pop()
+    pixelSpacing = self.frameAttribute(dataset, 0, 'PixelMeasuresSequence', 'PixelSpacing')
+    if not pixelSpacing:
+      return None
+    geometry = DICOMLib.DICOMSliceGeometry(positions, orientations, epsilon=self.epsilon)
+    if (geometry.missingGeometry or geometry.irregularSpacings.size or geometry.duplicatePositions.size
+        or geometry.orientationsDiffer or geometry.gantryTilt):
+      return None
+    if geometry.spacing is not None:
+      sliceSpacing = geometry.spacing
+    else:
+      thickness = self.frameAttribute(dataset, 0, 'PixelMeasuresSequence', 'SliceThickness')
+      sliceSpacing = float(thickness) if thickness else 1.
+
+    #
+    # the volume buffer, in the type the rescaled values need
+    #
+    rescaled = slope != 1. or intercept != 0.
+    if not rescaled:
+      outputType = dtype
+    elif slope == int(slope) and intercept == int(intercept):
+      bounds = [v * slope + intercept for v in (numpy.iinfo(dtype).min, numpy.iinfo(dtype).max)]
+      if numpy.iinfo(numpy.int16).min <= min(bounds) and max(bounds) <= numpy.iinfo(numpy.int16).max:
+        outputType = numpy.dtype(numpy.int16)
+      else:
+        outputType = numpy.dtype(numpy.int32)
+    else:
+      outputType = numpy.dtype(numpy.float32)
+    import vtk.util.numpy_support
+    imageData = vtk.vtkImageData()
+    imageData.SetDimensions(columns, rows, frames)
+    vtkType = vtk.util.numpy_support.get_vtk_array_type(outputType)
+    if vtk.VTK_MAJOR_VERSION <= 5:
+      imageData.SetScalarType(vtkType)
+      imageData.AllocateScalars()
+    else:
+      imageData.AllocateScalars(vtkType, 1)
+    volumeArray = vtk.util.numpy_support.vtk_to_numpy(imageData.GetPointData().GetScalars()).reshape(frames, rows, columns)
+
+    #
+    # read the frames in file order, then sort them
+    #
+    pixelBytes = frames * rows * columns * dtype.itemsize
+    fp = open(path, 'rb')
+    try:
+      offset = self.pixelDataOffset(fp, pixelBytes, explicitVR)
+      if offset is None:
+        return None
+      fp.seek(offset)
+      if rescaled:
+        frameArray = numpy.empty((frames, rows, columns), dtype=dtype)
+      else:
+        frameArray = volumeArray
+      if fp.readinto(frameArray) != pixelBytes:
+        return None
+    finally:
+      fp.close()
+    if rescaled:
+      volumeArray[:] = frameArray[geometry.order] * slope + intercept
+    elif (geometry.order != numpy.arange(frames)).any():
+      volumeArray[:] = frameArray[geometry.order]
+
+    #
+    # the volume node, with the geometry converted from LPS to RAS
+    #
+    lpsToRAS = numpy.array([-1., -1., 1.])
+    orientation = geometry.orientations[0]
+    volumeNode = slicer.vtkMRMLScalarVolumeNode()
+    volumeNode.SetName(slicer.mrmlScene.GetUniqueNameByString(slicer.util.unicodeify(loadable.name)))
+    volumeNode.SetIToRASDirection(*(orientation[:3] * lpsToRAS))
+    volumeNode.SetJToRASDirection(*(orientation[3:] * lpsToRAS))
+    volumeNode.SetKToRASDirection(*(geometry.scanAxis * lpsToRAS))
+    volumeNode.SetSpacing(float(pixelSpacing[1]), float(pixelSpacing[0]), sliceSpacing)
+    volumeNode.SetOrigin(*(geometry.positions[geometry.order[0]] * lpsToRAS))
+    volumeNode.SetAndObserveImageData(imageData)
+    displayNode = slicer.vtkMRMLScalarVolumeDisplayNode()
+    displayNode.SetAutoWindowLevel(1)
+    slicer.mrmlScene.AddNode(displayNode)
+    displayNode.SetAndObserveColorNodeID('vtkMRMLColorTableNodeGrey')
+    slicer.mrmlScene.AddNode(volumeNode)
+    volumeNode.SetAndObserveDisplayNodeID(displayNode.GetID())
+    return volumeNode
+
   def load(self,loadable):
     """Load the select as a scalar volume
     """
-    volumeNode = self.loadFilesWithArchetype(loadable.files, loadable.name)
+    volumeNode = None
+    if len(loadable.files) == 1:
+      frames = self.tagTable(loadable.files).value(loadable.files[0],'numberOfFrames')
+      if frames != "" and int(frames) > 1:
+        volumeNode = self.loadMultiFrame(loadable)
+    if not volumeNode:
+      volumeNode = self.loadFilesWithArchetype(loadable.files, loadable.name)
 
     if volumeNode:
       #
@@ -312,8 +451,9 @@ class DICOMScalarVolumePluginClass(DICOMPlugin):
       # corresponding to the loaded files
       #
       instanceUIDs = ""
+      tagTable = self.tagTable(loadable.files)
       for file in loadable.files:
-        uid = slicer.dicomDatabase.fileValue(file,self.tags['instanceUID'])
+        uid = tagTable.value(file,'instanceUID')
         if uid == "":
           uid = "Unknown"
         instanceUIDs += uid + " "
@@ -20,6 +20,9 @@ class DICOMSlicerDataBundlePluginClass(DICOMPlugin):
     self.tags['candygram'] = "cadb,0010"
     self.tags['zipSize'] = "cadb,1008"
     self.tags['zipData'] = "cadb,1010"
+    self.examinesSeriesIndependently = True
+    # the zip data itself is only needed for loading
+    self.examineTagNames = ['seriesDescription', 'candygram', 'zipSize']
 
   def examine(self,fileLists):
     """ Returns a list of DICOMLoadable instances
@@ -51,11 +54,12 @@ class DICOMSlicerDataBundlePluginClass(DICOMPlugin):
     loadables = []
     if len(files) == 1:
       f = files[0]
+      tagTable = self.tagTable(files, self.examineTagNames)
       # get the series description to use as base for volume name
-      name = slicer.dicomDatabase.fileValue(f, self.tags['seriesDescription'])
+      name = tagTable.value(f, 'seriesDescription')
       if name == "":
         name = "Unknown"
-      candygramValue = slicer.dicomDatabase.fileValue(f, self.tags['candygram'])
+      candygramValue = tagTable.value(f, 'candygram')
       if candygramValue:
         # default loadable includes all files for series
         loadable = DICOMLib.DICOMLoadable()
@@ -73,7 +77,7 @@ class DICOMSlicerDataBundlePluginClass(DICOMPlugin):
 
     f = loadable.files[0]
     try:
-      zipSize = int(slicer.dicomDatabase.fileValue(f, self.tags['zipSize']))
+      zipSize = int(self.tagTable([f], ['zipSize']).value(f, 'zipSize'))
     except ValueError:
       print("Could not get zipSize for %s" % f)
       return False
@@ -85,24 +89,100 @@ class DICOMSlicerDataBundlePluginClass(DICOMPlugin):
     # so we can seek from the end by the size of the zip data
     sceneDir = tempfile.mkdtemp('', 'sceneImport', slicer.app.temporaryPath)
     fp = open(f, 'rb')
-    fp.seek(-1 * (1+zipSize), os.SEEK_END)
-    zipData = fp.read(zipSize)
-    fp.close()
+    try:
+      fp.seek(0, os.SEEK_END)
+      zipOffset = fp.tell() - (1+zipSize)
+      zipData = FileRange(fp, zipOffset, zipSize)
+
+      # unpack the scene straight from the dicom file, one member
+      # at a time, without a copy of the zip in memory or on disk
+      try:
+        sceneFile = self.extractScene(zipData, sceneDir)
+      except (zipfile.BadZipfile, zipfile.LargeZipFile, NotImplementedError) as e:
+        print('could not extract the zip data (%s), saving it to a file' % e)
+        sceneFile = None
+      if sceneFile is None:
+        # let the application logic unpack a copy of the zip file
+        zipPath = os.path.join(sceneDir,'scene.zip')
+        zipData.copyTo(zipPath)
+        print('saved zip file to: %s' % zipPath)
+        appLogic = slicer.app.applicationLogic()
+        loaded = appLogic.OpenSlicerDataBundle(zipPath, sceneDir)
+        print ("loaded %s" % zipPath)
+        return loaded
+    finally:
+      fp.close()
+
+    # let the scene load it
+    slicer.mrmlScene.SetURL(sceneFile)
+    loaded = slicer.mrmlScene.Connect()
+    print ("loaded %s" % sceneFile)
 
-    # save to a temp zip file
-    zipPath = os.path.join(sceneDir,'scene.zip')
-    fp = open(zipPath,'wb')
-    fp.write(zipData)
-    fp.close()
+    return loaded != 0
 
-    print('saved zip file to: %s' % zipPath)
+  def extractScene(self,zipData,sceneDir):
+    """Extract the zip archive read from the file object zipData
+    into sceneDir and return the path of the mrml file it contains,
+    or None if there is none"""
+    archive = zipfile.ZipFile(zipData, 'r')
+    try:
+      archive.extractall(sceneDir)
+    finally:
+      archive.close()
+    for root, dirs, files in os.walk(sceneDir):
+      for name in sorted(files):
+        if name.endswith('.mrml'):
+          return os.path.join(root, name)
+    print('could not find mrml file in archive')
+    return None
 
-    # let the scene unpack it and load it
-    appLogic = slicer.app.applicationLogic()
-    sceneFile = appLogic.OpenSlicerDataBundle(zipPath, sceneDir)
-    print ("loaded %s" % sceneFile)
+#
+# FileRange
+#
 
-    return sceneFile != ""
+class FileRange(object):
+  """Read-only file object for a byte range of an open file,
+  so that the zip data can be read in place"""
+
+  def __init__(self,fp,offset,size):
+    self.fp = fp
+    self.offset = offset
+    self.size = size
+    self.position = 0
+
+  def seek(self,offset,whence=os.SEEK_SET):
+    if whence == os.SEEK_CUR:
+      offset += self.position
+    elif whence == os.SEEK_END:
+      offset += self.size
+    if offset < 0:
+      raise IOError('invalid seek offset')
+    self.position = offset
+
+  def tell(self):
+    return self.position
+
+  def read(self,size=-1):
+    remaining = max(self.size - self.position, 0)
+    if size is None or size < 0 or size > remaining:
+      size = remaining
+    self.fp.seek(self.offset + self.position)
+    data = self.fp.read(size)
+    self.position += len(data)
+    return data
+
+  def copyTo(self,path,chunkSize=16*1024*1024):
+    """Write the range to a new file, a chunk at a time"""
+    self.seek(0)
+    out = open(path, 'wb')
+    try:
+      while True:
+        data = self.read(chunkSize)
+        if not data:
+          break
+        out.write(data)
+    finally:
+      out.close()
 
 #
 # DICOMSlicerDataBundlePlugin
@@ -0,0 +1,165 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+import vtk
+import slicer
+import DICOMLib
+
+try:
+  import dicom
+  import dicom.dataset
+  import dicom.sequence
+except ImportError:
+  dicom = None
+
+class DICOMMultiFrameTesting(unittest.TestCase):
+
+  # sagittal frames, the scan axis is the cross product (-1,0,0)
+  orientation = [0., 1., 0., 0., 0., -1.]
+  pixelSpacing = [0.5, 0.8]
+  origin = numpy.array([30., -20., 10.])
+  # distances along the scan axis of the frames, in file order
+  distances = [4.5, 0., 6., 1.5, 3.]
+
+  def setUp(self):
+    slicer.mrmlScene.Clear(0)
+    self.tempDir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tempDir)
+
+  def runTest(self):
+    self.test_MultiFrame()
+    self.test_MultiFrameRescaled()
+
+  def item(self,**attributes):
+    item = dicom.dataset.Dataset()
+    for name, value in attributes.items():
+      setattr(item, name, value)
+    return item
+
+  def writeEnhancedMR(self,name,pixels,explicitVR=True,rescale=None):
+    """Write the frames in pixels (frames, rows, columns int16) as an
+    enhanced MR object, at the positions of self.distances"""
+    frames, rows, columns = pixels.shape
+    transferSyntax = '1.2.840.10008.1.2.1' if explicitVR else '1.2.840.10008.1.2'
+    sopClass = '1.2.840.10008.5.1.4.1.1.4.1'
+    meta = dicom.dataset.Dataset()
+    meta.MediaStorageSOPClassUID = sopClass
+    meta.MediaStorageSOPInstanceUID = '1.2.3.4.5.6.7'
+    meta.TransferSyntaxUID = transferSyntax
+    path = os.path.join(self.tempDir, name)
+    dataset = dicom.dataset.FileDataset(path, {}, file_meta=meta, preamble='\0' * 128)
+    dataset.is_little_endian = True
+    dataset.is_implicit_VR = not explicitVR
+    dataset.SOPClassUID = sopClass
+    dataset.SOPInstanceUID = '1.2.3.4.5.6.7'
+    dataset.Modality = 'MR'
+    dataset.NumberOfFrames = frames
+    dataset.Rows = rows
+    dataset.Columns = columns
+    dataset.SamplesPerPixel = 1
+    dataset.PhotometricInterpretation = 'MONOCHROME2'
+    dataset.BitsAllocated = 16
+    dataset.BitsStored = 16
+    dataset.HighBit = 15
+    dataset.PixelRepresentation = 1
+
+    shared = self.item(
+      PixelMeasuresSequence=dicom.sequence.Sequence([self.item(PixelSpacing=self.pixelSpacing, SliceThickness=1.5)]),
+      PlaneOrientationSequence=dicom.sequence.Sequence([self.item(ImageOrientationPatient=self.orientation)]))
+    if rescale:
+      shared.PixelValueTransformationSequence = dicom.sequence.Sequence([
+        self.item(RescaleSlope=rescale[0], RescaleIntercept=rescale[1], RescaleType='US')])
+    dataset.SharedFunctionalGroupsSequence = dicom.sequence.Sequence([shared])
+    scanAxis = numpy.cross(self.orientation[:3], self.orientation[3:])
+    perFrame = []
+    for distance in self.distances:
+      position = [float(v) for v in self.origin + distance * scanAxis]
+      perFrame.append(self.item(PlanePositionSequence=dicom.sequence.Sequence([self.item(ImagePositionPatient=position)])))
+    dataset.PerFrameFunctionalGroupsSequence = dicom.sequence.Sequence(perFrame)
+    dataset.add_new(0x7fe00010, 'OW', pixels.astype('<i2').tostring())
+    dataset.save_as(path)
+    return path
+
+  def framePixels(self,rows=3,columns=4):
+    """Frames whose values encode the row, the column and the sorted
+    position of the frame"""
+    order = numpy.argsort(self.distances)
+    rank = numpy.empty(len(order), dtype=int)
+    rank[order] = numpy.arange(len(order))
+    pixels = numpy.empty((len(self.distances), rows, columns), dtype=numpy.int16)
+    for frame in xrange(len(self.distances)):
+      pixels[frame] = 100 * rank[frame] + numpy.arange(rows * columns).reshape(rows, columns)
+    return pixels[order], pixels
+
+  def loadMultiFrame(self,path):
+    loadable = DICOMLib.DICOMLoadable()
+    loadable.files = [path]
+    loadable.name = os.path.basename(path)
+    plugin = slicer.modules.dicomPlugins['DICOMScalarVolumePlugin']()
+    return plugin.loadMultiFrame(loadable)
+
+  def volumeArray(self,volumeNode):
+    import vtk.util.numpy_support
+    imageData = volumeNode.GetImageData()
+    shape = list(imageData.GetDimensions())
+    shape.reverse()
+    return vtk.util.numpy_support.vtk_to_numpy(imageData.GetPointData().GetScalars()).reshape(shape)
+
+  def checkIJKToRAS(self,volumeNode):
+    """The columns of IJKToRAS are the directions of the frames scaled
+    by the spacing, and the origin is the first sorted frame, in RAS"""
+    lpsToRAS = numpy.array([-1., -1., 1.])
+    rowDirection = numpy.array(self.orientation[:3])
+    columnDirection = numpy.array(self.orientation[3:])
+    scanAxis = numpy.cross(rowDirection, columnDirection)
+    spacing = sorted(self.distances)[1] - sorted(self.distances)[0]
+    expected = numpy.identity(4)
+    expected[:3,0] = rowDirection * lpsToRAS * self.pixelSpacing[1]
+    expected[:3,1] = columnDirection * lpsToRAS * self.pixelSpacing[0]
+    expected[:3,2] = scanAxis * lpsToRAS * spacing
+    expected[:3,3] = (self.origin + min(self.distances) * scanAxis) * lpsToRAS
+    matrix = vtk.vtkMatrix4x4()
+    volumeNode.GetIJKToRASMatrix(matrix)
+    ijkToRAS = numpy.array([[matrix.GetElement(row, column) for column in xrange(4)] for row in xrange(4)])
+    self.assertTrue(numpy.allclose(ijkToRAS, expected), "IJKToRAS\n%s\nexpected\n%s" % (ijkToRAS, expected))
+
+  def test_MultiFrame(self):
+    """An enhanced MR object with frames out of order is loaded
+    sorted, with its values and geometry"""
+    if dicom is None:
+      self.skipTest("pydicom is not available")
+    sortedPixels, pixels = self.framePixels()
+    for explicitVR in (True, False):
+      slicer.mrmlScene.Clear(0)
+      path = self.writeEnhancedMR('multiframe%d.dcm' % explicitVR, pixels, explicitVR=explicitVR)
+      volumeNode = self.loadMultiFrame(path)
+      self.assertTrue(volumeNode is not None)
+      self.assertEqual(volumeNode.GetImageData().GetDimensions(), (4, 3, 5))
+      array = self.volumeArray(volumeNode)
+      self.assertEqual(array.dtype, numpy.int16)
+      self.assertTrue((array == sortedPixels).all())
+      # frame k holds the k-th position along the scan axis
+      self.assertEqual(list(array[:,0,0]), [0, 100, 200, 300, 400])
+      self.checkIJKToRAS(volumeNode)
+
+  def test_MultiFrameRescaled(self):
+    """The rescale of the functional groups is applied to the values"""
+    if dicom is None:
+      self.skipTest("pydicom is not available")
+    sortedPixels, pixels = self.framePixels()
+    path = self.writeEnhancedMR('rescaled.dcm', pixels, rescale=(2, -1024))
+    volumeNode = self.loadMultiFrame(path)
+    self.assertTrue(volumeNode is not None)
+    array = self.volumeArray(volumeNode)
+    self.assertEqual(array.dtype, numpy.int32)
+    self.assertTrue((array == sortedPixels.astype(numpy.int32) * 2 - 1024).all())
+    self.checkIJKToRAS(volumeNode)
+
+    path = self.writeEnhancedMR('rescaledFloat.dcm', pixels, rescale=(0.5, 1.25))
+    array = self.volumeArray(self.loadMultiFrame(path))
+    self.assertEqual(array.dtype, numpy.float32)
+    self.assertTrue(numpy.allclose(array, sortedPixels * 0.5 + 1.25))
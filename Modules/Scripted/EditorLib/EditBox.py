@@ -413,6 +413,11 @@ class EditBox(object):
   def updateUndoRedoButtons(self):
     self.effectButtons["PreviousCheckPoint"].enabled = self.undoRedo.undoEnabled()
     self.effectButtons["NextCheckPoint"].enabled = self.undoRedo.redoEnabled()
+    # show the memory and time used by the checkpoints in the tool tips
+    self.undoRedo.updateMetrics()
+    summary = self.undoRedo.metrics.summary()
+    for effect in ("PreviousCheckPoint", "NextCheckPoint"):
+      self.effectButtons[effect].setToolTip("%s\n%s" % (EditBox.displayNames[effect], summary))
 
   def isFloatingMode(self):
     return self.mainFrame.parent() is None
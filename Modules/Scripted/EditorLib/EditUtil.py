@@ -18,6 +18,11 @@ comment = """
 
 class EditUtil(object):
 
+  # callables invoked as callback(volumeNode, extent) by
+  # markVolumeNodeAsModified (class level so that all the
+  # EditUtil instances share them)
+  volumeModifiedCallbacks = []
+
   def getParameterNode(self):
     """Get the Editor parameter node - a singleton in the scene"""
     node = self._findParameterNodeInScene()
@@ -182,7 +187,7 @@ class EditUtil(object):
       sliceCompositeNode.SetForegroundVolumeID(sliceCompositeNode.GetBackgroundVolumeID())
       sliceCompositeNode.SetBackgroundVolumeID(oldForeground)
 
-  def markVolumeNodeAsModified(self,volumeNode):
+  def markVolumeNodeAsModified(self,volumeNode,extent=None):
     """Mark all parts of a volume node as modified so that a correct
     render is triggered.  This includes setting the modified flag on the
     point data scalars so that the GetScalarRange method will return the
@@ -193,6 +198,10 @@ class EditUtil(object):
     via an editing operation.
     Note that this call will typically schedule a render operation to be
     performed the next time the event loop is idle.
+    When the edited region is known, pass its IJK extent
+    (iMin, iMax, jMin, jMax, kMin, kMax) so that the volume modified
+    callbacks can update incrementally; None means the whole volume
+    may have changed.
     """
     if vtk.VTK_MAJOR_VERSION > 5 and volumeNode.GetImageDataConnection():
       volumeNode.GetImageDataConnection().GetProducer().Update()
@@ -200,51 +209,180 @@ class EditUtil(object):
       volumeNode.GetImageData().GetPointData().GetScalars().Modified()
     volumeNode.GetImageData().Modified()
     volumeNode.Modified()
+    for callback in list(EditUtil.volumeModifiedCallbacks):
+      callback(volumeNode, extent)
+
+  def addVolumeModifiedCallback(self,callback):
+    """Call callback(volumeNode, extent) each time an edit is
+    reported through markVolumeNodeAsModified"""
+    if callback not in EditUtil.volumeModifiedCallbacks:
+      EditUtil.volumeModifiedCallbacks.append(callback)
+
+  def removeVolumeModifiedCallback(self,callback):
+    if callback in EditUtil.volumeModifiedCallbacks:
+      EditUtil.volumeModifiedCallbacks.remove(callback)
+
+  def extentOfPoints(self,points):
+    """Return the IJK extent (iMin, iMax, jMin, jMax, kMin, kMax)
+    enclosing a list of ijk points"""
+    extent = []
+    for d in xrange(3):
+      values = [p[d] for p in points]
+      extent += [min(values), max(values)]
+    return tuple(extent)
+
+  def unionExtent(self,extent1,extent2):
+    """Return the extent enclosing two extents, either can be None"""
+    if extent1 is None:
+      return extent2
+    if extent2 is None:
+      return extent1
+    extent = []
+    for d in xrange(3):
+      extent += [min(extent1[2*d], extent2[2*d]), max(extent1[2*d+1], extent2[2*d+1])]
+    return tuple(extent)
+
+
+class UndoRedoMetrics(object):
+  """Counters describing the memory and time used by an UndoRedo
+  instance.  The byte counts are refreshed by UndoRedo.updateMetrics,
+  the times and restore counts accumulate until reset.
+  """
+
+  def __init__(self):
+    self.reset()
+
+  def reset(self):
+    # number of checkpoints stored and the time spent finding their
+    # changed extent and compressing them (in the background)
+    self.checkPoints = 0
+    self.extentSeconds = 0.
+    self.compressSeconds = 0.
+    self.lastStashSeconds = 0.
+    # restores, and restores done before the checkpoint compression
+    # was finished (these use the uncompressed data, they don't wait)
+    self.restores = 0
+    self.restoresWhileStashing = 0
+    # bytes held by the undo and redo lists, their uncompressed size
+    # and the size of the shadow copies of the edited volumes
+    self.undoBytes = 0
+    self.redoBytes = 0
+    self.rawBytes = 0
+    self.shadowBytes = 0
+
+  def stashSecondsPerCheckPoint(self):
+    if self.checkPoints == 0:
+      return 0.
+    return (self.extentSeconds + self.compressSeconds) / self.checkPoints
+
+  def compressionRatio(self):
+    """Uncompressed over stored size of the checkpoints"""
+    storedBytes = self.undoBytes + self.redoBytes
+    if storedBytes == 0:
+      return 1.
+    return float(self.rawBytes) / storedBytes
+
+  def summary(self):
+    megaByte = 1024. * 1024.
+    return ("Undo: %.1f MB, redo: %.1f MB (%.1fx compressed), volume copies: %.1f MB\n"
+            "%d checkpoints, %.3f s per checkpoint, %d of %d restores before compression finished" %
+            (self.undoBytes / megaByte, self.redoBytes / megaByte, self.compressionRatio(),
+             self.shadowBytes / megaByte, self.checkPoints, self.stashSecondsPerCheckPoint(),
+             self.restoresWhileStashing, self.restores))
 
 
 class UndoRedo(object):
-  """ Code to manage a list of undo/redo volumes
-  stored in a compressed format using the vtkImageStash
-  class to compress label maps in a thread
+  """ Code to manage a list of undo/redo volumes.
+  Only the bounding box of the voxels changed by an edit is kept,
+  compressed in a background thread.  A copy of each edited label
+  volume as it was at the last checkpoint (the shadow) is compared
+  with the volume to find what an edit changed.  Checkpoints are
+  dropped, oldest first, to stay within undoSize entries and
+  memoryBudget bytes of stored checkpoints.
   """
 
   class checkPoint(object):
-    """Internal class to store one checkpoint
-    step consisting of the stashed data
-    and the volumeNode it corresponds to
+    """Internal class to store one checkpoint step: the content of
+    an IJK extent of the volumeNode before (undo) or after (redo) an
+    edit.  A checkpoint saved before an edit is pending until the
+    edit is over and its extent is known.  An extent of None with
+    no pending edit means nothing changed.
     """
-    def __init__(self,volumeNode, layoutName):
+    def __init__(self, volumeNode, layoutName, extent=None, array=None, pending=False,
+                 metrics=None, stashSeconds=0.):
       self.volumeNode = volumeNode
-      self.stashImage = vtk.vtkImageData()
-      self.stash = slicer.vtkImageStash()
-      self.stashImage.DeepCopy( volumeNode.GetImageData() )
-      self.stash.SetStashImage( self.stashImage )
-      self.stash.ThreadedStash()
       self.layoutName = layoutName
-
-    def restore(self):
-      """Unstash the volume but first check that the
-      stash operation is not still ongoing in the other thread.
-      TODO: the stash operation is determinisitic, so there's
-      no chance of a deadlock here, but it would still be better
-      to integrate the wait into the event queue to avoid locking
-      the interface.  In practice this would only happen if the user
-      clicks Undo while the thread is still executing, which is
-      unlikely.  And at worst this busy loop will consume two threads
-      (this one and the stashing one) for the time the stash takes to complete.
+      self.pending = pending
+      self.extent = extent
+      self.stored = None
+      self.thread = None
+      self.metrics = metrics
+      self.stashSeconds = stashSeconds
+      if metrics and not pending:
+        metrics.checkPoints += 1
+        metrics.extentSeconds += stashSeconds
+        metrics.lastStashSeconds = stashSeconds
+      if array is not None:
+        self.shape = array.shape
+        self.dtype = array.dtype
+        # stored is (compressed, data) so that it is replaced in one
+        # assignment when the compression thread is done
+        self.stored = (False, array.tostring())
+        import threading
+        self.thread = threading.Thread(target=self.compress)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def compress(self):
+      import time, zlib
+      startTime = time.time()
+      compressed, data = self.stored
+      if not compressed:
+        self.stored = (True, zlib.compress(data, 1))
+      seconds = time.time() - startTime
+      self.stashSeconds += seconds
+      if self.metrics:
+        self.metrics.compressSeconds += seconds
+        self.metrics.lastStashSeconds = self.stashSeconds
+
+    def compressing(self):
+      return self.stored is not None and not self.stored[0]
+
+    def content(self):
+      """Return the stored voxels, using the uncompressed data if
+      the compression is not finished (no waiting on the thread)
       """
-      while self.stash.GetStashing():
-        pass
-      self.stash.Unstash()
-      self.volumeNode.GetImageData().DeepCopy( self.stashImage )
-      EditUtil().markVolumeNodeAsModified(self.volumeNode)
-
-
-  def __init__(self,undoSize=100):
+      import numpy, zlib
+      compressed, data = self.stored
+      if compressed:
+        data = zlib.decompress(data)
+      return numpy.fromstring(data, dtype=self.dtype).reshape(self.shape)
+
+    def size(self, compressed=False):
+      """Bytes used by the stored voxels, once compressed
+      if requested (waits for the compression thread)"""
+      if self.stored is None:
+        return 0
+      if compressed and self.thread:
+        self.thread.join()
+      return len(self.stored[1])
+
+    def rawSize(self):
+      """Bytes of the uncompressed voxels"""
+      if self.stored is None:
+        return 0
+      return self.dtype.itemsize * reduce(lambda x,y: x*y, self.shape, 1)
+
+
+  def __init__(self,undoSize=100,memoryBudget=512*1024*1024):
     self.enabled = True
     self.undoSize = undoSize
+    self.memoryBudget = memoryBudget
     self.undoList = []
     self.redoList = []
+    # volume node ID -> (label array at the last checkpoint, scalars modified time)
+    self.shadows = {}
+    self.metrics = UndoRedoMetrics()
     self.editUtil = EditUtil()
     self.stateChangedCallback = self.defaultStateChangedCallback
 
@@ -262,56 +400,184 @@ class UndoRedo(object):
     """for managing undo/redo button state"""
     return self.enabled and self.redoList != []
 
-  def storeVolume(self, checkPointList, volumeNode, layoutName):
-    """ Internal helper function
-    Save a stashed copy of the given volume node into
-    the passed list (could be undo or redo list)
+  def labelArray(self, volumeNode):
+    """Numpy (k,j,i) view of the volume voxels"""
+    import vtk.util.numpy_support
+    imageData = volumeNode.GetImageData()
+    shape = list(imageData.GetDimensions())
+    shape.reverse()
+    return vtk.util.numpy_support.vtk_to_numpy(imageData.GetPointData().GetScalars()).reshape(shape)
+
+  def modifiedTime(self, volumeNode):
+    return volumeNode.GetImageData().GetPointData().GetScalars().GetMTime()
+
+  def changedExtent(self, array, shadow, slabThickness=16):
+    """Return the IJK extent of the voxels that differ between
+    two (k,j,i) arrays, or None if they are identical.  The arrays
+    are compared a slab at a time to keep the memory use low.
     """
-    if not self.enabled or not volumeNode or not volumeNode.GetImageData():
+    import numpy
+    ks = []
+    jChanged = numpy.zeros(array.shape[1], dtype=bool)
+    iChanged = numpy.zeros(array.shape[2], dtype=bool)
+    for k in xrange(0, array.shape[0], slabThickness):
+      changed = array[k:k+slabThickness] != shadow[k:k+slabThickness]
+      slices = changed.any(axis=2)
+      if not slices.any():
+        continue
+      ks += list(k + numpy.nonzero(slices.any(axis=1))[0])
+      jChanged |= slices.any(axis=0)
+      iChanged |= changed.any(axis=1).any(axis=0)
+    if ks == []:
+      return None
+    js = numpy.nonzero(jChanged)[0]
+    ins = numpy.nonzero(iChanged)[0]
+    return (int(ins[0]), int(ins[-1]), int(js[0]), int(js[-1]), int(ks[0]), int(ks[-1]))
+
+  def region(self, extent):
+    """Numpy slices of an IJK extent"""
+    return (slice(extent[4], extent[5]+1), slice(extent[2], extent[3]+1), slice(extent[0], extent[1]+1))
+
+  def synchronize(self, volumeNode):
+    """Bring the shadow of the volume up to date and return the
+    extent that changed since it was last synchronized together with
+    the previous content of that extent (None, None if unchanged).
+    A new or resized volume starts a new shadow and its history is
+    forgotten.
+    """
+    array = self.labelArray(volumeNode)
+    modifiedTime = self.modifiedTime(volumeNode)
+    shadow, shadowTime = self.shadows.get(volumeNode.GetID(), (None, None))
+    if shadow is None or shadow.shape != array.shape or shadow.dtype != array.dtype:
+      if shadow is not None:
+        self.forget(volumeNode)
+      self.shadows[volumeNode.GetID()] = (array.copy(), modifiedTime)
+      return None, None
+    if modifiedTime == shadowTime:
+      return None, None
+    extent = self.changedExtent(array, shadow)
+    previous = None
+    if extent:
+      region = self.region(extent)
+      previous = shadow[region].copy()
+      shadow[region] = array[region]
+    self.shadows[volumeNode.GetID()] = (shadow, modifiedTime)
+    return extent, previous
+
+  def forget(self, volumeNode):
+    """Remove the checkpoints of a volume"""
+    self.undoList = [c for c in self.undoList if c.volumeNode != volumeNode]
+    self.redoList = [c for c in self.redoList if c.volumeNode != volumeNode]
+
+  def finishPending(self):
+    """Turn the pending checkpoint on top of the undo list into the
+    extent changed by the edit since it was saved
+    """
+    if self.undoList == [] or not self.undoList[-1].pending:
       return
-    checkPointList.append( self.checkPoint(volumeNode, layoutName) )
-    self.stateChangedCallback()
-    if len(checkPointList) >= self.undoSize:
-      return( checkPointList[1:] )
-    else:
-      return( checkPointList )
+    import time
+    startTime = time.time()
+    pending = self.undoList[-1]
+    extent, previous = self.synchronize(pending.volumeNode)
+    if self.undoList != [] and self.undoList[-1] is pending:
+      self.undoList[-1] = self.checkPoint(pending.volumeNode, pending.layoutName, extent, previous,
+                                          metrics=self.metrics, stashSeconds=time.time() - startTime)
+
+  def storedSize(self, compressed=False):
+    """Bytes used by the stored checkpoints (the shadows not included)"""
+    return sum([c.size(compressed) for c in self.undoList + self.redoList])
+
+  def trim(self):
+    """Drop the oldest checkpoints beyond undoSize or memoryBudget
+    and the shadows of volumes without checkpoints
+    """
+    while len(self.undoList) >= self.undoSize:
+      self.undoList = self.undoList[1:]
+    # checkpoints still being compressed are only waited for
+    # when the budget seems to be exceeded
+    if self.storedSize() > self.memoryBudget:
+      while self.undoList != [] and self.storedSize(compressed=True) > self.memoryBudget:
+        self.undoList = self.undoList[1:]
+    nodeIDs = set([c.volumeNode.GetID() for c in self.undoList + self.redoList])
+    for nodeID in self.shadows.keys():
+      if nodeID not in nodeIDs:
+        del self.shadows[nodeID]
+
+  def updateMetrics(self):
+    """Refresh the byte counts of the metrics"""
+    self.metrics.undoBytes = sum([c.size() for c in self.undoList])
+    self.metrics.redoBytes = sum([c.size() for c in self.redoList])
+    self.metrics.rawBytes = sum([c.rawSize() for c in self.undoList + self.redoList])
+    self.metrics.shadowBytes = sum([shadow.nbytes for shadow, modifiedTime in self.shadows.values()])
+
+  def apply(self, checkPoint, checkPointList):
+    """Put the content of checkPoint back into its volume and append
+    to checkPointList the checkpoint that reverts it
+    """
+    volumeNode = checkPoint.volumeNode
+    if not volumeNode.GetImageData():
+      return
+    import time
+    self.synchronize(volumeNode)
+    self.metrics.restores += 1
+    reverse = self.checkPoint(volumeNode, checkPoint.layoutName)
+    if checkPoint.extent:
+      startTime = time.time()
+      array = self.labelArray(volumeNode)
+      shadow = self.shadows[volumeNode.GetID()][0]
+      region = self.region(checkPoint.extent)
+      if checkPoint.compressing():
+        self.metrics.restoresWhileStashing += 1
+      content = checkPoint.content()
+      if array[region].shape == content.shape:
+        current = array[region].copy()
+        reverse = self.checkPoint(volumeNode, checkPoint.layoutName, checkPoint.extent, current,
+                                  metrics=self.metrics, stashSeconds=time.time() - startTime)
+        array[region] = content
+        shadow[region] = content
+        self.editUtil.markVolumeNodeAsModified(volumeNode, checkPoint.extent)
+        self.shadows[volumeNode.GetID()] = (shadow, self.modifiedTime(volumeNode))
+    checkPointList.append(reverse)
 
   def saveState(self, layoutName = 'Red'):
     """Called by effects as they modify the label volume node
     """
-    # store current state onto undoList
-    self.undoList = self.storeVolume( self.undoList, self.editUtil.getLabelVolume(layoutName), layoutName )
+    volumeNode = self.editUtil.getLabelVolume(layoutName)
+    if not self.enabled or not volumeNode or not volumeNode.GetImageData():
+      return
+    self.finishPending()
+    # changes made without a checkpoint become part of the shadow
+    self.synchronize(volumeNode)
+    self.undoList.append(self.checkPoint(volumeNode, layoutName, pending=True))
     self.redoList = []
+    self.trim()
+    self.updateMetrics()
     self.stateChangedCallback()
 
   def undo(self):
     """Perform the operation when the user presses
     the undo button on the editor interface.
-    This pushes the current state onto the redoList and
-    removes a volume from the undoList.
+    This restores the extent changed by the last edit and
+    pushes its current content onto the redoList.
     """
     if self.undoList == []:
       return
-    # store current state onto redoList
-    layoutName = self.undoList[-1].layoutName
-    self.redoList = self.storeVolume( self.redoList, self.editUtil.getLabelVolume(layoutName), layoutName )
-    # get the checkPoint to restore and remove it from the list
-    self.undoList[-1].restore()
+    self.finishPending()
+    self.apply(self.undoList[-1], self.redoList)
     self.undoList = self.undoList[:-1]
+    self.updateMetrics()
     self.stateChangedCallback()
 
   def redo(self):
     """Perform the operation when the user presses
     the undo button on the editor interface.
-    This pushes the current state onto the undo stack
-    and restores the state from the redo stack
+    This restores the extent from the redo stack and
+    pushes its current content onto the undo stack
     """
     if self.redoList == []:
       return
-    # store current state onto undoList
-    layoutName = self.redoList[-1].layoutName
-    self.undoList = self.storeVolume( self.undoList, self.editUtil.getLabelVolume(layoutName), layoutName )
-    # get the checkPoint to restore and remove it from the list
-    self.redoList[-1].restore()
+    self.apply(self.redoList[-1], self.undoList)
     self.redoList = self.redoList[:-1]
+    self.trim()
+    self.updateMetrics()
     self.stateChangedCallback()
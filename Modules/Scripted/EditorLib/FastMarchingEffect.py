@@ -1,4 +1,5 @@
 import os
+import numpy
 from __main__ import vtk, qt, ctk, slicer
 import EditorLib
 from EditorLib.EditOptions import HelpButton
@@ -219,35 +220,40 @@ class FastMarchingEffectTool(Effect.EffectTool):
   def getVolumeNode(self):
     return self.sliceWidget.sliceLogic().GetLabelLayer().GetVolumeNode()
 #
-# FastMarchingEffectLogic
+# FastMarchingSession
 #
 
-class FastMarchingEffectLogic(Effect.EffectLogic):
+class FastMarchingSession(object):
   """
-  This class contains helper methods for a given effect
-  type.  It can be instanced as needed by an FastMarchingEffectTool
-  or FastMarchingEffectOptions instance in order to compute intermediate
-  results (say, for user feedback) or to implement the final
-  segmentation editing operation.  This class is split
-  from the FastMarchingEffectTool so that the operations can be used
-  by other code without the need for a view context.
+  The state of fast marching in one layout: the background
+  preprocessed for the filter (kept until the background changes)
+  and the voxels reached by the last march in order of arrival
+  time.  Showing a fraction of the march only adds or removes the
+  band of voxels between the previous and the new arrival rank.
   """
 
-  def __init__(self,sliceLogic):
-    super(FastMarchingEffectLogic,self).__init__(sliceLogic)
-    self.fm = {}
-
-  def fastMarching(self, percentMax, LayoutName):
-
-    self.fm.update({LayoutName : None})
-    # allocate a new filter each time March is hit
-    bgImage = self.editUtil.getBackgroundImage(LayoutName)
-    labelImage = self.editUtil.getLabelImage(LayoutName)
-
-    # collect seeds
-    dim = bgImage.GetWholeExtent()
-    # initialize the filter
-    tmpfm = slicer.vtkPichonFastMarching()
+  def __init__(self):
+    self.backgroundKey = None
+    self.preprocessedBackground = None
+    self.depth = 0
+    # result of the last march
+    self.labelNodeID = None
+    self.dimensions = None
+    self.label = 0
+    self.arrivalOrder = numpy.zeros(0, dtype=numpy.int64)
+    # rank of the last voxel shown, -1 for none
+    self.shown = -1
+
+  def preprocess(self, backgroundNode):
+    """
+    Return the background rescaled to a depth of at most 300 and
+    cast to short, as the filter needs, computing it only when the
+    background has changed since the last call.
+    """
+    bgImage = backgroundNode.GetImageData()
+    key = (backgroundNode.GetID(), bgImage.GetMTime(), bgImage.GetPointData().GetScalars().GetMTime())
+    if key == self.backgroundKey:
+      return self.preprocessedBackground
     scalarRange = bgImage.GetScalarRange()
     depth = scalarRange[1]-scalarRange[0]
 
@@ -274,75 +280,153 @@ class FastMarchingEffectLogic(Effect.EffectLogic):
       scalarRange = bgImage.GetScalarRange()
       depth = scalarRange[1]-scalarRange[0]
 
-    print('Input scalar range: '+str(depth))
-    if vtk.VTK_MAJOR_VERSION <= 5:
-      tmpfm.init(dim[1]+1, dim[3]+1, dim[5]+1, depth, 1, 1, 1)
-    else:
-      tmpfm.init(dim[0], dim[1], dim[2], depth, 1, 1, 1)
-
     caster = vtk.vtkImageCast()
     caster.SetOutputScalarTypeToShort()
     if vtk.VTK_MAJOR_VERSION <= 5:
       caster.SetInput(bgImage)
-      caster.Update()
-      tmpfm.SetInput(caster.GetOutput())
     else:
       caster.SetInputData(bgImage)
-      tmpfm.SetInputConnection(caster.GetOutputPort())
-
-    # self.fm.SetOutput(labelImage)
-
+    caster.Update()
+    self.preprocessedBackground = vtk.vtkImageData()
+    self.preprocessedBackground.DeepCopy(caster.GetOutput())
+    self.depth = depth
+    self.backgroundKey = key
+    return self.preprocessedBackground
+
+  def march(self, backgroundNode, labelNode, label, percentMax):
+    """
+    Grow label from the seeds in the label image and keep the voxels
+    reached in order of arrival.  Returns the number of voxels the
+    evolution was asked to reach, 0 without seeds.
+    """
+    import vtk.util.numpy_support
+    bgImage = self.preprocess(backgroundNode)
+    labelImage = labelNode.GetImageData()
+    dim = bgImage.GetDimensions()
+    print('Input scalar range: '+str(self.depth))
+
+    fm = slicer.vtkPichonFastMarching()
+    fm.init(dim[0], dim[1], dim[2], self.depth, 1, 1, 1)
     if vtk.VTK_MAJOR_VERSION <= 5:
-      npoints = int((dim[1]+1)*(dim[3]+1)*(dim[5]+1)*percentMax/100.)
+      fm.SetInput(bgImage)
     else:
-      npoints = int(dim[0]*dim[1]*dim[2]*percentMax/100.)
+      fm.SetInputData(bgImage)
 
-    tmpfm.setNPointsEvolution(npoints)
-    print('Setting active label to '+str(self.editUtil.getLabel()))
-    tmpfm.setActiveLabel(self.editUtil.getLabel())
+    npoints = int(dim[0]*dim[1]*dim[2]*percentMax/100.)
+    fm.setNPointsEvolution(npoints)
+    print('Setting active label to '+str(label))
+    fm.setActiveLabel(label)
 
-    nSeeds = tmpfm.addSeedsFromImage(labelImage)
-    self.fm.update({LayoutName : tmpfm})
+    self.arrivalOrder = numpy.zeros(0, dtype=numpy.int64)
+    self.shown = -1
+    nSeeds = fm.addSeedsFromImage(labelImage)
     if nSeeds == 0:
       return 0
 
-    tmpfm.Modified()
-    tmpfm.Update()
+    # the first update initializes the filter, the second one marches
+    fm.Update()
+    fm.Modified()
+    fm.Update()
+
+    knownPoints = vtk.vtkIntArray()
+    fm.getKnownPoints(knownPoints)
+    self.arrivalOrder = vtk.util.numpy_support.vtk_to_numpy(knownPoints).astype(numpy.int64)
+    self.labelNodeID = labelNode.GetID()
+    self.dimensions = labelImage.GetDimensions()
+    self.label = label
+    return npoints
 
-    # TODO: need to call show() twice for data to be updated
-    tmpfm.show(1)
-    tmpfm.Modified()
-    tmpfm.Update()
+  def show(self, labelNode, value):
+    """
+    Show the voxels reached by the march up to the fraction value of
+    the arrival order in the label image, as vtkPichonFastMarching.show
+    does: voxels are labeled if they were empty and emptied if they
+    still hold the label.  Returns the IJK extent that changed or None.
+    """
+    if self.arrivalOrder.size == 0 or labelNode.GetID() != self.labelNodeID:
+      return None
+    labelImage = labelNode.GetImageData()
+    if not labelImage or labelImage.GetDimensions() != self.dimensions:
+      return None
+    value = min(max(value, 0.), 1.)
+    newShown = int((self.arrivalOrder.size-1)*value)
+    if newShown == self.shown:
+      return None
+    import vtk.util.numpy_support
+    labelFlat = vtk.util.numpy_support.vtk_to_numpy(labelImage.GetPointData().GetScalars())
+    if newShown > self.shown:
+      band = self.arrivalOrder[self.shown+1:newShown+1]
+      band = band[labelFlat[band] == 0]
+      labelFlat[band] = self.label
+    else:
+      band = self.arrivalOrder[newShown+1:self.shown+1]
+      band = band[labelFlat[band] == self.label]
+      labelFlat[band] = 0
+    self.shown = newShown
+    if band.size == 0:
+      return None
+    sliceSize = self.dimensions[0] * self.dimensions[1]
+    k = band // sliceSize
+    j = (band % sliceSize) // self.dimensions[0]
+    i = band % self.dimensions[0]
+    return tuple([int(e) for e in (i.min(), i.max(), j.min(), j.max(), k.min(), k.max())])
+
+#
+# FastMarchingEffectLogic
+#
+
+class FastMarchingEffectLogic(Effect.EffectLogic):
+  """
+  This class contains helper methods for a given effect
+  type.  It can be instanced as needed by an FastMarchingEffectTool
+  or FastMarchingEffectOptions instance in order to compute intermediate
+  results (say, for user feedback) or to implement the final
+  segmentation editing operation.  This class is split
+  from the FastMarchingEffectTool so that the operations can be used
+  by other code without the need for a view context.
+  """
 
-    tmpfm.show(1)
-    tmpfm.Modified()
-    tmpfm.Update()
+  def __init__(self,sliceLogic):
+    super(FastMarchingEffectLogic,self).__init__(sliceLogic)
+    # layout name -> FastMarchingSession
+    self.sessions = {}
 
-    self.fm.update({LayoutName : tmpfm})
+  def getSession(self, LayoutName):
+    if LayoutName not in self.sessions:
+      self.sessions[LayoutName] = FastMarchingSession()
+    return self.sessions[LayoutName]
 
-    self.undoRedo.saveState(LayoutName)
+  def fastMarching(self, percentMax, LayoutName):
+    self.sliceLogic = self.editUtil.getSliceLogic(LayoutName)
+    backgroundNode = self.editUtil.getBackgroundVolume(LayoutName)
+    labelNode = self.editUtil.getLabelVolume(LayoutName)
+    if not backgroundNode or not labelNode:
+      return 0
+    if not backgroundNode.GetImageData() or not labelNode.GetImageData():
+      return 0
+
+    session = self.getSession(LayoutName)
+    npoints = session.march(backgroundNode, labelNode, self.editUtil.getLabel(), percentMax)
+    if npoints == 0:
+      return 0
 
-    self.editUtil.getLabelImage(LayoutName).DeepCopy(tmpfm.GetOutput())
-    self.editUtil.markVolumeNodeAsModified(self.sliceLogic.GetLabelLayer().GetVolumeNode())
-    # print('FastMarching output image: '+str(output))
+    self.undoRedo.saveState(LayoutName)
+    extent = session.show(labelNode, 1.)
+    if extent:
+      self.editUtil.markVolumeNodeAsModified(labelNode, extent)
     print('FastMarching march update completed')
 
     return npoints
 
   def updateLabel(self, value, LayoutName):
     self.sliceLogic = self.editUtil.getSliceLogic(LayoutName)
-    tmpfm = self.fm.get(LayoutName)
-    if not tmpfm:
+    session = self.sessions.get(LayoutName)
+    labelNode = self.editUtil.getLabelVolume(LayoutName)
+    if not session or not labelNode:
       return
-    tmpfm.show(value)
-    tmpfm.Modified()
-    tmpfm.Update()
-    self.fm.update({LayoutName : tmpfm})
-
-    self.editUtil.getLabelImage(LayoutName).DeepCopy(tmpfm.GetOutput())
-    self.editUtil.getLabelImage(LayoutName).Modified()
-
-    self.editUtil.markVolumeNodeAsModified(self.sliceLogic.GetLabelLayer().GetVolumeNode())
+    extent = session.show(labelNode, value)
+    if extent:
+      self.editUtil.markVolumeNodeAsModified(labelNode, extent)
 
   def getLabelNode(self):
     return self.sliceLogic.GetLabelLayer().GetVolumeNode()
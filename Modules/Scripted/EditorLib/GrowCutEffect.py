@@ -1,4 +1,6 @@
 import os
+import time
+import numpy
 from __main__ import vtk
 import vtkITK
 from __main__ import ctk
@@ -7,6 +9,7 @@ from __main__ import slicer
 from EditOptions import EditOptions
 from EditorLib import EditorLib
 import Effect
+import LabelSplitMerge
 
 
 #########################################################
@@ -47,6 +50,11 @@ class GrowCutEffectOptions(Effect.EffectOptions):
     self.helpLabel = qt.QLabel("Run the GrowCut segmentation on the current label map.\nThis will use your current segmentation as an example\nto fill in the rest of the volume.", self.frame)
     self.frame.layout().addWidget(self.helpLabel)
 
+    self.incremental = qt.QCheckBox("Incremental", self.frame)
+    self.incremental.setToolTip("Only segment around the seeds and, when seeds are added,\nstart again from the previous result instead of from scratch.")
+    self.frame.layout().addWidget(self.incremental)
+    self.widgets.append(self.incremental)
+
     self.apply = qt.QPushButton("Apply", self.frame)
     self.apply.objectName = self.__class__.__name__ + 'Apply'
     self.apply.setToolTip("Apply to run segmentation.\nCreates a new label volume using the current volume as input")
@@ -55,6 +63,7 @@ class GrowCutEffectOptions(Effect.EffectOptions):
 
     EditorLib.HelpButton(self.frame, "Use this tool to apply grow cut segmentation.\n\n Select different label colors and paint on foreground and background or as many different classes as you want using the standard drawing tools.\nTo run segmentation correctly, you need to supply a minimum or two class labels.")
 
+    self.connections.append( (self.incremental, 'clicked()', self.updateMRMLFromGUI) )
     self.connections.append( (self.apply, 'clicked()', self.onApply) )
 
     # Add vertical spacer
@@ -76,23 +85,54 @@ class GrowCutEffectOptions(Effect.EffectOptions):
 
   def setMRMLDefaults(self):
     super(GrowCutEffectOptions,self).setMRMLDefaults()
+    disableState = self.parameterNode.GetDisableModifiedEvent()
+    self.parameterNode.SetDisableModifiedEvent(1)
+    defaults = (
+      ("incremental", "1"),
+    )
+    for d in defaults:
+      param = "GrowCutEffect,"+d[0]
+      pvalue = self.parameterNode.GetParameter(param)
+      if pvalue == '':
+        self.parameterNode.SetParameter(param, d[1])
+    self.parameterNode.SetDisableModifiedEvent(disableState)
 
   def updateGUIFromMRML(self,caller,event):
+    if self.parameterNode.GetParameter("GrowCutEffect,incremental") == '':
+      # don't update if the parameter node has not got all values yet
+      return
     super(GrowCutEffectOptions,self).updateGUIFromMRML(caller,event)
+    self.disconnectWidgets()
+    incremental = not (0 == int(self.parameterNode.GetParameter("GrowCutEffect,incremental")))
+    self.incremental.setChecked( incremental )
+    self.connectWidgets()
 
   def onApply(self):
     slicer.util.showStatusMessage("Running GrowCut...", 2000)
     self.logic.undoRedo = self.undoRedo
+    self.logic.incremental = self.incremental.checked
+    reports = []
     if self.SelectionDirection.AxiCBox.checked:
-      self.logic.growCut('Red')
+      reports.append(self.logic.growCut('Red'))
     if self.SelectionDirection.SagCBox.checked:
-      self.logic.growCut('Yellow')
+      reports.append(self.logic.growCut('Yellow'))
     if self.SelectionDirection.CorCBox.checked:
-      self.logic.growCut('Green')
-    slicer.util.showStatusMessage("GrowCut Finished", 2000)
+      reports.append(self.logic.growCut('Green'))
+    reports = [report for report in reports if report]
+    if reports:
+      slicer.util.showStatusMessage("GrowCut Finished: " + reports[-1], 5000)
+    else:
+      slicer.util.showStatusMessage("GrowCut Finished", 2000)
 
   def updateMRMLFromGUI(self):
+    disableState = self.parameterNode.GetDisableModifiedEvent()
+    self.parameterNode.SetDisableModifiedEvent(1)
     super(GrowCutEffectOptions,self).updateMRMLFromGUI()
+    if self.incremental.checked:
+      self.parameterNode.SetParameter( "GrowCutEffect,incremental", "1" )
+    else:
+      self.parameterNode.SetParameter( "GrowCutEffect,incremental", "0" )
+    self.parameterNode.SetDisableModifiedEvent(disableState)
 
 #
 # GrowCutEffectTool
@@ -114,6 +154,197 @@ class GrowCutEffectTool(Effect.EffectTool):
   def cleanup(self):
     super(GrowCutEffectTool,self).cleanup()
 
+#
+# GrowCutSession
+#
+
+class GrowCutSession(object):
+  """
+  The state of GrowCut in one layout.  The filter only looks at the
+  bounding box of the seeds padded by the object radius, so only
+  that box of the background and label map is handed to it instead
+  of the whole volumes.  The seeds and the result of the last run
+  are kept for their box: running again after painting more seeds
+  gives the previous result to the filter as the prior segmentation,
+  and the voxels painted since as seeds along with the previous ones.
+  """
+
+  def __init__(self):
+    self.splitMergeEngine = LabelSplitMerge.LabelSplitMerge()
+    self.reset()
+
+  def reset(self):
+    self.labelNodeID = None
+    self.backgroundKey = None
+    self.dimensions = None
+    # IJK extent of the last run, with its seeds and result there
+    self.extent = None
+    self.seeds = None
+    self.result = None
+    self.warmStart = False
+    # seconds spent in each stage and in each iteration of the filter
+    # in the last run, the first including the setup of the filter
+    self.timings = {}
+    self.iterationTimes = []
+
+  def key(self, backgroundNode):
+    bgImage = backgroundNode.GetImageData()
+    return (backgroundNode.GetID(), bgImage.GetMTime(), bgImage.GetPointData().GetScalars().GetMTime())
+
+  def canWarmStart(self, backgroundNode, labelNode):
+    """True if the last run was on the same volumes"""
+    return (self.extent is not None and labelNode.GetID() == self.labelNodeID
+            and labelNode.GetImageData().GetDimensions() == self.dimensions
+            and self.key(backgroundNode) == self.backgroundKey)
+
+  def unionExtent(self, extent, other):
+    if extent is None:
+      return other
+    if other is None:
+      return extent
+    return (min(extent[0], other[0]), max(extent[1], other[1]),
+            min(extent[2], other[2]), max(extent[3], other[3]),
+            min(extent[4], other[4]), max(extent[5], other[5]))
+
+  def padExtent(self, extent, padding, dimensions):
+    return (max(extent[0] - padding, 0), min(extent[1] + padding, dimensions[0] - 1),
+            max(extent[2] - padding, 0), min(extent[3] + padding, dimensions[1] - 1),
+            max(extent[4] - padding, 0), min(extent[5] + padding, dimensions[2] - 1))
+
+  def imageFromArray(self, array, spacing):
+    """vtkImageData holding a copy of the (k,j,i) array"""
+    import vtk.util.numpy_support
+    image = vtk.vtkImageData()
+    image.SetDimensions(array.shape[2], array.shape[1], array.shape[0])
+    image.SetSpacing(spacing)
+    scalars = vtk.util.numpy_support.numpy_to_vtk(numpy.ascontiguousarray(array).ravel(), deep=1)
+    image.GetPointData().SetScalars(scalars)
+    return image
+
+  def run(self, backgroundNode, labelNode, objectSize, contrastNoiseRatio, priorStrength, padding, numberOfThreads=0):
+    """
+    Run the filter on the seeds of the label map, padded by padding
+    voxels.  The result is kept for apply.  Returns the IJK extent
+    of the result, or None without seeds.
+    """
+    import vtk.util.numpy_support
+    startTime = time.time()
+    bgImage = backgroundNode.GetImageData()
+    labelImage = labelNode.GetImageData()
+    dimensions = labelImage.GetDimensions()
+    if bgImage.GetDimensions() != dimensions:
+      print('GrowCut: the background and label map dimensions differ')
+      return None
+    shape = dimensions[::-1]
+    labelArray = vtk.util.numpy_support.vtk_to_numpy(labelImage.GetPointData().GetScalars()).reshape(shape)
+    bgArray = vtk.util.numpy_support.vtk_to_numpy(bgImage.GetPointData().GetScalars()).reshape(shape)
+    engine = self.splitMergeEngine
+
+    warmStart = self.canWarmStart(backgroundNode, labelNode)
+    if warmStart:
+      # what changed in the last result since was painted by the user
+      current = labelArray[engine.region(self.extent)]
+      changed = current != self.result
+      previousSeeds = self.seeds.copy()
+      previousSeeds[changed] = current[changed]
+      prior = self.result.astype(numpy.int16)
+      prior[changed] = 0
+      seedExtent = engine.occupiedExtent(previousSeeds)
+      if seedExtent is not None:
+        seedExtent = (seedExtent[0] + self.extent[0], seedExtent[1] + self.extent[0],
+                      seedExtent[2] + self.extent[2], seedExtent[3] + self.extent[2],
+                      seedExtent[4] + self.extent[4], seedExtent[5] + self.extent[4])
+      seedExtent = self.unionExtent(seedExtent, engine.occupiedExtent(labelArray, exclude=self.extent))
+    else:
+      seedExtent = engine.occupiedExtent(labelArray)
+    if seedExtent is None:
+      self.reset()
+      return None
+
+    extent = self.padExtent(seedExtent, padding, dimensions)
+    if warmStart:
+      extent = self.unionExtent(extent, self.extent)
+    region = engine.region(extent)
+    seeds = labelArray[region].astype(numpy.int16)
+    priorSegmentation = numpy.zeros_like(seeds)
+    if warmStart:
+      previous = (slice(self.extent[4] - extent[4], self.extent[5] + 1 - extent[4]),
+                  slice(self.extent[2] - extent[2], self.extent[3] + 1 - extent[2]),
+                  slice(self.extent[0] - extent[0], self.extent[1] + 1 - extent[0]))
+      seeds[previous] = previousSeeds
+      priorSegmentation[previous] = prior
+
+    # the filter casts the labels to short
+    spacing = labelImage.GetSpacing()
+    images = (self.imageFromArray(bgArray[region], spacing),
+              self.imageFromArray(seeds, spacing),
+              self.imageFromArray(priorSegmentation, spacing))
+    preparedTime = time.time()
+
+    growCutFilter = vtkITK.vtkITKGrowCutSegmentationImageFilter()
+    for port, image in enumerate(images):
+      if vtk.VTK_MAJOR_VERSION <= 5:
+        growCutFilter.SetInput( port, image )
+      else:
+        growCutFilter.SetInputData( port, image )
+    growCutFilter.SetObjectSize( objectSize )
+    growCutFilter.SetContrastNoiseRatio( contrastNoiseRatio )
+    growCutFilter.SetPriorSegmentConfidence( priorStrength )
+    growCutFilter.SetNumberOfThreads( numberOfThreads )
+    progressEvents = []
+    def onProgress(caller, event):
+      progressEvents.append((time.time(), caller.GetProgress()))
+    growCutFilter.AddObserver(vtk.vtkCommand.ProgressEvent, onProgress)
+    growCutFilter.Update()
+    filteredTime = time.time()
+
+    output = growCutFilter.GetOutput().GetPointData().GetScalars()
+    self.result = vtk.util.numpy_support.vtk_to_numpy(output).reshape(seeds.shape).astype(labelArray.dtype)
+    self.seeds = seeds
+    self.extent = extent
+    self.warmStart = warmStart
+    self.labelNodeID = labelNode.GetID()
+    self.dimensions = dimensions
+    self.backgroundKey = self.key(backgroundNode)
+    # the pipelines report 0 and 1 around the filter and the filter
+    # reports 1 once done, the iterations report the saturated fraction
+    self.iterationTimes = []
+    previousTime = preparedTime
+    for eventTime, progress in progressEvents:
+      if 0 < progress < 1:
+        self.iterationTimes.append(eventTime - previousTime)
+      previousTime = eventTime
+    self.timings = {'prepare': preparedTime - startTime, 'filter': filteredTime - preparedTime}
+    return extent
+
+  def apply(self, labelNode):
+    """Write the result of the last run into the label map"""
+    import vtk.util.numpy_support
+    startTime = time.time()
+    labelImage = labelNode.GetImageData()
+    labelArray = vtk.util.numpy_support.vtk_to_numpy(labelImage.GetPointData().GetScalars())
+    labelArray = labelArray.reshape(labelImage.GetDimensions()[::-1])
+    labelArray[self.splitMergeEngine.region(self.extent)] = self.result
+    self.timings['apply'] = time.time() - startTime
+
+  def report(self):
+    """Text describing the size and timing of the last run"""
+    extent = self.extent
+    size = (extent[1] - extent[0] + 1, extent[3] - extent[2] + 1, extent[5] - extent[4] + 1)
+    text = "%dx%dx%d of %dx%dx%d voxels" % (size + tuple(self.dimensions))
+    if self.warmStart:
+      text += " from the previous result"
+    text += ", prepared in %.2fs" % self.timings['prepare']
+    if self.iterationTimes:
+      text += ", %d iterations in %.2fs (%.0fms each, %.0fms at most)" % (
+        len(self.iterationTimes), self.timings['filter'],
+        1000 * numpy.mean(self.iterationTimes), 1000 * numpy.max(self.iterationTimes))
+    else:
+      text += ", segmented in %.2fs" % self.timings['filter']
+    if 'apply' in self.timings:
+      text += ", applied in %.2fs" % self.timings['apply']
+    return text
+
 #
 # GrowCutEffectLogic
 #
@@ -129,12 +360,70 @@ class GrowCutEffectLogic(Effect.EffectLogic):
   by other code without the need for a view context.
   """
 
+  # volume of the object in voxels (times conversion) that sets the
+  # radius the filter grows the seeds by
+  objectSize = 5.
+  conversion = 1000
+  contrastNoiseRatio = 0.8
+  priorStrength = 0.003
+  # voxels added around the seeds and the object radius in
+  # incremental mode
+  padding = 0
+  # threads of the filter, 0 for the itk default
+  numberOfThreads = 0
+
   def __init__(self,sliceLogic):
     super(GrowCutEffectLogic,self).__init__(sliceLogic)
+    # only segment around the seeds and start from the previous result
+    self.incremental = True
+    self.sessions = {}
 
-  def growCut(self, LayoutName):
-    self.sliceLogic = self.editUtil.getSliceLogic(LayoutName)
+  def getSession(self, LayoutName):
+    if LayoutName not in self.sessions:
+      self.sessions[LayoutName] = GrowCutSession()
+    return self.sessions[LayoutName]
+
+  def objectRadius(self, spacing):
+    """Radius in voxels of an object of objectSize"""
+    voxelVolume = reduce(lambda x,y: x*y, spacing)
+    voxelAmount = self.objectSize / voxelVolume
+    voxelNumber = round(voxelAmount) * self.conversion
+
+    cubeRoot = 1./3.
+    return int(round(pow(voxelNumber,cubeRoot)))
 
+  def growCut(self, LayoutName='Red'):
+    """Segment the label map of the layout, returns a description of
+    the run in incremental mode"""
+    self.sliceLogic = self.editUtil.getSliceLogic(LayoutName)
+    if not self.incremental or self.scope != 'All':
+      self.growCutVolume()
+      return None
+
+    backgroundNode = self.editUtil.getBackgroundVolume(LayoutName)
+    labelNode = self.editUtil.getLabelVolume(LayoutName)
+    if not backgroundNode or not labelNode:
+      return None
+    if not backgroundNode.GetImageData() or not labelNode.GetImageData():
+      return None
+
+    session = self.getSession(LayoutName)
+    oSize = self.objectRadius(labelNode.GetImageData().GetSpacing())
+    extent = session.run(backgroundNode, labelNode, oSize, self.contrastNoiseRatio,
+                         self.priorStrength, oSize + self.padding, self.numberOfThreads)
+    if not extent:
+      return None
+
+    if self.undoRedo:
+      self.undoRedo.saveState(LayoutName)
+    session.apply(labelNode)
+    self.editUtil.markVolumeNodeAsModified(labelNode, extent)
+    report = session.report()
+    print('GrowCut: ' + report)
+    return report
+
+  def growCutVolume(self):
+    """Segment the whole scoped volume"""
     growCutFilter = vtkITK.vtkITKGrowCutSegmentationImageFilter()
     background = self.getScopedBackground()
     gestureInput = self.getScopedLabelInput()
@@ -165,23 +454,12 @@ class GrowCutEffectLogic(Effect.EffectLogic):
       growCutFilter.SetInputData( 1, gestureInput )
       growCutFilter.SetInputConnection( 2, thresh.GetOutputPort() )
 
-    objectSize = 5. # TODO: this is a magic number
-    contrastNoiseRatio = 0.8 # TODO: this is a magic number
-    priorStrength = 0.003 # TODO: this is a magic number
-    segmented = 2 # TODO: this is a magic number
-    conversion = 1000 # TODO: this is a magic number
-
-    spacing = gestureInput.GetSpacing()
-    voxelVolume = reduce(lambda x,y: x*y, spacing)
-    voxelAmount = objectSize / voxelVolume
-    voxelNumber = round(voxelAmount) * conversion
-
-    cubeRoot = 1./3.
-    oSize = int(round(pow(voxelNumber,cubeRoot)))
+    oSize = self.objectRadius(gestureInput.GetSpacing())
 
     growCutFilter.SetObjectSize( oSize )
-    growCutFilter.SetContrastNoiseRatio( contrastNoiseRatio )
-    growCutFilter.SetPriorSegmentConfidence( priorStrength )
+    growCutFilter.SetContrastNoiseRatio( self.contrastNoiseRatio )
+    growCutFilter.SetPriorSegmentConfidence( self.priorStrength )
+    growCutFilter.SetNumberOfThreads( self.numberOfThreads )
     growCutFilter.Update()
 
     growCutOutput.DeepCopy( growCutFilter.GetOutput() )
@@ -1,6 +1,7 @@
 import os
 import re
 import math
+import numpy
 from __main__ import qt
 from __main__ import ctk
 from __main__ import vtk
@@ -9,6 +10,7 @@ from __main__ import slicer
 import ColorBox
 import EditUtil
 import UpdateModelLive
+import LabelSplitMerge
 
 #########################################################
 #
@@ -51,6 +53,10 @@ class HelperBox(object):
     self.IsThreeVolume = IsThreeVolume
 
     self.UpdateModelLive = UpdateModelLive.UpdateModelLive(self.editUtil, False, IsThreeVolume)
+    self.splitMergeEngine = LabelSplitMerge.LabelSplitMerge()
+    # keep the structure volumes cropped to the bounding box of their
+    # labels, except the ones being edited
+    self.cropStructures = False
 
     if not parent:
       self.parent = slicer.qMRMLWidget()
@@ -200,31 +206,16 @@ class HelperBox(object):
       return self.masterCor
 
   def getRealScalarRange(self, Image):
-    if not Image:
+    """the labels (other than 0) present in the volume"""
+    if not Image or not Image.GetImageData():
       return []
-    AbsScalarRange = Image.GetImageData().GetScalarRange()
-    thresholder = vtk.vtkImageThreshold()
-    thresholder.SetNumberOfThreads(1)
-    RealScalarRange = []
-    for i in xrange(int(AbsScalarRange[0]), int(AbsScalarRange[1]) + 1):
-      if vtk.VTK_MAJOR_VERSION <= 5:
-        thresholder.SetInput(Image.GetImageData())
-      else:
-        thresholder.SetInputConnection(Image.GetImageDataConnection())
-      thresholder.SetInValue(i)
-      thresholder.SetInValue(i)
-      thresholder.SetOutValue(0)
-      thresholder.ReplaceInOn()
-      thresholder.ReplaceOutOn()
-      thresholder.ThresholdBetween(i, i)
-      thresholder.SetOutputScalarType(Image.GetImageData().GetScalarType())
-      thresholder.Update()
-      if thresholder.GetOutput().GetScalarRange() != (0.0, 0.0):
-        RealScalarRange.append(i)
-    return RealScalarRange
+    return self.splitMergeEngine.labels(self.UpdateModelLive.getVolumeArray(Image))
 
   def setMerge(self, merge, layoutName):
     """setter for merge volume"""
+    previous = self.getMerge(layoutName)
+    if self.cropStructures and merge and self.getMaster(layoutName):
+      self.expandStructure(merge, self.getMaster(layoutName))
     if layoutName == 'Red':
       self.mergeAxi = merge
     if layoutName == 'Yellow':
@@ -234,6 +225,8 @@ class HelperBox(object):
     self.updateViewLabel(layoutName)
     self.updateMergeNames(layoutName)
     self.UpdateModelLive.setMerge(merge, layoutName)
+    if self.cropStructures:
+      self.swapCroppedStructure(previous, merge, layoutName)
 
   def getMerge(self, layoutName):
     """getter for merge volume"""
@@ -244,6 +237,114 @@ class HelperBox(object):
     if layoutName == 'Green':
       return self.mergeCor
 
+  def structureOffset(self, volume, reference):
+    """IJK of the first voxel of volume in the voxel grid of reference,
+    or None if the grids do not line up or volume does not fit"""
+    if not volume.GetImageData() or not reference.GetImageData():
+      return None
+    ijkToRAS = vtk.vtkMatrix4x4()
+    volume.GetIJKToRASMatrix(ijkToRAS)
+    rasToIJK = vtk.vtkMatrix4x4()
+    reference.GetRASToIJKMatrix(rasToIJK)
+    volumeToReference = vtk.vtkMatrix4x4()
+    vtk.vtkMatrix4x4.Multiply4x4(rasToIJK, ijkToRAS, volumeToReference)
+    for r in xrange(3):
+      for c in xrange(3):
+        if abs(volumeToReference.GetElement(r, c) - (r == c)) > 1e-3:
+          return None
+    offset = [volumeToReference.GetElement(r, 3) for r in xrange(3)]
+    rounded = [int(round(o)) for o in offset]
+    dims = volume.GetImageData().GetDimensions()
+    referenceDims = reference.GetImageData().GetDimensions()
+    for n in xrange(3):
+      if abs(offset[n] - rounded[n]) > 1e-3 or rounded[n] < 0 or rounded[n] + dims[n] > referenceDims[n]:
+        return None
+    return tuple(rounded)
+
+  def isCroppedStructure(self, volume, reference):
+    return (volume.GetImageData() and reference.GetImageData() and
+            volume.GetImageData().GetDimensions() != reference.GetImageData().GetDimensions())
+
+  def setStructureImage(self, volume, reference, array, offset):
+    """replace the voxels of volume by a (k,j,i) array whose first voxel
+    is at offset in the voxel grid of reference"""
+    scalarType = volume.GetImageData().GetScalarType() if volume.GetImageData() else vtk.VTK_SHORT
+    imageData = vtk.vtkImageData()
+    imageData.SetDimensions(array.shape[2], array.shape[1], array.shape[0])
+    if vtk.VTK_MAJOR_VERSION <= 5:
+      imageData.SetScalarType(scalarType)
+      imageData.AllocateScalars()
+    else:
+      imageData.AllocateScalars(scalarType, 1)
+    volume.CopyOrientation(reference)
+    ijkToRAS = vtk.vtkMatrix4x4()
+    reference.GetIJKToRASMatrix(ijkToRAS)
+    volume.SetOrigin(ijkToRAS.MultiplyPoint(list(offset) + [1])[:3])
+    volume.SetAndObserveImageData(imageData)
+    self.UpdateModelLive.getVolumeArray(volume)[:] = array
+
+  def cropStructure(self, volume, reference):
+    """crop a structure volume to the bounding box of its labels"""
+    offset = self.structureOffset(volume, reference)
+    if offset is None:
+      return
+    array = self.UpdateModelLive.getVolumeArray(volume)
+    extent = self.splitMergeEngine.occupiedExtent(array)
+    if not extent:
+      # keep a single empty voxel
+      extent = (0, 0, 0, 0, 0, 0)
+    if extent == (0, array.shape[2] - 1, 0, array.shape[1] - 1, 0, array.shape[0] - 1):
+      return
+    cropped = array[self.splitMergeEngine.region(extent)].copy()
+    self.setStructureImage(volume, reference, cropped, (offset[0] + extent[0], offset[1] + extent[2], offset[2] + extent[4]))
+    self.editUtil.markVolumeNodeAsModified(volume)
+
+  def expandStructure(self, volume, reference):
+    """expand a cropped structure volume to the size of reference"""
+    if not self.isCroppedStructure(volume, reference):
+      return
+    offset = self.structureOffset(volume, reference)
+    if offset is None:
+      return
+    array = self.UpdateModelLive.getVolumeArray(volume)
+    referenceArray = self.UpdateModelLive.getVolumeArray(reference)
+    expanded = numpy.zeros(referenceArray.shape, dtype=array.dtype)
+    expanded[offset[2]:offset[2] + array.shape[0], offset[1]:offset[1] + array.shape[1], offset[0]:offset[0] + array.shape[2]] = array
+    self.setStructureImage(volume, reference, expanded, (0, 0, 0))
+    self.editUtil.markVolumeNodeAsModified(volume)
+
+  def swapCroppedStructure(self, previous, merge, layoutName):
+    """the merge volume of a layout is edited by the effects so it is
+    kept full size, the structure it replaced is cropped again unless
+    another layout still uses it"""
+    master = self.getMaster(layoutName)
+    if not master or not previous or previous == merge:
+      return
+    if previous in [self.mergeAxi, self.mergeSag, self.mergeCor]:
+      return
+    if self.IsMergeAlreadyAdded(previous.GetName()):
+      self.cropStructure(previous, master)
+
+  def cropStructuresCBoxChanged(self, state = None):
+    """crop or expand all the structure volumes"""
+    self.cropStructures = self.cropStructuresCBox.checked
+    merges = [self.mergeAxi, self.mergeSag, self.mergeCor]
+    for row in range(self.structures.rowCount()):
+      Nodes = slicer.mrmlScene.GetNodesByName(self.structures.item(row, 2).text())
+      if Nodes.GetNumberOfItems() != 1:
+        continue
+      Volume = Nodes.GetItemAsObject(0)
+      LayoutName = 'Red'
+      if self.threeVolumesCBox.checked:
+        LayoutName = self.structures.item(row, 4).text()
+      master = self.getMaster(LayoutName)
+      if not Volume or not master:
+        continue
+      if not self.cropStructures:
+        self.expandStructure(Volume, master)
+      elif Volume not in merges:
+        self.cropStructure(Volume, master)
+
   def updateMergeButtons(self):
     """update the set buttons based existence of master image"""
     self.setMergeAxiButton.setDisabled(not self.masterAxi)
@@ -495,35 +596,32 @@ class HelperBox(object):
       return
     SelVolumes = self.GetSelectedStructuresByDirection(LayoutName)
 
-    rows = self.structures.rowCount()
-
-    combiner = slicer.vtkImageLabelCombine()
     MergeName = merge.GetName()
-    dims = merge.GetImageData().GetDimensions()
+    structureArrays = []
+    offsets = []
     for VolumeName in SelVolumes:
       Nodes = slicer.mrmlScene.GetNodesByName(VolumeName)
       if Nodes.GetNumberOfItems() == 1:
         Volume = Nodes.GetItemAsObject(0)
-        if Volume:
-          # check that structure in the same size as the merge volume
-          if Volume.GetImageData().GetDimensions() != dims:
+        if Volume and Volume.GetImageData():
+          # check that structure lies on the voxels of the merge volume,
+          # cropped structures are merged into their bounding box
+          offset = self.structureOffset(Volume, merge)
+          if offset is None:
             print("WARNING: Volume %s does not have the same dimensions as the target merge volume.  Use the Resample Scalar/Vector/DWI module to resample.  Use %s as the Reference Volume and select Nearest Neighbor (nn) Interpolation Type." % (VolumeName, MergeName))
           else:
-            if vtk.VTK_MAJOR_VERSION <= 5:
-              combiner.SetInput1(merge.GetImageData())
-              combiner.SetInput2(Volume.GetImageData())
-            else:
-              combiner.SetInputConnection(0, merge.GetImageDataConnection())
-              combiner.SetInputConnection(1, Volume.GetImageDataConnection())
-            self.statusText("Merging %s" % VolumeName)
-            combiner.Update()
-            merge.GetImageData().DeepCopy(combiner.GetOutput())
+            structureArrays.append(self.UpdateModelLive.getVolumeArray(Volume))
+            offsets.append(offset)
         else:
           print("WARNING: No image data for volume node %s." % VolumeName)
       else:
         print("WARNING: The node %s for creating model not one, it's %s" % (VolumeName, str(Nodes.GetNumberOfItems())))
 
-    self.editUtil.markVolumeNodeAsModified(merge)
+    # all the structures are combined in one pass over the merge volume
+    self.statusText("Merging %d structures..." % len(structureArrays))
+    extent = self.splitMergeEngine.merge(self.UpdateModelLive.getVolumeArray(merge), structureArrays, offsets)
+    if extent:
+      self.editUtil.markVolumeNodeAsModified(merge, extent)
     self.statusText("Finished merging.")
 
   def splitMerge(self, LayoutName):
@@ -531,46 +629,51 @@ class HelperBox(object):
     self.statusText("Splitting...")
 
     merge = self.getMerge(LayoutName)
-    if not merge:
+    if not merge or not merge.GetImageData():
       return
     colorNode = merge.GetDisplayNode().GetColorNode()
     MergeName = merge.GetName()
 
-    ScalarRange = self.mergeAxi.GetImageData().GetScalarRange()
-    lo = int(ScalarRange[0])
-    hi = int(ScalarRange[1])
-
-    # TODO: pending resolution of bug 1822, run the thresholding
-    # in single threaded mode to avoid data corruption observed on mac release
-    # builds
-    thresholder = vtk.vtkImageThreshold()
-    thresholder.SetNumberOfThreads(1)
-    for i in xrange(lo, hi + 1):
-      if vtk.VTK_MAJOR_VERSION <= 5:
-        thresholder.SetInput(merge.GetImageData())
+    # the labels present and their extents are found in one pass, then
+    # each structure only visits the bounding box of its label
+    mergeArray = self.UpdateModelLive.getVolumeArray(merge)
+    bounds = self.splitMergeEngine.labelBounds(mergeArray)
+    for i in sorted(bounds.keys()):
+      extent = bounds[i][1]
+      self.statusText("Splitting label %d..." % i)
+      labelName = colorNode.GetColorName(i)
+      SplitImageName = MergeName + '-l' + labelName
+      self.statusText("Creating structure volume %s..." % SplitImageName)
+      if self.cropStructures:
+        structureVolume = self.createCroppedStructure(merge, SplitImageName,
+            self.splitMergeEngine.extract(mergeArray, i, extent), (extent[0], extent[2], extent[4]))
       else:
-        thresholder.SetInputConnection(merge.GetImageDataConnection())
-      thresholder.SetInValue(i)
-      thresholder.SetOutValue(0)
-      thresholder.ReplaceInOn()
-      thresholder.ReplaceOutOn()
-      thresholder.ThresholdBetween(i, i)
-      thresholder.SetOutputScalarType(merge.GetImageData().GetScalarType())
-      thresholder.Update()
-      if thresholder.GetOutput().GetScalarRange() != (0.0, 0.0):
-        self.statusText("Splitting label %d..." % i)
-        labelName = colorNode.GetColorName(i)
-        SplitImageName = MergeName + '-l' + labelName
-        self.statusText("Creating structure volume %s..." % SplitImageName)
         structureVolume = self.volumesLogic.CreateAndAddLabelVolume(slicer.mrmlScene, merge, SplitImageName)
-        structureVolume.GetDisplayNode().SetAndObserveColorNodeID(colorNode.GetID())
-        self.AddStructureLayoutName = LayoutName
-        self.addStructure(i, structureVolume)
-        structureVolume.GetImageData().DeepCopy(thresholder.GetOutput())
-        self.editUtil.markVolumeNodeAsModified(structureVolume)
+        structureArray = self.UpdateModelLive.getVolumeArray(structureVolume)
+        structureArray.fill(0)
+        self.splitMergeEngine.extract(mergeArray, i, extent, structureArray)
+      structureVolume.GetDisplayNode().SetAndObserveColorNodeID(colorNode.GetID())
+      self.AddStructureLayoutName = LayoutName
+      self.addStructure(i, structureVolume)
+      self.editUtil.markVolumeNodeAsModified(structureVolume)
 
     self.statusText("Finished splitting.")
 
+  def createCroppedStructure(self, merge, name, array, offset):
+    """create a label volume holding only the (k,j,i) array, whose
+    first voxel is at offset in the merge volume"""
+    displayNode = slicer.vtkMRMLLabelMapVolumeDisplayNode()
+    slicer.mrmlScene.AddNode(displayNode)
+    structureVolume = slicer.vtkMRMLScalarVolumeNode()
+    structureVolume.SetLabelMap(1)
+    structureVolume.SetName(slicer.mrmlScene.GetUniqueNameByString(name))
+    if merge.GetID():
+      structureVolume.SetAttribute("AssociatedNodeID", merge.GetID())
+    self.setStructureImage(structureVolume, merge, array, offset)
+    structureVolume.SetAndObserveDisplayNodeID(displayNode.GetID())
+    slicer.mrmlScene.AddNode(structureVolume)
+    return structureVolume
+
   def selectAllModelsCBoxChanged(self, state = None):
     rows = self.structures.rowCount()
     if self.selectAllModelsCBox.checked:
@@ -722,6 +825,14 @@ class HelperBox(object):
     self.updateModelsLiveCBox.connect("stateChanged(int)", self.updateModelsLiveCBoxChanged)
     self.CheckBoxesFrame.layout().addWidget(self.updateModelsLiveCBox)
 
+    # crop structures button
+    self.cropStructuresCBox = qt.QCheckBox("Crop Structures", self.CheckBoxesFrame)
+    self.cropStructuresCBox.objectName = 'CropStructuresCBox'
+    self.cropStructuresCBox.setToolTip("Keep only the bounding box of the labels of each structure volume in memory. The structure being edited is expanded to the size of the master volume.")
+    self.cropStructuresCBox.setChecked(self.cropStructures)
+    self.cropStructuresCBox.connect("stateChanged(int)", self.cropStructuresCBoxChanged)
+    self.CheckBoxesFrame.layout().addWidget(self.cropStructuresCBox)
+
   # TODO: make the text and selector the same size, so it looks better
   def createMasterAxiSelector(self):
     """create the master axial selector"""
@@ -1,4 +1,5 @@
 import os
+import numpy
 from __main__ import vtk
 from __main__ import qt
 from __main__ import ctk
@@ -328,125 +329,220 @@ class LabelEffectLogic(Effect.EffectLogic):
     labelNode = labelLogic.GetVolumeNode()
     if not sliceNode or not labelNode: return
 
-    maskIJKToRAS, mask = self.makeMaskImage(polyData)
-
     polyData.GetPoints().Modified()
     bounds = polyData.GetBounds()
-
-    self.applyImageMask(maskIJKToRAS, mask, bounds, self.sliceLogic.GetName())
-
-  def applyImageMask(self, maskIJKToRAS, mask, bounds, layoutName):
+    import vtk.util.numpy_support
+    xy = vtk.util.numpy_support.vtk_to_numpy(polyData.GetPoints().GetData())[:, :2].astype(numpy.float64)
+
+    layoutName = self.sliceLogic.GetName()
+    grid = self.sampleGrid(bounds, layoutName)
+    if not grid: return
+    origin, columnStep, rowStep, columns, rows, scale = grid
+    uv = (xy - (bounds[0], bounds[2])) * scale
+    mask = self.rasterizePolygon(uv, columns, rows)
+    rowIndices, columnIndices = numpy.nonzero(mask)
+    ijk = origin + numpy.outer(columnIndices, columnStep) + numpy.outer(rowIndices, rowStep)
+    self.paintIJK(ijk, layoutName)
+
+  #
+  # rasterization buffers, shared by all the label effects
+  # and grown as needed
+  #
+  rasterBuffers = {}
+
+  def rasterBuffer(self, name, shape, dtype):
+    """Return a reused array of the given shape (contents undefined)"""
+    size = int(numpy.prod(shape))
+    buffer = self.rasterBuffers.get(name)
+    if buffer is None or buffer.size < size or buffer.dtype != dtype:
+      buffer = numpy.empty(max(size, 1024), dtype=dtype)
+      self.rasterBuffers[name] = buffer
+    return buffer[:size].reshape(shape)
+
+  def matrixToArray(self, matrix):
+    return numpy.array([[matrix.GetElement(row, column) for column in xrange(4)] for row in xrange(4)])
+
+  def sampleGrid(self, bounds, layoutName):
     """
-    apply a pre-rasterized image to the current label layer
-    - maskIJKToRAS tells the mapping from image pixels to RAS
-    - mask is a vtkImageData
-    - bounds are the xy extents of the mask (zlo and zhi ignored)
+    Return the sampling of the label IJK space within the xy
+    bounds of the slice as (origin, columnStep, rowStep, columns,
+    rows, scale): sample (column, row) is at IJK origin +
+    column * columnStep + row * rowStep and at xy
+    (xlo, ylo) + (column, row) / scale.  The steps move by one
+    voxel along the IJK axis closest to the x and y directions of
+    the slice, so every voxel the slice goes through is sampled,
+    once for slices that are aligned with the volume.
+    Returns None if the volumes are missing.
     """
     sliceLogic = self.editUtil.getSliceLogic(layoutName)
-    backgroundLogic = sliceLogic.GetBackgroundLayer()
-    backgroundNode = backgroundLogic.GetVolumeNode()
-    if not backgroundNode: return
-    backgroundImage = backgroundNode.GetImageData()
-    if not backgroundImage: return
-    labelLogic = sliceLogic.GetLabelLayer()
-    labelNode = labelLogic.GetVolumeNode()
-    if not labelNode: return
+    labelNode = sliceLogic.GetLabelLayer().GetVolumeNode()
+    if not labelNode or not labelNode.GetImageData(): return None
+    xyToRAS = self.matrixToArray(sliceLogic.GetSliceNode().GetXYToRAS())
+    rasToIJK = numpy.linalg.inv(self.matrixToArray(self.getIJKToRASMatrix(labelNode)))
+    xyToIJK = numpy.dot(rasToIJK, xyToRAS)
+    scale = numpy.array([numpy.abs(xyToIJK[:3, 0]).max(), numpy.abs(xyToIJK[:3, 1]).max()])
+    if not (scale > 0).all(): return None
+    xlo, xhi, ylo, yhi = bounds[:4]
+    columns = int(numpy.ceil((xhi - xlo) * scale[0])) + 1
+    rows = int(numpy.ceil((yhi - ylo) * scale[1])) + 1
+    origin = numpy.dot(xyToIJK, (xlo, ylo, 0, 1))[:3]
+    return origin, xyToIJK[:3, 0] / scale[0], xyToIJK[:3, 1] / scale[1], columns, rows, scale
+
+  def rasterizePolygon(self, uv, columns, rows):
+    """
+    Fill the polygon given by the (n,2) array of its (column, row)
+    vertices (even-odd rule) and return a (rows, columns) boolean
+    mask.  The samples on the outline are included.  The mask is a
+    reused buffer, valid until the next call.
+    """
+    mask = self.rasterBuffer('mask', (rows, columns), numpy.bool_)
+    mask.fill(False)
+    if uv.shape[0] == 0:
+      return mask
+    start = uv
+    end = numpy.roll(uv, -1, axis=0)
+    delta = end - start
+
+    # interior: the crossings of the edges with each row, sorted,
+    # fill between the pairs of crossings
+    if uv.shape[0] > 2:
+      row = numpy.arange(rows, dtype=numpy.float64)[:, numpy.newaxis]
+      crosses = (((start[:, 1] <= row) & (row < end[:, 1])) |
+                 ((end[:, 1] <= row) & (row < start[:, 1])))
+      dv = numpy.where(delta[:, 1] != 0, delta[:, 1], 1.)
+      crossings = start[:, 0] + (row - start[:, 1]) * delta[:, 0] / dv
+      crossings = numpy.where(crosses, crossings, numpy.inf)
+      crossings.sort(axis=1)
+      pairs = int(crosses.sum(axis=1).max()) // 2
+      if pairs:
+        first = numpy.ceil(crossings[:, 0:2*pairs:2])
+        last = numpy.floor(crossings[:, 1:2*pairs:2])
+        valid = numpy.isfinite(last)
+        first = numpy.clip(numpy.where(valid, first, 0), 0, columns)
+        last = numpy.clip(numpy.where(valid, last, -1), -1, columns - 1)
+        valid &= first <= last
+        rowIndex = numpy.repeat(numpy.arange(rows), pairs).reshape(rows, pairs)
+        width = columns + 1
+        changes = numpy.zeros(rows * width, dtype=numpy.int32)
+        if valid.any():
+          # bincount has no minlength before numpy 1.6
+          starts = numpy.bincount((rowIndex * width + first)[valid].astype(numpy.int64))
+          changes[:starts.size] += starts.astype(numpy.int32)
+          ends = numpy.bincount((rowIndex * width + last + 1)[valid].astype(numpy.int64))
+          changes[:ends.size] -= ends.astype(numpy.int32)
+        inside = self.rasterBuffer('inside', (rows, width), numpy.int32)
+        numpy.cumsum(changes.reshape(rows, width), axis=1, out=inside)
+        mask |= inside[:, :columns] > 0
+
+    # outline: sample every edge at most one sample apart
+    lengths = numpy.ceil(numpy.abs(delta).max(axis=1)).astype(numpy.int64) + 1
+    edge = numpy.repeat(numpy.arange(uv.shape[0]), lengths)
+    step = numpy.arange(lengths.sum()) - numpy.repeat(numpy.cumsum(lengths) - lengths, lengths)
+    t = step / numpy.maximum(lengths - 1, 1).astype(numpy.float64)[edge]
+    points = numpy.floor(start[edge] + t[:, numpy.newaxis] * delta[edge] + 0.5).astype(numpy.int64)
+    keep = ((points >= 0) & (points < (columns, rows))).all(axis=1)
+    mask[points[keep, 1], points[keep, 0]] = True
+    return mask
+
+  def paintIJK(self, ijk, layoutName):
+    """
+    paint the current label at the (n,3) array of continuous label IJK
+    sample positions, honouring the paintOver and threshold settings
+    the same way vtkImageSlicePaint does, with array operations.
+    The undo state is saved first.
+    """
+    sliceLogic = self.editUtil.getSliceLogic(layoutName)
+    labelNode = sliceLogic.GetLabelLayer().GetVolumeNode()
+    backgroundNode = sliceLogic.GetBackgroundLayer().GetVolumeNode()
+    if not labelNode or not backgroundNode: return
     labelImage = labelNode.GetImageData()
-    if not labelImage: return
-
-    #
-    # at this point, the mask vtkImageData contains a rasterized
-    # version of the polygon and now needs to be added to the label
-    # image
-    #
+    backgroundImage = backgroundNode.GetImageData()
+    if not labelImage or not backgroundImage: return
 
     # store a backup copy of the label map for undo
-    # (this happens in it's own thread, so it is cheap)
     if self.undoRedo:
       self.undoRedo.saveState(layoutName)
 
-    #
-    # get the mask bounding box in ijk coordinates
-    # - get the xy bounds
-    # - transform to ijk
-    # - clamp the bounds to the dimensions of the label image
-    #
-
-    xlo, xhi, ylo, yhi, zlo, zhi = bounds
-    labelLogic = self.sliceLogic.GetLabelLayer()
-    xyToIJK = labelLogic.GetXYToIJKTransform()
-    tlIJK = xyToIJK.TransformDoublePoint( (xlo, yhi, 0) )
-    trIJK = xyToIJK.TransformDoublePoint( (xhi, yhi, 0) )
-    blIJK = xyToIJK.TransformDoublePoint( (xlo, ylo, 0) )
-    brIJK = xyToIJK.TransformDoublePoint( (xhi, ylo, 0) )
-
-    # do the clamping of the four corners
-    dims = labelImage.GetDimensions()
-    tl = [0,] * 3
-    tr = [0,] * 3
-    bl = [0,] * 3
-    br = [0,] * 3
-    corners = ((tlIJK, tl),(trIJK, tr),(blIJK, bl),(brIJK, br))
-    for corner,clampedCorner in corners:
-      for d in xrange(3):
-        clamped = int(round(corner[d]))
-        if clamped < 0: clamped = 0
-        if clamped >= dims[d]: clamped = dims[d]-1
-        clampedCorner[d] = clamped
-
-    #
-    # get the ijk to ras matrices including transforms
-    # (use the maskToRAS calculated above)
-    #
-
-    labelLogic = self.sliceLogic.GetLabelLayer()
-    labelNode = labelLogic.GetVolumeNode()
-    backgroundLogic = self.sliceLogic.GetLabelLayer()
-    backgroundNode = backgroundLogic.GetVolumeNode()
-
-    backgroundIJKToRAS = self.getIJKToRASMatrix(backgroundNode)
-    labelIJKToRAS = self.getIJKToRASMatrix(labelNode)
-
-    #
-    # create an exract image for undo if it doesn't exist yet.
-    #
-
-    if not self.extractImage:
-      self.extractImage = vtk.vtkImageData()
-
     parameterNode = self.editUtil.getParameterNode()
     paintLabel = int(parameterNode.GetParameter("label"))
     paintOver = int(parameterNode.GetParameter("LabelEffect,paintOver"))
     paintThreshold = int(parameterNode.GetParameter("LabelEffect,paintThreshold"))
-    paintThresholdMin = float(
-        parameterNode.GetParameter("LabelEffect,paintThresholdMin"))
-    paintThresholdMax = float(
-        parameterNode.GetParameter("LabelEffect,paintThresholdMax"))
+    paintThresholdMin = float(parameterNode.GetParameter("LabelEffect,paintThresholdMin"))
+    paintThresholdMax = float(parameterNode.GetParameter("LabelEffect,paintThresholdMax"))
+
+    import vtk.util.numpy_support
+    dims = numpy.array(labelImage.GetDimensions())
+    labelFlat = vtk.util.numpy_support.vtk_to_numpy(labelImage.GetPointData().GetScalars())
+
+    # samples within the volume, rounded to voxels as vtkImageSlicePaint does
+    ijk = ijk[((ijk >= 0) & (ijk <= dims - 1)).all(axis=1)]
+    floor = numpy.floor(ijk)
+    voxels = (floor + (ijk - floor > 0.5)).astype(numpy.int64)
+    strides = numpy.array([1, dims[0], dims[0] * dims[1]])
+    indices = numpy.unique(numpy.dot(voxels, strides))
+
+    if not paintOver:
+      indices = indices[labelFlat[indices] == 0]
+    if paintThreshold and indices.size:
+      backgroundFlat = vtk.util.numpy_support.vtk_to_numpy(backgroundImage.GetPointData().GetScalars())
+      labelIJKToRAS = self.matrixToArray(self.getIJKToRASMatrix(labelNode))
+      backgroundIJKToRAS = self.matrixToArray(self.getIJKToRASMatrix(backgroundNode))
+      backgroundDims = numpy.array(backgroundImage.GetDimensions())
+      if (backgroundDims == dims).all() and numpy.allclose(labelIJKToRAS, backgroundIJKToRAS):
+        backgroundIndices = indices
+      else:
+        labelToBackground = numpy.dot(numpy.linalg.inv(backgroundIJKToRAS), labelIJKToRAS)
+        k, j, i = self.unravelIndices(indices, strides)
+        backgroundIJK = numpy.dot(numpy.column_stack((i, j, k, numpy.ones(i.size))), labelToBackground[:3].T)
+        backgroundIJK = numpy.clip(numpy.floor(backgroundIJK + 0.5), 0, backgroundDims - 1).astype(numpy.int64)
+        backgroundIndices = numpy.dot(backgroundIJK, numpy.array([1, backgroundDims[0], backgroundDims[0] * backgroundDims[1]]))
+      background = backgroundFlat[backgroundIndices]
+      indices = indices[(background > paintThresholdMin) & (background < paintThresholdMax)]
+    if indices.size == 0:
+      return
+
+    labelFlat[indices] = paintLabel
+    k, j, i = self.unravelIndices(indices, strides)
+    extent = tuple([int(e) for e in (i.min(), i.max(), j.min(), j.max(), k.min(), k.max())])
+    self.editUtil.markVolumeNodeAsModified(labelNode, extent)
+
+  def unravelIndices(self, indices, strides):
+    """k, j, i arrays of flat voxel indices of a volume with the given
+    (1, dimX, dimX*dimY) strides"""
+    return indices // strides[2], (indices % strides[2]) // strides[1], indices % strides[1]
 
-    #
-    # set up the painter class and let 'r rip!
-    #
-    self.painter.SetBackgroundImage( backgroundImage )
-    self.painter.SetBackgroundIJKToWorld( backgroundIJKToRAS )
-    self.painter.SetWorkingImage( labelImage )
-    self.painter.SetWorkingIJKToWorld( labelIJKToRAS )
-    self.painter.SetMaskImage( mask )
-    self.painter.SetExtractImage( self.extractImage )
-    self.painter.SetReplaceImage(None)
-    self.painter.SetMaskIJKToWorld( maskIJKToRAS )
-    self.painter.SetTopLeft(tl)
-    self.painter.SetTopRight(tr)
-    self.painter.SetBottomLeft(bl)
-    self.painter.SetBottomRight(br)
-
-    self.painter.SetPaintLabel( paintLabel )
-    self.painter.SetPaintOver( paintOver )
-    self.painter.SetThresholdPaint( paintThreshold )
-    self.painter.SetThresholdPaintRange( paintThresholdMin, paintThresholdMax )
-
-    self.painter.Paint()
-
-    self.editUtil.markVolumeNodeAsModified(labelNode)
+  def applyImageMask(self, maskIJKToRAS, mask, bounds, layoutName):
+    """
+    apply a pre-rasterized image to the current label layer
+    - maskIJKToRAS tells the mapping from image pixels to RAS
+    - mask is a vtkImageData
+    - bounds are the xy extents of the mask (zlo and zhi ignored)
+    The label voxels of the slice within bounds are looked up in
+    the mask all at once and painted with paintIJK.
+    """
+    sliceLogic = self.editUtil.getSliceLogic(layoutName)
+    labelNode = sliceLogic.GetLabelLayer().GetVolumeNode()
+    if not labelNode or not labelNode.GetImageData(): return
+    grid = self.sampleGrid(bounds, layoutName)
+    if not grid: return
+    origin, columnStep, rowStep, columns, rows, scale = grid
+    rowIndices, columnIndices = numpy.indices((rows, columns))
+    ijk = (origin + numpy.outer(columnIndices.ravel(), columnStep)
+           + numpy.outer(rowIndices.ravel(), rowStep))
+
+    # label IJK to mask IJK, rounded as vtkImageSlicePaint does
+    labelIJKToRAS = self.matrixToArray(self.getIJKToRASMatrix(labelNode))
+    labelToMask = numpy.dot(numpy.linalg.inv(self.matrixToArray(maskIJKToRAS)), labelIJKToRAS)
+    maskIJK = numpy.dot(ijk, labelToMask[:2, :3].T) + labelToMask[:2, 3]
+    floor = numpy.floor(maskIJK)
+    maskIJK = numpy.maximum((floor + (maskIJK - floor > 0.5)), 0).astype(numpy.int64)
+    import vtk.util.numpy_support
+    maskDims = mask.GetDimensions()
+    maskArray = vtk.util.numpy_support.vtk_to_numpy(mask.GetPointData().GetScalars()).reshape(maskDims[1], maskDims[0])
+    inside = (maskIJK[:, 0] < maskDims[0]) & (maskIJK[:, 1] < maskDims[1])
+    ijk = ijk[inside]
+    maskIJK = maskIJK[inside]
+    self.paintIJK(ijk[maskArray[maskIJK[:, 1], maskIJK[:, 0]] != 0], layoutName)
 
   def sliceIJKPlane(self):
     """ Return a code indicating which plane of IJK
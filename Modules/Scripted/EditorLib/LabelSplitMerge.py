@@ -0,0 +1,168 @@
+import numpy
+
+#########################################################
+#
+#
+comment = """
+
+  LabelSplitMerge splits a merged label map into one array per
+  label and merges structure arrays back, working on numpy views
+  of the volumes a slab at a time.
+
+# TODO :
+"""
+#
+#########################################################
+
+class LabelSplitMerge(object):
+  """Split and merge engine for (k,j,i) label arrays.
+
+  labelBounds finds the labels present in an array and the IJK
+  extent of each label in one pass, so a structure can be extracted
+  by only visiting its bounding box.  merge combines any number of
+  structure arrays into a merge array in one pass with the rule of
+  vtkImageLabelCombine: a voxel of the merge that already has a
+  label keeps it, an empty one takes the label of the first
+  structure that has one there.  Structures can be cropped to the
+  bounding box of their labels and merged at their offset.
+  """
+
+  def __init__(self, slabThickness=16):
+    # number of k slices processed at once, bounds the size of the
+    # temporary arrays
+    self.slabThickness = slabThickness
+
+  def labelBounds(self, array, background=0):
+    """Return a dictionary of the labels present in the array (other
+    than background) to their (count, extent) where extent is
+    (iMin, iMax, jMin, jMax, kMin, kMax)
+    """
+    bounds = {}
+    for start in xrange(0, array.shape[0], self.slabThickness):
+      slab = array[start:start+self.slabThickness]
+      ks, js, ins = numpy.nonzero(slab != background)
+      if ks.size == 0:
+        continue
+      values = slab[ks, js, ins]
+      order = numpy.argsort(values, kind='mergesort')
+      values = values[order]
+      starts = numpy.concatenate(([0], numpy.nonzero(numpy.diff(values))[0] + 1))
+      counts = numpy.diff(numpy.append(starts, values.size))
+      extremes = []
+      for coordinates in (ins, js, ks + start):
+        coordinates = coordinates[order]
+        extremes.append(numpy.minimum.reduceat(coordinates, starts))
+        extremes.append(numpy.maximum.reduceat(coordinates, starts))
+      for n, label in enumerate(values[starts]):
+        label = int(label)
+        extent = [int(e[n]) for e in extremes]
+        if label in bounds:
+          count, previous = bounds[label]
+          extent = [min(previous[0], extent[0]), max(previous[1], extent[1]),
+                    min(previous[2], extent[2]), max(previous[3], extent[3]),
+                    min(previous[4], extent[4]), max(previous[5], extent[5])]
+          bounds[label] = (count + int(counts[n]), tuple(extent))
+        else:
+          bounds[label] = (int(counts[n]), tuple(extent))
+    return bounds
+
+  def labels(self, array, background=0):
+    """Sorted list of the labels present in the array"""
+    return sorted(self.labelBounds(array, background).keys())
+
+  def region(self, extent):
+    """Numpy slices of an IJK extent"""
+    return (slice(extent[4], extent[5]+1), slice(extent[2], extent[3]+1), slice(extent[0], extent[1]+1))
+
+  def extract(self, array, label, extent, target=None):
+    """Copy the voxels of label within extent into target, a zero
+    filled array of the same shape as array.  When target is None
+    only the extent is extracted: the cropped array is returned and
+    its first voxel is at (extent[0], extent[2], extent[4])
+    """
+    region = self.region(extent)
+    mask = array[region] == label
+    if target is None:
+      return (mask * array.dtype.type(label)).astype(array.dtype)
+    target[region][mask] = label
+    return target
+
+  def split(self, array, background=0, cropped=False):
+    """Yield (label, extent, structure array) for every label of the
+    array, in label order.  The structure arrays are full size, or
+    cropped to the extent of the label"""
+    bounds = self.labelBounds(array, background)
+    for label in sorted(bounds.keys()):
+      extent = bounds[label][1]
+      if cropped:
+        yield label, extent, self.extract(array, label, extent)
+      else:
+        yield label, extent, self.extract(array, label, extent, numpy.zeros_like(array))
+
+  def occupiedExtent(self, array, background=0, exclude=None):
+    """IJK extent of the voxels that are not background, or None.
+    The voxels within the extent exclude are not looked at"""
+    ks = []
+    jOccupied = numpy.zeros(array.shape[1], dtype=bool)
+    iOccupied = numpy.zeros(array.shape[2], dtype=bool)
+    for start in xrange(0, array.shape[0], self.slabThickness):
+      occupied = array[start:start+self.slabThickness] != background
+      if exclude:
+        kStart = max(exclude[4] - start, 0)
+        kEnd = min(exclude[5] + 1 - start, occupied.shape[0])
+        if kStart < kEnd:
+          occupied[kStart:kEnd, exclude[2]:exclude[3]+1, exclude[0]:exclude[1]+1] = False
+      slices = occupied.any(axis=2)
+      if not slices.any():
+        continue
+      ks += list(start + numpy.nonzero(slices.any(axis=1))[0])
+      jOccupied |= slices.any(axis=0)
+      iOccupied |= occupied.any(axis=1).any(axis=0)
+    if ks == []:
+      return None
+    js = numpy.nonzero(jOccupied)[0]
+    ins = numpy.nonzero(iOccupied)[0]
+    return (int(ins[0]), int(ins[-1]), int(js[0]), int(js[-1]), int(ks[0]), int(ks[-1]))
+
+  def merge(self, mergeArray, structureArrays, offsets=None):
+    """Combine the structure arrays into mergeArray in place, return
+    the IJK extent that changed or None.  A structure array is the
+    shape of mergeArray, or a cropped one whose first voxel is at the
+    (i, j, k) of its entry in offsets
+    """
+    if not structureArrays:
+      return None
+    if offsets is None:
+      offsets = [(0, 0, 0)] * len(structureArrays)
+    changedExtent = None
+    for start in xrange(0, mergeArray.shape[0], self.slabThickness):
+      end = min(start + self.slabThickness, mergeArray.shape[0])
+      slab = mergeArray[start:end]
+      changed = slab < 0
+      slab[changed] = 0
+      for structureArray, offset in zip(structureArrays, offsets):
+        # the k range of the structure within the slab
+        kStart = max(start, offset[2])
+        kEnd = min(end, offset[2] + structureArray.shape[0])
+        if kStart >= kEnd:
+          continue
+        mergeRegion = (slice(kStart - start, kEnd - start),
+                       slice(offset[1], offset[1] + structureArray.shape[1]),
+                       slice(offset[0], offset[0] + structureArray.shape[2]))
+        structureSlab = structureArray[kStart-offset[2]:kEnd-offset[2]]
+        target = slab[mergeRegion]
+        fill = (target == 0) & (structureSlab > 0)
+        target[fill] = structureSlab[fill]
+        changed[mergeRegion] |= fill
+      ks, js, ins = numpy.nonzero(changed)
+      if ks.size == 0:
+        continue
+      extent = (int(ins.min()), int(ins.max()), int(js.min()), int(js.max()),
+                int(ks.min()) + start, int(ks.max()) + start)
+      if changedExtent is None:
+        changedExtent = extent
+      else:
+        changedExtent = (min(changedExtent[0], extent[0]), max(changedExtent[1], extent[1]),
+                         min(changedExtent[2], extent[2]), max(changedExtent[3], extent[3]),
+                         min(changedExtent[4], extent[4]), max(changedExtent[5], extent[5]))
+    return changedExtent
@@ -254,6 +254,20 @@ int vtkPichonFastMarching::nKnownPoints(void)
   return knownPoints.size();
 }
 
+int vtkPichonFastMarching::getKnownPoints(vtkIntArray* points)
+{
+  points->SetNumberOfComponents(1);
+  if(somethingReallyWrong)
+    {
+    points->SetNumberOfTuples(0);
+    return 0;
+    }
+  points->SetNumberOfTuples(knownPoints.size());
+  for(int k=0;k<(int)knownPoints.size();k++)
+    points->SetValue(k, knownPoints[k]);
+  return knownPoints.size();
+}
+
 void vtkPichonFastMarchingExecute(vtkPichonFastMarching *self,
                 vtkImageData *vtkNotUsed(inData), short *inPtr,
                 vtkImageData *vtkNotUsed(outData), short *outPtr,
@@ -14,6 +14,7 @@
 
 // VTK includes
 #include <vtkImageData.h>
+#include <vtkIntArray.h>
 #include <vtkImageAlgorithm.h>
 #include <vtkVersion.h>
 
@@ -82,6 +83,11 @@ public:
   int nValidSeeds( void );
   int nKnownPoints(void);
 
+  /// Copy the voxel indices of the known points into \a points, in
+  /// the order the evolution reached them (increasing arrival time).
+  /// Returns the number of points.
+  int getKnownPoints(vtkIntArray* points);
+
   void setNPointsEvolution( int n );
 
   void setInData(short* data);
@@ -293,6 +293,7 @@ class PaintEffectTool(LabelEffect.LabelEffectTool):
     # interaction state variables
     self.position = [0, 0, 0]
     self.paintCoordinates = []
+    self.paintedExtent = None
     self.feedbackActors = []
     self.lastRadius = 0
 
@@ -509,11 +510,19 @@ class PaintEffectTool(LabelEffect.LabelEffectTool):
         layoutName = sliceLogic.GetSliceCompositeNode().GetLayoutName()
         self.undoRedo.saveState(layoutName)
 
-    for xy in self.paintCoordinates:
-      if self.pixelMode:
-        self.paintPixel(xy[0], xy[1])
-      else:
-        self.paintBrush(xy[0], xy[1])
+    # the brushes and pixels report the extent they touched
+    self.paintedExtent = None
+    if self.sphere and not self.pixelMode and self.paintCoordinates != []:
+      # the whole stroke is painted at once with the cached stencil
+      painted = self.paintSphereStroke(self.paintCoordinates)
+    else:
+      painted = False
+    if not painted:
+      for xy in self.paintCoordinates:
+        if self.pixelMode:
+          self.paintPixel(xy[0], xy[1])
+        else:
+          self.paintBrush(xy[0], xy[1])
     self.paintCoordinates = []
     self.paintFeedback()
 
@@ -523,7 +532,8 @@ class PaintEffectTool(LabelEffect.LabelEffectTool):
     # - so we trick it by changing the image data first
     labelLogic = sliceLogic.GetLabelLayer()
     labelNode = labelLogic.GetVolumeNode()
-    self.editUtil.markVolumeNodeAsModified(labelNode)
+    if labelNode:
+      self.editUtil.markVolumeNodeAsModified(labelNode, self.paintedExtent)
 
   def paintPixel(self, x, y):
     """
@@ -555,7 +565,61 @@ class PaintEffectTool(LabelEffect.LabelEffectTool):
     parameterNode = self.editUtil.getParameterNode()
     paintLabel = int(parameterNode.GetParameter("label"))
     labelImage.SetScalarComponentFromFloat(ijk[0],ijk[1],ijk[2],0, paintLabel)
-    self.editUtil.markVolumeNodeAsModified(labelNode)
+    pixelExtent = self.editUtil.extentOfPoints((ijk,))
+    self.paintedExtent = self.editUtil.unionExtent(self.paintedExtent, pixelExtent)
+    self.editUtil.markVolumeNodeAsModified(labelNode, pixelExtent)
+
+  def paintSphereStroke(self, coordinates):
+    """
+    paint a spherical brush at each of the xy coordinates
+    with array operations on the label image (see
+    PaintEffectLogic.paintSpheres).  Returns False when the
+    stroke has to be painted brush by brush instead: threshold
+    painting with a background that does not share the label
+    geometry needs the resampling of vtkImageSlicePaint.
+    """
+    sliceLogic = self.sliceWidget.sliceLogic()
+    sliceNode = sliceLogic.GetSliceNode()
+    labelNode = sliceLogic.GetLabelLayer().GetVolumeNode()
+    backgroundNode = sliceLogic.GetBackgroundLayer().GetVolumeNode()
+    if not labelNode or not backgroundNode:
+      return False
+    labelImage = labelNode.GetImageData()
+    backgroundImage = backgroundNode.GetImageData()
+
+    def toArray(matrix):
+      return numpy.array([[matrix.GetElement(row, column) for column in xrange(4)] for row in xrange(4)])
+    ijkToRAS = toArray(self.logic.getIJKToRASMatrix(labelNode))
+
+    parameterNode = self.editUtil.getParameterNode()
+    paintLabel = int(parameterNode.GetParameter("label"))
+    paintOver = int(parameterNode.GetParameter("LabelEffect,paintOver"))
+    paintThreshold = int(parameterNode.GetParameter("LabelEffect,paintThreshold"))
+    thresholdRange = None
+    if paintThreshold:
+      if backgroundImage.GetDimensions() != labelImage.GetDimensions():
+        return False
+      if not numpy.allclose(toArray(self.logic.getIJKToRASMatrix(backgroundNode)), ijkToRAS):
+        return False
+      thresholdRange = (float(parameterNode.GetParameter("LabelEffect,paintThresholdMin")),
+                        float(parameterNode.GetParameter("LabelEffect,paintThresholdMax")))
+
+    xyToIJK = numpy.dot(numpy.linalg.inv(ijkToRAS), toArray(sliceNode.GetXYToRAS()))
+    xy = numpy.array([(x, y, 0, 1) for x, y in coordinates], dtype=float)
+    centersIJK = numpy.dot(xy, xyToIJK.T)[:, :3]
+
+    import vtk.util.numpy_support
+    shape = list(labelImage.GetDimensions())
+    shape.reverse()
+    labelArray = vtk.util.numpy_support.vtk_to_numpy(labelImage.GetPointData().GetScalars()).reshape(shape)
+    backgroundArray = None
+    if thresholdRange is not None:
+      backgroundArray = vtk.util.numpy_support.vtk_to_numpy(backgroundImage.GetPointData().GetScalars()).reshape(shape)
+
+    extent = self.logic.paintSpheres(labelArray, backgroundArray, centersIJK, self.radius, ijkToRAS[:3, :3],
+                                     paintLabel, paintOver, thresholdRange)
+    self.paintedExtent = self.editUtil.unionExtent(self.paintedExtent, extent)
+    return True
 
   def paintBrush(self, x, y):
     """
@@ -773,6 +837,8 @@ class PaintEffectTool(LabelEffect.LabelEffectTool):
 
 
             self.painter.Paint()
+            self.paintedExtent = self.editUtil.unionExtent(self.paintedExtent,
+                self.editUtil.extentOfPoints((tltemp, trtemp, bltemp, brtemp)))
 
 
     # paint the slice: same for circular and spherical brush modes
@@ -783,6 +849,7 @@ class PaintEffectTool(LabelEffect.LabelEffectTool):
     self.painter.SetBrushCenter( brushCenter[0], brushCenter[1], brushCenter[2] )
     self.painter.SetBrushRadius( brushRadius )
     self.painter.Paint()
+    self.paintedExtent = self.editUtil.unionExtent(self.paintedExtent, self.editUtil.extentOfPoints((tl, tr, bl, br)))
 
 
 #
@@ -800,9 +867,81 @@ class PaintEffectLogic(LabelEffect.LabelEffectLogic):
   by other code without the need for a view context.
   """
 
+  # sphere brush stencils, shared by all the paint tools and
+  # keyed by radius and IJK to RAS direction
+  stencils = {}
+  maximumStencils = 16
+
   def __init__(self,sliceLogic):
     super(PaintEffectLogic,self).__init__(sliceLogic)
 
+  def sphereStencil(self, radius, ijkToRAS):
+    """Return (offsets, offsetsRAS) for a spherical brush of the given
+    radius (in mm) on a volume with the given 3x3 ijkToRAS direction
+    matrix (spacing included): the IJK offsets of all the voxels that
+    can be inside the sphere when its center lies anywhere within the
+    center voxel, and the RAS vectors of these offsets
+    """
+    key = (round(radius, 6),) + tuple(numpy.round(ijkToRAS, 6).ravel())
+    if key in self.stencils:
+      return self.stencils[key]
+    # the center can be half a voxel away from the voxel center
+    reach = radius + 0.5 * numpy.sqrt((ijkToRAS**2).sum(axis=0)).sum()
+    rasToIJK = numpy.linalg.inv(ijkToRAS)
+    halfWidths = numpy.ceil(reach * numpy.sqrt((rasToIJK**2).sum(axis=1))).astype(int)
+    grid = numpy.mgrid[-halfWidths[0]:halfWidths[0]+1,
+                       -halfWidths[1]:halfWidths[1]+1,
+                       -halfWidths[2]:halfWidths[2]+1]
+    offsets = grid.reshape(3, -1).T
+    offsetsRAS = numpy.dot(offsets, ijkToRAS.T)
+    inside = (offsetsRAS**2).sum(axis=1) <= reach * reach
+    stencil = (offsets[inside], offsetsRAS[inside])
+    if len(self.stencils) >= self.maximumStencils:
+      self.stencils.clear()
+    self.stencils[key] = stencil
+    return stencil
+
+  def paintSpheres(self, labelArray, backgroundArray, centersIJK, radius, ijkToRAS,
+                   paintLabel, paintOver=True, thresholdRange=None):
+    """Paint spheres of the given radius (mm) centered at the (n,3)
+    array of continuous IJK centersIJK into the (k,j,i) labelArray.
+    The voxel closest to each center is always included so that small
+    brushes paint at least one voxel.  Voxels that are labeled already
+    are left alone unless paintOver, and when thresholdRange is given
+    only voxels with backgroundArray values within (min, max) are
+    painted.  Returns the painted IJK extent, or None if nothing changed.
+    """
+    offsets, offsetsRAS = self.sphereStencil(radius, ijkToRAS)
+    dimensions = numpy.array(labelArray.shape[::-1])
+    strides = numpy.array([1, dimensions[0], dimensions[0] * dimensions[1]])
+    indices = []
+    for center in centersIJK:
+      if not numpy.isfinite(center).all():
+        continue
+      base = numpy.round(center).astype(int)
+      shift = numpy.dot(center - base, ijkToRAS.T)
+      inside = ((offsetsRAS - shift)**2).sum(axis=1) <= radius * radius
+      voxels = numpy.vstack((offsets[inside], [0, 0, 0])) + base
+      voxels = voxels[((voxels >= 0) & (voxels < dimensions)).all(axis=1)]
+      indices.append(numpy.dot(voxels, strides))
+    if not indices:
+      return None
+    indices = numpy.unique(numpy.concatenate(indices))
+
+    labelFlat = labelArray.ravel()
+    if not paintOver:
+      indices = indices[labelFlat[indices] == 0]
+    if thresholdRange is not None:
+      background = backgroundArray.ravel()[indices]
+      indices = indices[(background >= thresholdRange[0]) & (background <= thresholdRange[1])]
+    if indices.size == 0:
+      return None
+    labelFlat[indices] = paintLabel
+    k = indices // strides[2]
+    j = (indices % strides[2]) // strides[1]
+    i = indices % strides[1]
+    return tuple([int(e) for e in (i.min(), i.max(), j.min(), j.max(), k.min(), k.max())])
+
 
 #
 # The PaintEffect class definition
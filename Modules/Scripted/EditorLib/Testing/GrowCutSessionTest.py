@@ -0,0 +1,77 @@
+import unittest
+import vtk
+import slicer
+import EditorLib
+
+class GrowCutSessionTesting(unittest.TestCase):
+  def setUp(self):
+    slicer.mrmlScene.Clear(0)
+
+  def runTest(self):
+    self.test_GrowCutSession()
+
+  def createVolumes(self):
+    """Make a background volume with a bright cube and an empty label map"""
+    imageData = vtk.vtkImageData()
+    imageData.SetDimensions(40, 40, 40)
+    if vtk.VTK_MAJOR_VERSION <= 5:
+      imageData.SetScalarTypeToShort()
+      imageData.AllocateScalars()
+    else:
+      imageData.AllocateScalars(vtk.VTK_SHORT, 1)
+    background = slicer.vtkMRMLScalarVolumeNode()
+    background.SetName('growCutBackground')
+    background.SetAndObserveImageData(imageData)
+    slicer.mrmlScene.AddNode(background)
+    array = slicer.util.array(background.GetName())
+    array[:] = 0
+    array[10:30, 10:30, 10:30] = 100
+
+    volumesLogic = slicer.modules.volumes.logic()
+    label = volumesLogic.CreateAndAddLabelVolume(slicer.mrmlScene, background, 'growCutBackground-label')
+    return background, label
+
+  def test_GrowCutSession(self):
+    """
+    Check that a run only segments the padded box of the seeds and
+    that painting more seeds starts again from the previous result
+    """
+    background, label = self.createVolumes()
+    editUtil = EditorLib.EditUtil.EditUtil()
+    array = slicer.util.array(label.GetName())
+    array[:] = 0
+    array[18:20, 18:20, 18:20] = 1
+    array[4:6, 18:20, 18:20] = 2
+    editUtil.markVolumeNodeAsModified(label)
+
+    session = EditorLib.GrowCutSession()
+    extent = session.run(background, label, 3, 0.8, 0.003, 3)
+    self.assertEqual(extent, (15, 22, 15, 22, 1, 22))
+    self.assertFalse(session.warmStart)
+    session.apply(label)
+    editUtil.markVolumeNodeAsModified(label)
+    self.assertEqual(array[19, 19, 19], 1)
+    self.assertEqual(array[5, 19, 19], 2)
+    self.assertEqual(array[15, 15, 15], 1)
+    self.assertEqual(array[2, 15, 15], 2)
+    self.assertEqual(array[:, :, :15].max(), 0)
+    self.assertEqual(array[:, :, 23:].max(), 0)
+    self.assertTrue(sum(session.iterationTimes) <= session.timings['filter'])
+
+    # a seed painted outside the box grows the box and keeps the result
+    array[18:20, 18:20, 26:28] = 1
+    editUtil.markVolumeNodeAsModified(label)
+    extent = session.run(background, label, 3, 0.8, 0.003, 3)
+    self.assertEqual(extent, (15, 30, 15, 22, 1, 22))
+    self.assertTrue(session.warmStart)
+    session.apply(label)
+    editUtil.markVolumeNodeAsModified(label)
+    self.assertEqual(array[19, 19, 19], 1)
+    self.assertEqual(array[5, 19, 19], 2)
+    self.assertEqual(array[15, 15, 15], 1)
+    self.assertEqual(array[19, 19, 29], 1)
+    self.assertEqual(array[:, :, 31:].max(), 0)
+
+    # a new background starts over
+    background.GetImageData().Modified()
+    self.assertFalse(session.canWarmStart(background, label))
@@ -0,0 +1,79 @@
+import unittest
+import vtk
+import slicer
+import EditorLib
+
+class UndoRedoTesting(unittest.TestCase):
+  def setUp(self):
+    slicer.mrmlScene.Clear(0)
+
+  def runTest(self):
+    self.test_UndoRedo()
+
+  def createVolumes(self):
+    """Make a background volume and a label map and select them for editing"""
+    imageData = vtk.vtkImageData()
+    imageData.SetDimensions(40, 40, 40)
+    if vtk.VTK_MAJOR_VERSION <= 5:
+      imageData.SetScalarTypeToShort()
+      imageData.AllocateScalars()
+    else:
+      imageData.AllocateScalars(vtk.VTK_SHORT, 1)
+    background = slicer.vtkMRMLScalarVolumeNode()
+    background.SetName('undoRedoBackground')
+    background.SetAndObserveImageData(imageData)
+    slicer.mrmlScene.AddNode(background)
+
+    volumesLogic = slicer.modules.volumes.logic()
+    label = volumesLogic.CreateAndAddLabelVolume(slicer.mrmlScene, background, 'undoRedoBackground-label')
+    selectionNode = slicer.app.applicationLogic().GetSelectionNode()
+    selectionNode.SetReferenceActiveVolumeID(background.GetID())
+    selectionNode.SetReferenceActiveLabelVolumeID(label.GetID())
+    slicer.app.applicationLogic().PropagateVolumeSelection(0)
+    return label
+
+  def test_UndoRedo(self):
+    """
+    Check that checkpoints only keep the edited extent and that
+    undo and redo restore the label map and are counted in the metrics
+    """
+    label = self.createVolumes()
+    editUtil = EditorLib.EditUtil.EditUtil()
+    undoRedo = EditorLib.EditUtil.UndoRedo()
+    array = slicer.util.array(label.GetName())
+    array[:] = 0
+    editUtil.markVolumeNodeAsModified(label)
+
+    undoRedo.saveState('Red')
+    array[10:15, 20:22, 5:30] = 1
+    editUtil.markVolumeNodeAsModified(label)
+    undoRedo.saveState('Red')
+    array[12, 12, 12] = 2
+    editUtil.markVolumeNodeAsModified(label)
+
+    undoRedo.undo()
+    self.assertEqual(array[12, 12, 12], 0)
+    self.assertEqual(array.sum(), 5 * 2 * 25)
+    undoRedo.undo()
+    self.assertEqual(array.max(), 0)
+    self.assertFalse(undoRedo.undoEnabled())
+    undoRedo.redo()
+    undoRedo.redo()
+    self.assertEqual(array[12, 12, 12], 2)
+    self.assertEqual(array.sum(), 5 * 2 * 25 + 2)
+
+    # only the changed extents are stored
+    undoRedo.updateMetrics()
+    metrics = undoRedo.metrics
+    self.assertEqual(metrics.restores, 4)
+    self.assertEqual(metrics.rawBytes, (5 * 2 * 25 + 1) * array.dtype.itemsize)
+    self.assertTrue(metrics.undoBytes > 0)
+    self.assertEqual(metrics.redoBytes, 0)
+    self.assertEqual(metrics.shadowBytes, array.nbytes)
+    self.assertTrue(metrics.checkPoints >= 6)
+    self.assertTrue(metrics.restoresWhileStashing <= metrics.restores)
+
+    # a tiny budget keeps only the last checkpoint
+    undoRedo.memoryBudget = 1
+    undoRedo.saveState('Red')
+    self.assertEqual(len(undoRedo.undoList), 1)
@@ -1,6 +1,7 @@
 import os
 import re
 import math
+import numpy
 from __main__ import qt
 from __main__ import ctk
 from __main__ import vtk
@@ -25,6 +26,9 @@ comment = """
 class UpdateModelLive(object):
   """helper box class"""
 
+  # contour of a slice without the label
+  NoPoints = numpy.zeros((0, 3))
+
   def __init__(self, EditUtil, IsBuildLive = False, IsThreeVolumes = False):
     """the initi function"""
     self.editUtil = EditUtil
@@ -35,6 +39,11 @@ class UpdateModelLive(object):
     self.mergeCor = None
     # pairs of (node instance, observer tag number)
     self.observerTags = []
+    # merge node ID -> (first, last) slices reported as edited, and
+    # the layouts whose merge was modified, updated when the event
+    # loop is idle so that the modified events of one edit are merged
+    self.DirtySlices = {}
+    self.PendingLayouts = set()
 
     # filters
     self.ExtractVoi = vtk.vtkExtractVOI()
@@ -49,31 +58,23 @@ class UpdateModelLive(object):
     """what to do on exit"""
     for tagpair in self.observerTags:
       tagpair[0].RemoveObserver(tagpair[1])
+    self.observerTags = []
+    self.editUtil.removeVolumeModifiedCallback(self.onVolumeModified)
     self.initialise()
 
+  def getVolumeArray(self, volume):
+    """numpy (k,j,i) view of the voxels of a volume"""
+    import vtk.util.numpy_support
+    imageData = volume.GetImageData()
+    shape = list(imageData.GetDimensions())
+    shape.reverse()
+    return vtk.util.numpy_support.vtk_to_numpy(imageData.GetPointData().GetScalars()).reshape(shape)
+
   def getRealScalarRange(self, Image):
-    if not Image:
+    """the labels (other than 0) present in the volume"""
+    if not Image or not Image.GetImageData():
       return []
-    AbsScalarRange = Image.GetImageData().GetScalarRange()
-    thresholder = vtk.vtkImageThreshold()
-    thresholder.SetNumberOfThreads(1)
-    RealScalarRange = []
-    for i in xrange(int(AbsScalarRange[0]), int(AbsScalarRange[1]) + 1):
-      if vtk.VTK_MAJOR_VERSION <= 5:
-        thresholder.SetInput(Image.GetImageData())
-      else:
-        thresholder.SetInputConnection(Image.GetImageDataConnection())
-      thresholder.SetInValue(i)
-      thresholder.SetInValue(i)
-      thresholder.SetOutValue(0)
-      thresholder.ReplaceInOn()
-      thresholder.ReplaceOutOn()
-      thresholder.ThresholdBetween(i, i)
-      thresholder.SetOutputScalarType(Image.GetImageData().GetScalarType())
-      thresholder.Update()
-      if thresholder.GetOutput().GetScalarRange() != (0.0, 0.0):
-        RealScalarRange.append(i)
-    return RealScalarRange
+    return [int(l) for l in numpy.unique(self.getVolumeArray(Image)) if l != 0]
 
   def setMerge(self, merge, layoutName):
     """setter for merge volume"""
@@ -88,6 +89,7 @@ class UpdateModelLive(object):
       if self.mergeAxi:
         tag = self.mergeAxi.AddObserver(vtk.vtkCommand.ModifiedEvent, self.mergeAxiUpdated)
         self.observerTags.append((self.mergeAxi, tag))
+        self.editUtil.addVolumeModifiedCallback(self.onVolumeModified)
         ScalarRange = self.mergeAxi.GetImageData().GetScalarRange()
         self.ScalarRangeAxi = int(ScalarRange[1])
         self.initialiseContoursAxi()
@@ -100,6 +102,7 @@ class UpdateModelLive(object):
       if self.mergeSag:
         tag = self.mergeSag.AddObserver(vtk.vtkCommand.ModifiedEvent, self.mergeSagUpdated)
         self.observerTags.append((self.mergeSag, tag))
+        self.editUtil.addVolumeModifiedCallback(self.onVolumeModified)
         ScalarRange = self.mergeSag.GetImageData().GetScalarRange()
         self.ScalarRangeSag = int(ScalarRange[1])
         self.initialiseContoursSag()
@@ -112,6 +115,7 @@ class UpdateModelLive(object):
       if self.mergeCor:
         tag = self.mergeCor.AddObserver(vtk.vtkCommand.ModifiedEvent, self.mergeCorUpdated)
         self.observerTags.append((self.mergeCor, tag))
+        self.editUtil.addVolumeModifiedCallback(self.onVolumeModified)
         ScalarRange = self.mergeCor.GetImageData().GetScalarRange()
         self.ScalarRangeCor = int(ScalarRange[1])
         self.initialiseContoursCor()
@@ -144,7 +148,7 @@ class UpdateModelLive(object):
         self.buildAddedModels(LabelNumber, VolumeNodes)
 
   def getContourPoints2D(self, image, LabelNumber, SliceNumber):
-    """extracting the 2D contours"""
+    """extracting the 2D contours, returned as an (n,3) array of IJK points"""
     #print('getContourPoints2D', LabelNumber)
     if vtk.VTK_MAJOR_VERSION <= 5:
       self.ImageThresholdFilter.SetInput(image)
@@ -166,87 +170,83 @@ class UpdateModelLive(object):
     self.ExternalContourFilter.SetSliceNumber(SliceNumber)
     self.ExternalContourFilter.Update()
 
-    ContourPixels = vtk.vtkPoints()
-    ContourPixels.DeepCopy(self.ExternalContourFilter.GetOutput().GetPoints())
-    return ContourPixels
-
-  def getNumberOfContourPixels(self, ContourPixels, dim, exc = -1):
-    """computes the number pixels in the list of contour pixels"""
-    nPixels = 0
-    for i in range(exc) + range(exc + 1, dim):
-      nPixels = nPixels + ContourPixels[i].GetNumberOfPoints()
-    return nPixels
+    return self.arrayFromPoints(self.ExternalContourFilter.GetOutput().GetPoints())
 
-  def getContourPoints3D(self, volume, ContourPoints, ContourPixels, LabelNumber, CurrentSlice = -1):
-    """attaching the 2D contours in a 3D volume"""
+  def getContourPoints3D(self, volume, ContourPoints, ContourPixels, LabelNumber, Slices = None):
+    """attaching the 2D contours in a 3D volume.
+    ContourPixels holds the contour of each label on each slice,
+    only the given Slices (all if None) and the slices never
+    extracted are updated, slices without the label are skipped.
+    """
     #print('getContourPoints3D', LabelNumber)
     volumeImageData = volume.GetImageData()
     dim = volumeImageData.GetDimensions()
-    imageOrigin = volume.GetOrigin()
-    imageSpacing = volume.GetSpacing()
+    SlicePixels = ContourPixels.get(LabelNumber)
 
     if vtk.VTK_MAJOR_VERSION <= 5:
       self.ExtractVoi.SetInput(volumeImageData)
     else:
       self.ExtractVoi.SetInputData(volumeImageData)
 
-    if CurrentSlice == -1:
+    if Slices is None:
       SlicesRange = range(dim[2])
-      nPixels = 0
     else:
-      SlicesRange = range(CurrentSlice, CurrentSlice + 1)
-      nPixels = self.getNumberOfContourPixels(ContourPixels.get(LabelNumber), dim[2], CurrentSlice)
+      SlicesRange = set([i for i in Slices if i >= 0 and i < dim[2]])
+      SlicesRange.update([i for i in xrange(dim[2]) if SlicePixels[i] is None])
+      SlicesRange = sorted(SlicesRange)
+
+    # one pass over the volume tells which of the slices hold the label
+    volumeArray = self.getVolumeArray(volume)
+    if len(SlicesRange) == dim[2]:
+      LabelSlices = (volumeArray == LabelNumber).reshape(dim[2], -1).any(axis=1)
+    else:
+      LabelSlices = numpy.zeros(dim[2], dtype=bool)
+      for i in SlicesRange:
+        LabelSlices[i] = (volumeArray[i] == LabelNumber).any()
+
     for i in SlicesRange:
+      if not LabelSlices[i]:
+        SlicePixels[i] = self.NoPoints
+        continue
       self.ExtractVoi.SetVOI(0, dim[0], 0, dim[1], i, i)
       self.ExtractVoi.Update()
       currentSlice = vtk.vtkImageData()
       currentSlice.DeepCopy(self.ExtractVoi.GetOutput())
-      ContourPixels.get(LabelNumber)[i] = self.getContourPoints2D(currentSlice, LabelNumber, i)
-      nPixels = nPixels + ContourPixels.get(LabelNumber)[i].GetNumberOfPoints()
-
-    AllContourPixels = vtk.vtkPoints()
-    AllContourPixels.SetNumberOfPoints(nPixels)
-    j = 0
-    for i in range(dim[2]):
-      AllContourPixels = self.appendPoints(AllContourPixels, ContourPixels.get(LabelNumber)[i], j)
-      j = j + ContourPixels.get(LabelNumber)[i].GetNumberOfPoints()
+      SlicePixels[i] = self.getContourPoints2D(currentSlice, LabelNumber, i)
 
-    ContourPoints.update({LabelNumber : vtk.vtkPoints()})
+    # concatenate the slices and map them to RAS in bulk
+    AllContourPixels = numpy.concatenate(SlicePixels)
     IJKToRASMat = vtk.vtkMatrix4x4()
     volume.GetIJKToRASMatrix(IJKToRASMat)
-    IJKToRASTransform = vtk.vtkTransform()
-    IJKToRASTransform.SetMatrix(IJKToRASMat)
-    IJKToRASTransform.TransformPoints(AllContourPixels, ContourPoints.get(LabelNumber))
+    IJKToRAS = numpy.array([[IJKToRASMat.GetElement(r, c) for c in xrange(4)] for r in xrange(3)])
+    AllContourPoints = numpy.dot(AllContourPixels, IJKToRAS[:, :3].T) + IJKToRAS[:, 3]
+    ContourPoints.update({LabelNumber : self.pointsFromArray(AllContourPoints)})
 
     return [ContourPoints, ContourPixels]
 
-  def appendPoints(self, ContourPoints, AppendPoints, CurrentIndex):
-    """append one vtkPoints to another one"""
-    for j in range(AppendPoints.GetNumberOfPoints()):
-      ContourPoints.InsertPoint(CurrentIndex, AppendPoints.GetPoint(j))
-      CurrentIndex = CurrentIndex + 1
-    return ContourPoints
+  def arrayFromPoints(self, Points):
+    """copy of the coordinates of a vtkPoints as an (n,3) array"""
+    if not Points or Points.GetNumberOfPoints() == 0:
+      return self.NoPoints
+    import vtk.util.numpy_support
+    return vtk.util.numpy_support.vtk_to_numpy(Points.GetData()).astype(numpy.float64)
+
+  def pointsFromArray(self, Array):
+    """vtkPoints holding a copy of an (n,3) array"""
+    import vtk.util.numpy_support
+    Points = vtk.vtkPoints()
+    if len(Array):
+      Points.SetData(vtk.util.numpy_support.numpy_to_vtk(numpy.ascontiguousarray(Array, dtype=numpy.float64), deep=1))
+    return Points
 
   def copyViewPointsInAll(self, LabelNumber, ContourPoints):
     """copies all the contour points to one vtkPoints"""
-    NumberOfPoints = 0
-    for ContourPoint in ContourPoints:
-      CurrentPoints = ContourPoint.get(LabelNumber)
-      if CurrentPoints == None:
-        CurrentPoints = vtk.vtkPoints()
-      NumberOfPoints = NumberOfPoints + CurrentPoints.GetNumberOfPoints()
-
-    ContourPointsAll = vtk.vtkPoints()
-    ContourPointsAll.SetNumberOfPoints(NumberOfPoints)
-    CurrentIndex = 0
+    Arrays = [self.NoPoints]
     for ContourPoint in ContourPoints:
       CurrentPoints = ContourPoint.get(LabelNumber)
-      if CurrentPoints == None:
-        CurrentPoints = vtk.vtkPoints()
-      ContourPointsAll = self.appendPoints(ContourPointsAll, CurrentPoints, CurrentIndex)
-      CurrentIndex = CurrentIndex + CurrentPoints.GetNumberOfPoints()
-
-    return ContourPointsAll
+      if CurrentPoints != None:
+        Arrays.append(self.arrayFromPoints(CurrentPoints))
+    return self.pointsFromArray(numpy.concatenate(Arrays))
 
   def findActiveSlice(self):
     """checks all the three layouts to find the correct active slice"""
@@ -274,36 +274,102 @@ class UpdateModelLive(object):
   def initialiseLabel(self, LabelNumber, ArePixelsChanged = False):
     if LabelNumber not in self.AddedLabels:
       self.AddedLabels.append(LabelNumber)
+    # slices are None until their contours are extracted
     if self.mergeAxi and self.ContourPixelsAxi0n.get(LabelNumber) == None:
       dim = self.mergeAxi.GetImageData().GetDimensions()
-      self.ContourPixelsAxi0n.update({LabelNumber : [vtk.vtkPoints()] * dim[2]})
+      self.ContourPixelsAxi0n.update({LabelNumber : [None] * dim[2]})
       self.ContourPointsAxi.update({LabelNumber : vtk.vtkPoints()})
       self.ContourPointsAxiChanged.update({LabelNumber : ArePixelsChanged})
     if self.mergeSag and self.ContourPixelsSag0n.get(LabelNumber) == None:
       dim = self.mergeSag.GetImageData().GetDimensions()
-      self.ContourPixelsSag0n.update({LabelNumber : [vtk.vtkPoints()] * dim[2]})
+      self.ContourPixelsSag0n.update({LabelNumber : [None] * dim[2]})
       self.ContourPointsSag.update({LabelNumber : vtk.vtkPoints()})
       self.ContourPointsSagChanged.update({LabelNumber : ArePixelsChanged})
     if self.mergeCor and self.ContourPixelsCor0n.get(LabelNumber) == None:
       dim = self.mergeCor.GetImageData().GetDimensions()
-      self.ContourPixelsCor0n.update({LabelNumber : [vtk.vtkPoints()] * dim[2]})
+      self.ContourPixelsCor0n.update({LabelNumber : [None] * dim[2]})
       self.ContourPointsCor.update({LabelNumber : vtk.vtkPoints()})
       self.ContourPointsCorChanged.update({LabelNumber : ArePixelsChanged})
 
+  def onVolumeModified(self, volumeNode, extent):
+    """remember the slices of the merge volumes reported as edited"""
+    if volumeNode not in (self.mergeAxi, self.mergeSag, self.mergeCor):
+      return
+    NodeID = volumeNode.GetID()
+    if extent is None:
+      self.DirtySlices[NodeID] = None
+    elif NodeID not in self.DirtySlices:
+      self.DirtySlices[NodeID] = (extent[4], extent[5])
+    elif self.DirtySlices[NodeID] is not None:
+      First, Last = self.DirtySlices[NodeID]
+      self.DirtySlices[NodeID] = (min(First, extent[4]), max(Last, extent[5]))
+
+  def scheduleUpdate(self, LayoutName):
+    if not self.PendingLayouts:
+      qt.QTimer.singleShot(0, self.processPendingUpdates)
+    self.PendingLayouts.add(LayoutName)
+
+  def processPendingUpdates(self):
+    """update the contours of the edited slices, or of the active
+    slice when the modification did not report an extent"""
+    PendingLayouts = self.PendingLayouts
+    self.PendingLayouts = set()
+    for LayoutName, merge, update in (('Red', self.mergeAxi, self.updateModelFromAxi),
+                                      ('Yellow', self.mergeSag, self.updateModelFromSag),
+                                      ('Green', self.mergeCor, self.updateModelFromCor)):
+      if LayoutName not in PendingLayouts or not merge:
+        continue
+      CurrentLabelNumber = self.editUtil.getLabel()
+      if merge.GetID() in self.DirtySlices:
+        SliceRange = self.DirtySlices.pop(merge.GetID())
+        Slices = None if SliceRange is None else range(SliceRange[0], SliceRange[1] + 1)
+      else:
+        CurrentSlice = self.getActiveSlice(LayoutName)
+        Slices = None if CurrentSlice is None else [CurrentSlice]
+      update(CurrentLabelNumber, Slices)
+
   def mergeAxiUpdated(self, caller, event):
-    CurrentLabelNumber = self.editUtil.getLabel()
-    CurrentSlice = self.getActiveSlice('Red')
-    self.updateModelFromAxi(CurrentLabelNumber, CurrentSlice)
+    self.scheduleUpdate('Red')
 
   def mergeSagUpdated(self, caller, event):
-    CurrentLabelNumber = self.editUtil.getLabel()
-    CurrentSlice = self.getActiveSlice('Yellow')
-    self.updateModelFromSag(CurrentLabelNumber, CurrentSlice)
+    self.scheduleUpdate('Yellow')
 
   def mergeCorUpdated(self, caller, event):
-    CurrentLabelNumber = self.editUtil.getLabel()
-    CurrentSlice = self.getActiveSlice('Green')
-    self.updateModelFromCor(CurrentLabelNumber, CurrentSlice)
+    self.scheduleUpdate('Green')
+
+  def getLabelRange(self, ContourPixels, CurrentLabelNumber, Slices):
+    """the labels whose contours may change on the given slices: the
+    current label and the labels that had contours there, which may
+    have been painted over (all the labels when erasing)"""
+    if CurrentLabelNumber == 0:
+      return list(ContourPixels.iterkeys())
+    LabelRange = [CurrentLabelNumber]
+    if Slices is None:
+      return LabelRange
+    for LabelNumber, SlicePixels in ContourPixels.iteritems():
+      if LabelNumber != CurrentLabelNumber:
+        for i in Slices:
+          if i >= 0 and i < len(SlicePixels) and SlicePixels[i] is not None and len(SlicePixels[i]):
+            LabelRange.append(LabelNumber)
+            break
+    return LabelRange
+
+  def setSlicesChanged(self, ContourPointsChanged, LabelNumber, Slices):
+    """a label needs a new model: True for all the slices or the
+    set of the changed slices"""
+    Changed = ContourPointsChanged.get(LabelNumber)
+    if Slices is None or Changed is True:
+      ContourPointsChanged.update({LabelNumber : True})
+    elif not Changed:
+      ContourPointsChanged.update({LabelNumber : set(Slices)})
+    else:
+      Changed.update(Slices)
+
+  def getChangedSlices(self, ContourPointsChanged, LabelNumber):
+    Changed = ContourPointsChanged.get(LabelNumber)
+    if Changed is True:
+      return None
+    return sorted(Changed)
 
   def updateDefaultMerges(self, LabelNumber):
     """updates the models of the current merges"""
@@ -311,46 +377,40 @@ class UpdateModelLive(object):
     ContourPointsAll = self.copyViewPointsInAll(LabelNumber, [self.ContourPointsAxi, self.ContourPointsSag, self.ContourPointsCor])
     self.updateModel(ContourPointsAll, LabelNumber)
 
-  def updateModelFromAxi(self, CurrentLabelNumber, CurrentSlice = -1):
-    """updates the model based on the changes in axial view"""
+  def updateModelFromAxi(self, CurrentLabelNumber, Slices = None):
+    """updates the model based on the changes in axial view
+    on the given slices (all if None)"""
     print 'updateModelFromAxi'
-    if CurrentLabelNumber == 0:
-      LabelRange = self.ContourPixelsAxi0n.iterkeys()
-    else:
-      LabelRange = range(CurrentLabelNumber, CurrentLabelNumber + 1)
+    LabelRange = self.getLabelRange(self.ContourPixelsAxi0n, CurrentLabelNumber, Slices)
     for LabelNumber in LabelRange:
       self.initialiseLabel(LabelNumber)
-      self.ContourPointsAxiChanged.update({LabelNumber : True})
+      self.setSlicesChanged(self.ContourPointsAxiChanged, LabelNumber, Slices)
       if self.IsBuildLive:
-        self.ContourPointsAxi, self.ContourPixelsAxi0n = self.getContourPoints3D(self.mergeAxi, self.ContourPointsAxi, self.ContourPixelsAxi0n, LabelNumber, CurrentSlice)
+        self.ContourPointsAxi, self.ContourPixelsAxi0n = self.getContourPoints3D(self.mergeAxi, self.ContourPointsAxi, self.ContourPixelsAxi0n, LabelNumber, Slices)
         self.updateDefaultMerges(LabelNumber)
 
-  def updateModelFromSag(self, CurrentLabelNumber, CurrentSlice = -1):
-    """updates the model based on the changes in sagittal view"""
+  def updateModelFromSag(self, CurrentLabelNumber, Slices = None):
+    """updates the model based on the changes in sagittal view
+    on the given slices (all if None)"""
     print 'updateModelFromSag'
-    if CurrentLabelNumber == 0:
-      LabelRange = self.ContourPixelsSag0n.iterkeys()
-    else:
-      LabelRange = range(CurrentLabelNumber, CurrentLabelNumber + 1)
+    LabelRange = self.getLabelRange(self.ContourPixelsSag0n, CurrentLabelNumber, Slices)
     for LabelNumber in LabelRange:
       self.initialiseLabel(LabelNumber)
-      self.ContourPointsSagChanged.update({LabelNumber : True})
+      self.setSlicesChanged(self.ContourPointsSagChanged, LabelNumber, Slices)
       if self.IsBuildLive:
-        self.ContourPointsSag, self.ContourPixelsSag0n = self.getContourPoints3D(self.mergeSag, self.ContourPointsSag, self.ContourPixelsSag0n, LabelNumber, CurrentSlice)
+        self.ContourPointsSag, self.ContourPixelsSag0n = self.getContourPoints3D(self.mergeSag, self.ContourPointsSag, self.ContourPixelsSag0n, LabelNumber, Slices)
         self.updateDefaultMerges(LabelNumber)
 
-  def updateModelFromCor(self, CurrentLabelNumber, CurrentSlice = -1):
-    """updates the model based on the changes in coronal view"""
+  def updateModelFromCor(self, CurrentLabelNumber, Slices = None):
+    """updates the model based on the changes in coronal view
+    on the given slices (all if None)"""
     print 'updateModelFromCor'
-    if CurrentLabelNumber == 0:
-      LabelRange = self.ContourPixelsCor0n.iterkeys()
-    else:
-      LabelRange = range(CurrentLabelNumber, CurrentLabelNumber + 1)
+    LabelRange = self.getLabelRange(self.ContourPixelsCor0n, CurrentLabelNumber, Slices)
     for LabelNumber in LabelRange:
       self.initialiseLabel(LabelNumber)
-      self.ContourPointsCorChanged.update({LabelNumber : True})
+      self.setSlicesChanged(self.ContourPointsCorChanged, LabelNumber, Slices)
       if self.IsBuildLive:
-        self.ContourPointsCor, self.ContourPixelsCor0n = self.getContourPoints3D(self.mergeCor, self.ContourPointsCor, self.ContourPixelsCor0n, LabelNumber, CurrentSlice)
+        self.ContourPointsCor, self.ContourPixelsCor0n = self.getContourPoints3D(self.mergeCor, self.ContourPointsCor, self.ContourPixelsCor0n, LabelNumber, Slices)
         self.updateDefaultMerges(LabelNumber)
 
   def addToAddedLabels(self, NewLabels):
@@ -382,13 +442,16 @@ class UpdateModelLive(object):
     self.initialiseLabel(LabelNumber)
     UpdateTheModel = False
     if self.ContourPointsAxiChanged.get(LabelNumber) and VolumeAxi:
-      self.ContourPointsAxi, self.ContourPixelsAxi0n = self.getContourPoints3D(VolumeAxi, self.ContourPointsAxi, self.ContourPixelsAxi0n, LabelNumber)
+      Slices = self.getChangedSlices(self.ContourPointsAxiChanged, LabelNumber)
+      self.ContourPointsAxi, self.ContourPixelsAxi0n = self.getContourPoints3D(VolumeAxi, self.ContourPointsAxi, self.ContourPixelsAxi0n, LabelNumber, Slices)
       UpdateTheModel = True
     if self.ContourPointsSagChanged.get(LabelNumber) and VolumeSag:
-      self.ContourPointsSag, self.ContourPixelsSag0n = self.getContourPoints3D(VolumeSag, self.ContourPointsSag, self.ContourPixelsSag0n, LabelNumber)
+      Slices = self.getChangedSlices(self.ContourPointsSagChanged, LabelNumber)
+      self.ContourPointsSag, self.ContourPixelsSag0n = self.getContourPoints3D(VolumeSag, self.ContourPointsSag, self.ContourPixelsSag0n, LabelNumber, Slices)
       UpdateTheModel = True
     if self.ContourPointsCorChanged.get(LabelNumber) and VolumeCor:
-      self.ContourPointsCor, self.ContourPixelsCor0n = self.getContourPoints3D(VolumeCor, self.ContourPointsCor, self.ContourPixelsCor0n, LabelNumber)
+      Slices = self.getChangedSlices(self.ContourPointsCorChanged, LabelNumber)
+      self.ContourPointsCor, self.ContourPixelsCor0n = self.getContourPoints3D(VolumeCor, self.ContourPointsCor, self.ContourPixelsCor0n, LabelNumber, Slices)
       UpdateTheModel = True
     if UpdateTheModel:
       self.updateDefaultMerges(LabelNumber)
@@ -398,7 +461,7 @@ class UpdateModelLive(object):
     ContourPoints = []
     for VolumeNode in VolumeNodes:
       dim = VolumeNode.GetImageData().GetDimensions()
-      NodeContourPixels = {LabelNumber : [vtk.vtkPoints()] * dim[2]}
+      NodeContourPixels = {LabelNumber : [None] * dim[2]}
       NodeContourPoints = {LabelNumber : vtk.vtkPoints()}
       NodeContourPoints, NodeContourPixels = self.getContourPoints3D(VolumeNode, NodeContourPoints, NodeContourPixels, LabelNumber)
       ContourPoints.append(NodeContourPoints)
@@ -279,39 +279,33 @@ class WandEffectLogic(LabelEffect.LabelEffectLogic):
     backgroundArray = vtk.util.numpy_support.vtk_to_numpy(backgroundImage.GetPointData().GetScalars()).reshape(shape)
     labelArray = vtk.util.numpy_support.vtk_to_numpy(labelImage.GetPointData().GetScalars()).reshape(shape)
 
+    # check if IJK is inside the image
+    for e, d in zip(ijk, shape): # clamp to volume extent
+      if e < 0 or e >= d:
+        return
+
     if self.fillMode == 'Plane':
-      # select the plane corresponding to current slice orientation
-      # for the input volume
+      # grow within the plane corresponding to current slice
+      # orientation: all (k,j,i) axes but the one normal to it
       ijkPlane = self.sliceIJKPlane()
-      i,j,k = ijk
       if ijkPlane == 'JK':
-        backgroundDrawArray = backgroundArray[:,:,k]
-        labelDrawArray = labelArray[:,:,k]
-        ijk = (i, j)
-      if ijkPlane == 'IK':
-        backgroundDrawArray = backgroundArray[:,j,:]
-        labelDrawArray = labelArray[:,j,:]
-        ijk = (i, k)
-      if ijkPlane == 'IJ':
-        backgroundDrawArray = backgroundArray[i,:,:]
-        labelDrawArray = labelArray[i,:,:]
-        ijk = (j, k)
-    elif self.fillMode == 'Volume':
-      backgroundDrawArray = backgroundArray
-      labelDrawArray = labelArray
-
-    # check if IJK is inside the image
-    dims = labelImage.GetDimensions()
-    for e, d in zip(ijk, dims): # clamp to volume extent
-      if e < 0 or e >= d:
+        axes = (0, 1)
+      elif ijkPlane == 'IK':
+        axes = (0, 2)
+      elif ijkPlane == 'IJ':
+        axes = (1, 2)
+      else:
+        # oblique slice, no plane of the volume to fill
         return
+    elif self.fillMode == 'Volume':
+      axes = (0, 1, 2)
 
     #
-    # do a recursive search for pixels to change
+    # grow the region of pixels to change
     #
     layoutName = self.sliceLogic.GetSliceCompositeNode().GetLayoutName()
     self.undoRedo.saveState(layoutName)
-    value = backgroundDrawArray[ijk]
+    value = backgroundArray[ijk]
     label = self.editUtil.getLabel()
     if paintThreshold:
       lo = thresholdMin
@@ -319,60 +313,73 @@ class WandEffectLogic(LabelEffect.LabelEffectLogic):
     else:
       lo = value - tolerance
       hi = value + tolerance
-    pixelsSet = 0
-    toVisit = [ijk,]
-    # Create a map that contains the location of the pixels
-    # that have been already visited (added or considered to be added).
-    # This is required if paintOver is enabled because then we reconsider
-    # all pixels (not just the ones that have not labelled yet).
-    if paintOver:
-      labelDrawVisitedArray = numpy.zeros(labelDrawArray.shape,dtype='bool')
-
-    while toVisit != []:
-      location = toVisit.pop(0)
-      try:
-        l = labelDrawArray[location]
-        b = backgroundDrawArray[location]
-      except IndexError:
-        continue
-      if (not paintOver and l != 0):
-        # label filled already and not painting over, leave it alone
-        continue
-      if (paintOver and l == label):
-        # label is the current one, but maybe it was filled with another high/low value,
-        # so we have to visit it once (and only once) in this session, too
-        if  labelDrawVisitedArray[location]:
-          # visited already, so don't try to fill it again
-          continue
-        else:
-          # we'll visit this pixel now, so mark it as visited
-          labelDrawVisitedArray[location] = True
-      if b < lo or b > hi:
-        continue
-      labelDrawArray[location] = label
-      if l != label:
-        # only count those pixels that were changed (to allow step-by-step growing by multiple mouse clicks)
-        pixelsSet += 1
-      if pixelsSet > maxPixels:
-        toVisit = []
-      else:
-        if self.fillMode == 'Plane':
-          # add the 4 neighbors to the stack
-          toVisit.append((location[0] - 1, location[1]     ))
-          toVisit.append((location[0] + 1, location[1]     ))
-          toVisit.append((location[0]    , location[1] - 1 ))
-          toVisit.append((location[0]    , location[1] + 1 ))
-        elif self.fillMode == 'Volume':
-          # add the 6 neighbors to the stack
-          toVisit.append((location[0] - 1, location[1]    , location[2]    ))
-          toVisit.append((location[0] + 1, location[1]    , location[2]    ))
-          toVisit.append((location[0]    , location[1] - 1, location[2]    ))
-          toVisit.append((location[0]    , location[1] + 1, location[2]    ))
-          toVisit.append((location[0]    , location[1]    , location[2] - 1))
-          toVisit.append((location[0]    , location[1]    , location[2] + 1))
+    filled = self.floodFill(backgroundArray, labelArray, ijk, axes, lo, hi, label, paintOver, maxPixels)
+    if filled.size == 0:
+      return
+    labelArray.flat[filled] = label
 
     # signal to slicer that the label needs to be updated
-    self.editUtil.markVolumeNodeAsModified(labelNode)
+    sliceSize = labelArray.shape[1] * labelArray.shape[2]
+    k = filled // sliceSize
+    j = (filled % sliceSize) // labelArray.shape[2]
+    i = filled % labelArray.shape[2]
+    extent = (i.min(), i.max(), j.min(), j.max(), k.min(), k.max())
+    self.editUtil.markVolumeNodeAsModified(labelNode, tuple([int(e) for e in extent]))
+
+  def floodFill(self, backgroundArray, labelArray, seed, axes, lo, hi, label, paintOver, maxPixels):
+    """Return the flat indices of the pixels connected to seed (a k,j,i
+    index) that the wand sets to label, growing along the given array
+    axes (face neighbors only).
+    A pixel can be filled when its background value is within [lo,hi]
+    and it is unlabeled, or any label with paintOver.  The region grows
+    one breadth-first layer at a time with whole-frontier numpy
+    operations, each pixel is visited once.  Growing stops as soon as
+    more than maxPixels pixels would change label (pixels that
+    already have the label don't count, so repeated clicks keep
+    growing the region): the last layer is truncated in scan order.
+    """
+    import numpy
+    backgroundFlat = backgroundArray.ravel()
+    labelFlat = labelArray.ravel()
+    strides = (labelArray.shape[1] * labelArray.shape[2], labelArray.shape[2], 1)
+
+    def fillable(indices):
+      b = backgroundFlat[indices]
+      ok = (b >= lo) & (b <= hi)
+      if not paintOver:
+        ok &= labelFlat[indices] == 0
+      return indices[ok]
+
+    seedIndex = numpy.array([seed[0] * strides[0] + seed[1] * strides[1] + seed[2]])
+    frontier = fillable(seedIndex)
+    # numpy.zeros is lazily allocated, only the touched pages are used
+    visited = numpy.zeros(labelFlat.size, dtype=bool)
+    visited[frontier] = True
+    layers = []
+    pixelsSet = 0
+    while frontier.size:
+      changes = numpy.cumsum(labelFlat[frontier] != label)
+      if pixelsSet + changes[-1] > maxPixels:
+        # keep up to and including the pixel that exceeds maxPixels
+        last = numpy.searchsorted(changes, maxPixels - pixelsSet, side='right')
+        layers.append(frontier[:last+1])
+        break
+      pixelsSet += changes[-1]
+      layers.append(frontier)
+
+      neighbors = []
+      for axis in axes:
+        coordinate = (frontier // strides[axis]) % labelArray.shape[axis]
+        neighbors.append(frontier[coordinate > 0] - strides[axis])
+        neighbors.append(frontier[coordinate < labelArray.shape[axis] - 1] + strides[axis])
+      neighbors = numpy.unique(numpy.concatenate(neighbors))
+      neighbors = fillable(neighbors[~visited[neighbors]])
+      visited[neighbors] = True
+      frontier = neighbors
+
+    if not layers:
+      return numpy.zeros(0, dtype=numpy.intp)
+    return numpy.concatenate(layers)
 
 #
 # The WandEffect class definition
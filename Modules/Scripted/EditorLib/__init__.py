@@ -32,3 +32,4 @@ from FastMarchingEffect import *
 from WandEffect import *
 from SelectDirection import *
 from UpdateModelLive import *
+from LabelSplitMerge import *
@@ -37,6 +37,7 @@ class LabelStatisticsWidget:
     self.labelNode = None
     self.fileName = None
     self.fileDialog = None
+    self.cache = LabelStatisticsCache()
     if not parent:
       self.setup()
       self.grayscaleSelector.setMRMLScene(slicer.mrmlScene)
@@ -94,6 +95,20 @@ class LabelStatisticsWidget:
     self.labelSelector.setToolTip( "Pick the label map to edit" )
     self.labelSelectorFrame.layout().addWidget( self.labelSelector )
 
+    # Extended statistics
+    self.extendedCheckBox = qt.QCheckBox()
+    self.extendedCheckBox.setText('Extended statistics')
+    self.extendedCheckBox.checked = False
+    self.extendedCheckBox.setToolTip('Also calculate median, 5th/95th percentiles, centroid and bounding box of each label')
+    self.parent.layout().addWidget(self.extendedCheckBox)
+
+    # Live update
+    self.liveCheckBox = qt.QCheckBox()
+    self.liveCheckBox.setText('Update live')
+    self.liveCheckBox.checked = False
+    self.liveCheckBox.setToolTip('Update the statistics (except extended ones) while the label map is edited in the Editor')
+    self.parent.layout().addWidget(self.liveCheckBox)
+
     # Apply button
     self.applyButton = qt.QPushButton("Apply")
     self.applyButton.toolTip = "Calculate Statistics."
@@ -136,6 +151,7 @@ class LabelStatisticsWidget:
     self.applyButton.connect('clicked()', self.onApply)
     self.chartButton.connect('clicked()', self.onChart)
     self.saveButton.connect('clicked()', self.onSave)
+    self.liveCheckBox.connect('toggled(bool)', self.onLiveToggled)
     self.grayscaleSelector.connect('currentNodeChanged(vtkMRMLNode*)', self.onGrayscaleSelect)
     self.labelSelector.connect('currentNodeChanged(vtkMRMLNode*)', self.onLabelSelect)
 
@@ -162,11 +178,32 @@ class LabelStatisticsWidget:
     # TODO: why doesn't processEvents alone make the label text change?
     self.applyButton.repaint()
     slicer.app.processEvents()
-    self.logic = LabelStatisticsLogic(self.grayscaleNode, self.labelNode)
+    self.logic = LabelStatisticsLogic(self.grayscaleNode, self.labelNode, extendedStatistics=self.extendedCheckBox.checked)
     self.populateStats()
     self.chartFrame.enabled = True
     self.saveButton.enabled = True
     self.applyButton.text = "Apply"
+    if self.liveCheckBox.checked:
+      # start following the edits from the current state
+      self.cache.labelStats(self.grayscaleNode, self.labelNode)
+
+  def onLiveToggled(self, checked):
+    if checked:
+      self.cache.start()
+      self.cache.modifiedCallbacks.append(self.onLabelEdited)
+      if self.logic:
+        self.cache.labelStats(self.grayscaleNode, self.labelNode)
+    else:
+      self.cache.stop()
+      self.cache.modifiedCallbacks = []
+
+  def onLabelEdited(self, labelNode):
+    """Refresh the table from the incrementally updated statistics
+    """
+    if not self.logic or self.logic.extendedStatistics or labelNode != self.labelNode:
+      return
+    self.logic.labelStats = self.cache.labelStats(self.grayscaleNode, self.labelNode)
+    self.populateStats()
 
   def onChart(self):
     """chart the label statistics
@@ -233,14 +270,35 @@ class LabelStatisticsLogic:
   """Implement the logic to calculate label statistics.
   Nodes are passed in as arguments.
   Results are stored as 'statistics' instance variable.
+  The engine selects how the statistics are computed:
+  'SinglePass' reduces all labels at once over numpy views of the
+  image data, 'Streaming' does the same reduction slab by slab along K
+  to bound the temporary memory, 'PerLabel' runs a
+  threshold/stencil/accumulate pipeline for every label value.
+  Use fromFiles to compute the statistics of volumes that do not
+  fit in memory directly from disk.
+  With extendedStatistics the numpy engines also compute, in the same
+  pass, percentiles, a fixed-bin intensity histogram, the RAS centroid
+  and the IJK bounding box of each label.
   """
 
-  def __init__(self, grayscaleNode, labelNode, fileName=None):
+  engines = ("SinglePass", "Streaming", "PerLabel")
+
+  def __init__(self, grayscaleNode, labelNode, fileName=None, engine="SinglePass", slabThickness=16,
+               extendedStatistics=False, histogramBins=100):
     #import numpy
 
-    self.keys = ("Index", "Count", "Volume mm^3", "Volume cc", "Min", "Max", "Mean", "StdDev")
-    cubicMMPerVoxel = reduce(lambda x,y: x*y, labelNode.GetSpacing())
-    ccPerCubicMM = 0.001
+    from LabelStatisticsLib import labelStatisticsKeys, labelStatisticsExtendedKeys
+    self.keys = labelStatisticsKeys
+    if extendedStatistics:
+      if engine == "PerLabel":
+        raise ValueError("Extended statistics are not available with the PerLabel engine")
+      self.keys = self.keys + labelStatisticsExtendedKeys
+    self.extendedStatistics = extendedStatistics
+    self.histogramBins = histogramBins
+    self.cubicMMPerVoxel = 1.
+    self.ccPerCubicMM = 0.001
+    self.ijkToRAS = None
 
     # TODO: progress and status updates
     # this->InvokeEvent(vtkLabelStatisticsLogic::StartLabelStats, (void*)"start label stats")
@@ -248,6 +306,110 @@ class LabelStatisticsLogic:
     self.labelStats = {}
     self.labelStats['Labels'] = []
 
+    if grayscaleNode is None and labelNode is None:
+      # statistics will be filled in by the caller (see fromFiles)
+      return
+
+    self.cubicMMPerVoxel = reduce(lambda x,y: x*y, labelNode.GetSpacing())
+    ijkToRAS = vtk.vtkMatrix4x4()
+    labelNode.GetIJKToRASMatrix(ijkToRAS)
+    self.ijkToRAS = [[ijkToRAS.GetElement(row,column) for column in xrange(4)] for row in xrange(4)]
+
+    if engine == "SinglePass":
+      self.computeSinglePass(grayscaleNode, labelNode)
+    elif engine == "Streaming":
+      self.computeStreaming(grayscaleNode, labelNode, slabThickness)
+    elif engine == "PerLabel":
+      self.computePerLabel(grayscaleNode, labelNode)
+    else:
+      raise ValueError("Unknown label statistics engine '%s', expected one of %s" % (engine, str(self.engines)))
+
+  @classmethod
+  def fromFiles(cls, grayscalePath, labelPath, slabThickness=16, histogramRange=None, histogramBins=100):
+    """Compute the statistics of a grayscale/label file pair without
+    loading the volumes, one slab of slabThickness slices along K at
+    a time: nrrd and MetaImage files, in any combination, are memory
+    mapped or decompressed slab by slab (see LabelStatisticsLib.slabReader).
+    Extended statistics are computed when a histogramRange (lo, hi)
+    is given, the grayscale range is not known before reading.
+    """
+    from LabelStatisticsLib import slabReader, accumulateSlabs
+    extendedStatistics = histogramRange is not None
+    logic = cls(None, None, extendedStatistics=extendedStatistics, histogramBins=histogramBins)
+    accumulator = logic.createAccumulator(histogramRange)
+    labelReader = slabReader(labelPath)
+    grayscaleReader = slabReader(grayscalePath)
+    if labelReader.dimensions != grayscaleReader.dimensions:
+      raise ValueError("Volumes do not have the same dimensions: %s and %s" %
+                         (str(grayscaleReader.dimensions), str(labelReader.dimensions)))
+    logic.ijkToRAS = labelReader.ijkToRAS
+    accumulateSlabs(labelReader.slabs(slabThickness), grayscaleReader.slabs(slabThickness), accumulator)
+    logic.cubicMMPerVoxel = reduce(lambda x,y: x*y, labelReader.spacing)
+    logic.setStatsFromAccumulator(accumulator)
+    return logic
+
+  def computeStreaming(self, grayscaleNode, labelNode, slabThickness):
+    """Compute the statistics slab by slab over the in-memory images
+    so that the temporaries of the reduction stay proportional to
+    the slab size
+    """
+    from LabelStatisticsLib import accumulateSlabs
+    accumulator = self.createAccumulator(grayscaleNode.GetImageData().GetScalarRange())
+    accumulateSlabs(self.nodeSlabs(labelNode, slabThickness),
+                    self.nodeSlabs(grayscaleNode, slabThickness), accumulator)
+    self.setStatsFromAccumulator(accumulator)
+
+  def nodeSlabs(self, volumeNode, slabThickness):
+    """Yield (firstK, array) views of consecutive slabs along K
+    """
+    imageData = volumeNode.GetImageData()
+    dimensions = imageData.GetDimensions()
+    array = self.imageDataArray(imageData).reshape(dimensions[2], dimensions[1], dimensions[0])
+    for k in xrange(0, dimensions[2], slabThickness):
+      yield k, array[k:k+slabThickness]
+
+  def computeSinglePass(self, grayscaleNode, labelNode):
+    """Compute the statistics of all labels with one vectorized
+    reduction over the label and grayscale arrays
+    """
+    dimensions = labelNode.GetImageData().GetDimensions()
+    shape = (dimensions[2], dimensions[1], dimensions[0])
+    labelArray = self.imageDataArray(labelNode.GetImageData()).reshape(shape)
+    grayscaleArray = self.imageDataArray(grayscaleNode.GetImageData()).reshape(shape)
+    accumulator = self.createAccumulator(grayscaleNode.GetImageData().GetScalarRange())
+    accumulator.addChunk(labelArray, grayscaleArray)
+    self.setStatsFromAccumulator(accumulator)
+
+  def createAccumulator(self, histogramRange):
+    from LabelStatisticsLib import LabelStatisticsAccumulator
+    if not self.extendedStatistics:
+      return LabelStatisticsAccumulator()
+    lo, hi = histogramRange
+    if hi <= lo:
+      # constant image, give the bins a width
+      hi = lo + 1
+    return LabelStatisticsAccumulator(extended=True, histogramRange=(lo, hi), histogramBins=self.histogramBins)
+
+  def imageDataArray(self, imageData):
+    """Numpy view of the first scalar component of an image (no copy
+    for single component images)
+    """
+    import vtk.util.numpy_support
+    scalars = imageData.GetPointData().GetScalars()
+    array = vtk.util.numpy_support.vtk_to_numpy(scalars)
+    if scalars.GetNumberOfComponents() > 1:
+      array = array[:,0]
+    return array
+
+  def setStatsFromAccumulator(self, accumulator):
+    """Fill the labelStats dictionary from the per-label sums
+    """
+    self.labelStats = accumulator.labelStats(self.cubicMMPerVoxel, self.ccPerCubicMM, self.ijkToRAS)
+
+  def computePerLabel(self, grayscaleNode, labelNode):
+    """Compute the statistics with one threshold/stencil/accumulate
+    pipeline per label value (reference implementation)
+    """
     stataccum = vtk.vtkImageAccumulate()
     if vtk.VTK_MAJOR_VERSION <= 5:
       stataccum.SetInput(labelNode.GetImageData())
@@ -309,8 +471,8 @@ class LabelStatisticsLogic:
         self.labelStats["Labels"].append(i)
         self.labelStats[i,"Index"] = i
         self.labelStats[i,"Count"] = stat1.GetVoxelCount()
-        self.labelStats[i,"Volume mm^3"] = self.labelStats[i,"Count"] * cubicMMPerVoxel
-        self.labelStats[i,"Volume cc"] = self.labelStats[i,"Volume mm^3"] * ccPerCubicMM
+        self.labelStats[i,"Volume mm^3"] = self.labelStats[i,"Count"] * self.cubicMMPerVoxel
+        self.labelStats[i,"Volume cc"] = self.labelStats[i,"Volume mm^3"] * self.ccPerCubicMM
         self.labelStats[i,"Min"] = stat1.GetMin()[0]
         self.labelStats[i,"Max"] = stat1.GetMax()[0]
         self.labelStats[i,"Mean"] = stat1.GetMean()[0]
@@ -394,6 +556,88 @@ class LabelStatisticsLogic:
     fp.write(self.statsAsCSV())
     fp.close()
 
+class LabelStatisticsCache(object):
+  """Label statistics kept up to date while the label maps are edited,
+  keyed by label node ID.
+  Once started, the cache is notified of the edits reported by the
+  Editor effects through EditUtil.markVolumeNodeAsModified and only
+  revisits the edited IJK extent of the label maps it holds (see
+  LabelStatisticsLib.IncrementalLabelStatistics).  Edits of the
+  grayscale volume are not tracked.
+  """
+
+  def __init__(self):
+    # label node ID -> (grayscale node ID, scalar arrays, incremental statistics)
+    self.entries = {}
+    # called as callback(labelNode) after statistics were updated by an edit
+    self.modifiedCallbacks = []
+    self.editUtil = None
+
+  def start(self):
+    import EditorLib
+    try:
+      # for developer build...
+      self.editUtil = EditorLib.EditUtil.EditUtil()
+    except AttributeError:
+      # for release package...
+      self.editUtil = EditorLib.EditUtil()
+    self.editUtil.addVolumeModifiedCallback(self.onVolumeModified)
+
+  def stop(self):
+    if self.editUtil:
+      self.editUtil.removeVolumeModifiedCallback(self.onVolumeModified)
+    self.entries = {}
+
+  def scalarArrays(self, grayscaleNode, labelNode):
+    return (grayscaleNode.GetImageData().GetPointData().GetScalars(),
+            labelNode.GetImageData().GetPointData().GetScalars())
+
+  def entry(self, grayscaleNode, labelNode):
+    """Return the incremental statistics of the pair, (re)built if the
+    pair is new or the image data arrays were replaced
+    """
+    import vtk.util.numpy_support
+    from LabelStatisticsLib import IncrementalLabelStatistics
+    entry = self.entries.get(labelNode.GetID())
+    arrays = self.scalarArrays(grayscaleNode, labelNode)
+    if entry and entry[0] == grayscaleNode.GetID() and entry[1][0] is arrays[0] and entry[1][1] is arrays[1]:
+      return entry[2]
+    dimensions = labelNode.GetImageData().GetDimensions()
+    if grayscaleNode.GetImageData().GetDimensions() != dimensions:
+      raise ValueError("Volumes do not have the same dimensions")
+    shape = (dimensions[2], dimensions[1], dimensions[0])
+    # the arrays are held by the entry so the numpy views stay valid
+    labelArray = vtk.util.numpy_support.vtk_to_numpy(arrays[1]).reshape(shape)
+    grayscaleArray = vtk.util.numpy_support.vtk_to_numpy(arrays[0]).reshape(shape)
+    statistics = IncrementalLabelStatistics(labelArray, grayscaleArray)
+    self.entries[labelNode.GetID()] = (grayscaleNode.GetID(), arrays, statistics)
+    return statistics
+
+  def labelStats(self, grayscaleNode, labelNode):
+    """Return the statistics of the pair in the LabelStatisticsLogic.labelStats layout
+    """
+    statistics = self.entry(grayscaleNode, labelNode)
+    cubicMMPerVoxel = reduce(lambda x,y: x*y, labelNode.GetSpacing())
+    return statistics.labelStats(cubicMMPerVoxel)
+
+  def onVolumeModified(self, volumeNode, extent):
+    entry = self.entries.get(volumeNode.GetID())
+    if not entry:
+      return
+    grayscaleNode = slicer.mrmlScene.GetNodeByID(entry[0])
+    if not grayscaleNode or not volumeNode.GetImageData():
+      del self.entries[volumeNode.GetID()]
+      return
+    arrays = self.scalarArrays(grayscaleNode, volumeNode)
+    if entry[1][0] is arrays[0] and entry[1][1] is arrays[1]:
+      entry[2].update(extent)
+    else:
+      # new image data (e.g. restored by undo), start over
+      del self.entries[volumeNode.GetID()]
+      self.entry(grayscaleNode, volumeNode)
+    for callback in self.modifiedCallbacks:
+      callback(volumeNode)
+
 class LabelStatisticsTest(unittest.TestCase):
   """
   This is the test case.
@@ -426,6 +670,16 @@ class LabelStatisticsTest(unittest.TestCase):
     """
     self.setUp()
     self.test_LabelStatisticsBasic()
+    self.setUp()
+    self.test_LabelStatisticsEngines()
+    self.setUp()
+    self.test_LabelStatisticsExtended()
+    self.setUp()
+    self.test_LabelStatisticsCache()
+    self.setUp()
+    self.test_LabelStatisticsFromFiles()
+    self.setUp()
+    self.test_LabelStatisticsBatch()
 
   def test_LabelStatisticsBasic(self):
     """
@@ -460,6 +714,260 @@ class LabelStatisticsTest(unittest.TestCase):
 
     self.delayDisplay('test_LabelStatisticsBasic passed!')
 
+  def test_LabelStatisticsEngines(self):
+    """
+    Check that the single pass and streaming engines match the per label pipeline
+    """
+
+    self.delayDisplay("Starting test_LabelStatisticsEngines")
+    import SampleData
+    sampleDataLogic = SampleData.SampleDataLogic()
+    mrHead = sampleDataLogic.downloadMRHead()
+
+    volumesLogic = slicer.modules.volumes.logic()
+    mrHeadLabel = volumesLogic.CreateAndAddLabelVolume( slicer.mrmlScene, mrHead, "mrHead-label" )
+
+    # make a few labels out of intensity bands
+    labelArray = slicer.util.array('mrHead-label')
+    labelArray[:] = slicer.util.array('MRHead') / 40
+    mrHeadLabel.GetImageData().Modified()
+
+    perLabel = LabelStatisticsLogic(mrHead, mrHeadLabel, engine="PerLabel")
+    singlePass = LabelStatisticsLogic(mrHead, mrHeadLabel, engine="SinglePass")
+    streaming = LabelStatisticsLogic(mrHead, mrHeadLabel, engine="Streaming", slabThickness=7)
+
+    for logic in (singlePass, streaming):
+      self.assertEqual( perLabel.labelStats["Labels"], logic.labelStats["Labels"] )
+      for i in perLabel.labelStats["Labels"]:
+        for k in perLabel.keys:
+          self.assertAlmostEqual( perLabel.labelStats[i,k], logic.labelStats[i,k], places=3 )
+
+    self.delayDisplay('test_LabelStatisticsEngines passed!')
+
+  def test_LabelStatisticsExtended(self):
+    """
+    Check the extended statistics against numpy on a known label
+    """
+
+    self.delayDisplay("Starting test_LabelStatisticsExtended")
+    import numpy
+    import SampleData
+    sampleDataLogic = SampleData.SampleDataLogic()
+    mrHead = sampleDataLogic.downloadMRHead()
+
+    volumesLogic = slicer.modules.volumes.logic()
+    mrHeadLabel = volumesLogic.CreateAndAddLabelVolume( slicer.mrmlScene, mrHead, "mrHead-label" )
+    labelArray = slicer.util.array('mrHead-label')
+    labelArray[:] = 0
+    labelArray[40:60,100:120,80:90] = 1
+    mrHeadLabel.GetImageData().Modified()
+    grayscaleArray = slicer.util.array('MRHead')
+    values = grayscaleArray[labelArray == 1]
+
+    singlePass = LabelStatisticsLogic(mrHead, mrHeadLabel, extendedStatistics=True)
+    streaming = LabelStatisticsLogic(mrHead, mrHeadLabel, engine="Streaming", extendedStatistics=True)
+
+    self.assertEqual( singlePass.labelStats[1,"Median"], numpy.median(values) )
+    # numpy.percentile is not in the bundled numpy
+    sortedValues = numpy.sort(values.ravel()).astype(float)
+    rank = (sortedValues.size - 1) * 0.95
+    below = int(rank)
+    percentile95 = sortedValues[below] + (rank - below) * (sortedValues[min(below + 1, sortedValues.size - 1)] - sortedValues[below])
+    self.assertAlmostEqual( singlePass.labelStats[1,"Percentile 95"], percentile95, places=3 )
+    for logic in (singlePass, streaming):
+      self.assertEqual( (logic.labelStats[1,"I Min"], logic.labelStats[1,"I Max"]), (80, 89) )
+      self.assertEqual( (logic.labelStats[1,"K Min"], logic.labelStats[1,"K Max"]), (40, 59) )
+      self.assertEqual( logic.labelStats[1,"Histogram"].sum(), values.size )
+      ijkToRAS = vtk.vtkMatrix4x4()
+      mrHead.GetIJKToRASMatrix(ijkToRAS)
+      centroid = ijkToRAS.MultiplyPoint((84.5, 109.5, 49.5, 1))
+      for axis, name in enumerate("RAS"):
+        self.assertAlmostEqual( logic.labelStats[1,"Centroid " + name], centroid[axis], places=3 )
+
+    self.delayDisplay('test_LabelStatisticsExtended passed!')
+
+  def test_LabelStatisticsCache(self):
+    """
+    Check that incremental updates of the cache match a full computation
+    """
+
+    self.delayDisplay("Starting test_LabelStatisticsCache")
+    import SampleData
+    import EditorLib
+    sampleDataLogic = SampleData.SampleDataLogic()
+    mrHead = sampleDataLogic.downloadMRHead()
+
+    volumesLogic = slicer.modules.volumes.logic()
+    mrHeadLabel = volumesLogic.CreateAndAddLabelVolume( slicer.mrmlScene, mrHead, "mrHead-label" )
+    labelArray = slicer.util.array('mrHead-label')
+    labelArray[:] = slicer.util.array('MRHead') / 40
+    mrHeadLabel.GetImageData().Modified()
+
+    cache = LabelStatisticsCache()
+    cache.start()
+    cache.labelStats(mrHead, mrHeadLabel)
+
+    # paint a box and report its extent like the editor effects do
+    labelArray[50:60,100:140,20:30] = 7
+    EditorLib.EditUtil.EditUtil().markVolumeNodeAsModified(mrHeadLabel, (20,29,100,139,50,59))
+    incremental = cache.labelStats(mrHead, mrHeadLabel)
+    cache.stop()
+
+    logic = LabelStatisticsLogic(mrHead, mrHeadLabel)
+    self.assertEqual( logic.labelStats["Labels"], incremental["Labels"] )
+    for i in logic.labelStats["Labels"]:
+      for k in logic.keys:
+        self.assertAlmostEqual( logic.labelStats[i,k], incremental[i,k], places=3 )
+
+    self.delayDisplay('test_LabelStatisticsCache passed!')
+
+  def writeNRRD(self, path, volumeNode, encoding='raw'):
+    """Write the image of volumeNode to a raw or gzip encoded nrrd
+    file with the geometry of the node
+    """
+    import sys
+    import gzip
+    import vtk.util.numpy_support
+    array = vtk.util.numpy_support.vtk_to_numpy(volumeNode.GetImageData().GetPointData().GetScalars())
+    ijkToRAS = vtk.vtkMatrix4x4()
+    volumeNode.GetIJKToRASMatrix(ijkToRAS)
+    directions = " ".join(["(%r,%r,%r)" % tuple([ijkToRAS.GetElement(row, column) for row in xrange(3)]) for column in xrange(3)])
+    origin = "(%r,%r,%r)" % tuple([ijkToRAS.GetElement(row, 3) for row in xrange(3)])
+    nrrdType = {'float32' : 'float', 'float64' : 'double'}.get(array.dtype.name, array.dtype.name)
+    fp = open(path, 'wb')
+    fp.write("NRRD0004\ntype: %s\ndimension: 3\nspace: right-anterior-superior\n" % nrrdType)
+    fp.write("sizes: %d %d %d\n" % volumeNode.GetImageData().GetDimensions())
+    fp.write("space directions: %s\nspace origin: %s\n" % (directions, origin))
+    fp.write("endian: %s\nencoding: %s\n\n" % (sys.byteorder, encoding))
+    if encoding == 'gzip':
+      data = gzip.GzipFile(fileobj=fp, mode='wb')
+      data.write(array.tostring())
+      data.close()
+    else:
+      fp.write(array.tostring())
+    fp.close()
+
+  def test_LabelStatisticsFromFiles(self):
+    """
+    Check that the statistics streamed from a MetaImage grayscale
+    and a raw nrrd label map match the in-memory computation
+    """
+
+    self.delayDisplay("Starting test_LabelStatisticsFromFiles")
+    import os
+    import SampleData
+    sampleDataLogic = SampleData.SampleDataLogic()
+    mrHead = sampleDataLogic.downloadMRHead()
+
+    volumesLogic = slicer.modules.volumes.logic()
+    mrHeadLabel = volumesLogic.CreateAndAddLabelVolume( slicer.mrmlScene, mrHead, "mrHead-label" )
+    labelArray = slicer.util.array('mrHead-label')
+    labelArray[:] = slicer.util.array('MRHead') / 40
+    mrHeadLabel.GetImageData().Modified()
+
+    grayscalePath = os.path.join(slicer.app.temporaryPath, 'LabelStatisticsTest.mha')
+    labelPath = os.path.join(slicer.app.temporaryPath, 'LabelStatisticsTest-label.nrrd')
+    writer = vtk.vtkMetaImageWriter()
+    writer.SetFileName(grayscalePath)
+    writer.SetCompression(True)
+    if vtk.VTK_MAJOR_VERSION <= 5:
+      writer.SetInput(mrHead.GetImageData())
+    else:
+      writer.SetInputData(mrHead.GetImageData())
+    writer.Write()
+    self.writeNRRD(labelPath, mrHeadLabel)
+
+    inMemory = LabelStatisticsLogic(mrHead, mrHeadLabel, extendedStatistics=True)
+    histogramRange = mrHead.GetImageData().GetScalarRange()
+    fromFiles = LabelStatisticsLogic.fromFiles(grayscalePath, labelPath, slabThickness=7, histogramRange=histogramRange)
+    os.remove(grayscalePath)
+    os.remove(labelPath)
+
+    # percentiles are exact in memory, from the histogram for slabs
+    keys = [k for k in inMemory.keys if k != "Median" and not k.startswith("Percentile")]
+    self.assertEqual( inMemory.labelStats["Labels"], fromFiles.labelStats["Labels"] )
+    for i in inMemory.labelStats["Labels"]:
+      for k in keys:
+        self.assertAlmostEqual( inMemory.labelStats[i,k], fromFiles.labelStats[i,k], places=3 )
+      self.assertEqual( list(inMemory.labelStats[i,"Histogram"]), list(fromFiles.labelStats[i,"Histogram"]) )
+
+    self.delayDisplay('test_LabelStatisticsFromFiles passed!')
+
+  def test_LabelStatisticsBatch(self):
+    """
+    Check the batch statistics of a manifest written to npz, that
+    a second run resumes and that other options are refused
+    """
+
+    self.delayDisplay("Starting test_LabelStatisticsBatch")
+    import os
+    import shutil
+    import tempfile
+    import numpy
+    import SampleData
+    from LabelStatisticsLib import LabelStatisticsBatch
+    sampleDataLogic = SampleData.SampleDataLogic()
+    mrHead = sampleDataLogic.downloadMRHead()
+
+    volumesLogic = slicer.modules.volumes.logic()
+    mrHeadLabel = volumesLogic.CreateAndAddLabelVolume( slicer.mrmlScene, mrHead, "mrHead-label" )
+    labelArray = slicer.util.array('mrHead-label')
+    labelArray[:] = slicer.util.array('MRHead') / 40
+    mrHeadLabel.GetImageData().Modified()
+    inMemory = LabelStatisticsLogic(mrHead, mrHeadLabel)
+
+    # gzip nrrd as the slicer writers save it, and raw nrrd
+    directory = tempfile.mkdtemp(dir=slicer.app.temporaryPath)
+    self.writeNRRD(os.path.join(directory, 'head.nrrd'), mrHead, encoding='gzip')
+    self.writeNRRD(os.path.join(directory, 'head-label.nrrd'), mrHeadLabel, encoding='gzip')
+    self.writeNRRD(os.path.join(directory, 'head-raw.nrrd'), mrHead)
+    manifestPath = os.path.join(directory, 'manifest.csv')
+    fp = open(manifestPath, 'w')
+    fp.write("subject,grayscale,label\n")
+    fp.write("first,head.nrrd,head-label.nrrd\n")
+    fp.write(",head-raw.nrrd,head-label.nrrd\n")
+    fp.close()
+    outputPath = os.path.join(directory, 'stats.npz')
+
+    computed = []
+    def progress(subject, done, total, seconds, error):
+      computed.append((subject, error))
+
+    try:
+      failures = LabelStatisticsBatch(manifestPath, outputPath, processes=1).run(progress)
+      self.assertEqual( failures, [] )
+      self.assertEqual( sorted(computed), [('first', None), ('head-label.nrrd', None)] )
+      columns = numpy.load(outputPath)
+      labels = inMemory.labelStats["Labels"]
+      for subject in ('first', 'head-label.nrrd'):
+        rows = columns['Subject'] == subject
+        self.assertEqual( list(columns['Index'][rows]), labels )
+        self.assertEqual( list(columns['Count'][rows]), [inMemory.labelStats[i,"Count"] for i in labels] )
+        for mean, i in zip(columns['Mean'][rows], labels):
+          self.assertAlmostEqual( mean, inMemory.labelStats[i,"Mean"], places=3 )
+      columns.close()
+
+      # done subjects are not computed again, new ones are
+      del computed[:]
+      LabelStatisticsBatch(manifestPath, outputPath, processes=1).run(progress)
+      self.assertEqual( computed, [] )
+      fp = open(manifestPath, 'a')
+      fp.write("third,head.nrrd,head-label.nrrd\n")
+      fp.close()
+      LabelStatisticsBatch(manifestPath, outputPath, processes=1).run(progress)
+      self.assertEqual( computed, [('third', None)] )
+      columns = numpy.load(outputPath)
+      self.assertEqual( len(columns['Subject']), 3 * len(labels) )
+      columns.close()
+
+      # the rows of other options cannot be resumed
+      extended = LabelStatisticsBatch(manifestPath, outputPath, processes=1, histogramRange=(0, 100))
+      self.assertRaises( ValueError, extended.run )
+    finally:
+      shutil.rmtree(directory)
+
+    self.delayDisplay('test_LabelStatisticsBatch passed!')
+
 class Slicelet(object):
   """A slicer slicelet is a module widget that comes up in stand alone mode
   implemented as a python class.
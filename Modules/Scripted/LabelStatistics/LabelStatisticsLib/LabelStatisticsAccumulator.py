@@ -0,0 +1,324 @@
+import numpy
+
+__all__ = ['LabelStatisticsAccumulator', 'labelStatisticsKeys', 'labelStatisticsExtendedKeys', 'paddedBincount']
+
+# columns of the statistics table, in the order used for display and csv
+labelStatisticsKeys = ("Index", "Count", "Volume mm^3", "Volume cc", "Min", "Max", "Mean", "StdDev")
+
+# additional columns computed when the accumulator is extended
+labelStatisticsExtendedKeys = ("Median", "Percentile 5", "Percentile 95",
+                               "Centroid R", "Centroid A", "Centroid S",
+                               "I Min", "I Max", "J Min", "J Max", "K Min", "K Max")
+
+def paddedBincount(bins, length, weights=None):
+  """numpy.bincount of the bins padded with zeros to length bins,
+  numpy before 1.6 has no minlength (and no bincount of nothing)
+  """
+  if bins.size == 0:
+    return numpy.zeros(length, dtype=numpy.int64 if weights is None else numpy.float64)
+  counts = numpy.bincount(bins, weights)
+  if counts.size < length:
+    counts = numpy.concatenate((counts, numpy.zeros(length - counts.size, dtype=counts.dtype)))
+  return counts
+
+#
+# LabelStatisticsAccumulator
+#
+
+class LabelStatisticsAccumulator(object):
+  """Per-label running sums (count, sum, sum of squares, min, max)
+  computed with vectorized bincount-style reductions over a label array
+  and the matching grayscale array.
+  Every label present in the data is handled in the same pass, so the
+  cost does not depend on the number of labels.  Accumulators can be
+  fed in chunks and merged, the statistics are derived at the end.
+  This module only depends on numpy so it can be used outside of slicer.
+
+  An extended accumulator also keeps, in the same pass, the sums of the
+  voxel IJK coordinates (centroid), the IJK bounding box and a fixed-bin
+  intensity histogram over histogramRange.  Chunks then have to be
+  (k,j,i) shaped arrays.  Percentiles are exact while the accumulator
+  holds a single chunk, after merging chunks they are interpolated
+  from the histogram.
+
+  The grayscale values are reduced in their own type: they are
+  grouped by label with a stable sort (by value within each label for
+  the percentiles of an extended accumulator) and the extremes taken
+  with ufunc.reduceat.  A basic accumulator reduces large blocks
+  chunkVoxels at a time so the temporaries stay bounded.
+  """
+
+  # beyond this label range (relative to the number of voxels) the
+  # labels are compacted with numpy.unique before binning to avoid
+  # allocating huge, mostly empty bin arrays
+  sparseRangeFactor = 4
+
+  # voxels reduced at once by a basic accumulator
+  chunkVoxels = 1 << 22
+
+  percentileKeys = ((50, "Median"), (5, "Percentile 5"), (95, "Percentile 95"))
+
+  def __init__(self, extended=False, histogramRange=None, histogramBins=100):
+    self.extended = extended
+    if extended and histogramRange is None:
+      raise ValueError("Extended label statistics need a histogram range")
+    self.histogramRange = histogramRange
+    self.histogramBins = histogramBins
+    self.labels = numpy.zeros(0, dtype=numpy.int64)
+    self.count = numpy.zeros(0, dtype=numpy.int64)
+    self.sum = numpy.zeros(0, dtype=numpy.float64)
+    self.sumSquares = numpy.zeros(0, dtype=numpy.float64)
+    self.min = numpy.zeros(0, dtype=numpy.float64)
+    self.max = numpy.zeros(0, dtype=numpy.float64)
+    if extended:
+      # per label rows, columns in i, j, k order
+      self.sumIJK = numpy.zeros((0,3), dtype=numpy.float64)
+      self.minIJK = numpy.zeros((0,3), dtype=numpy.int64)
+      self.maxIJK = numpy.zeros((0,3), dtype=numpy.int64)
+      self.histogram = numpy.zeros((0,histogramBins), dtype=numpy.int64)
+      # exact percentiles of a single chunk, {percent : array}
+      self.exactPercentiles = {}
+
+  def addChunk(self, labelArray, grayscaleArray, firstK=0):
+    """Accumulate a block of voxels.  The two arrays must have
+    the same number of elements, their shape is ignored unless the
+    accumulator is extended: then they are (k,j,i) arrays starting
+    at slice firstK of the volume.
+    """
+    if self.extended:
+      self.merge(self.reduceChunk(labelArray, grayscaleArray, firstK))
+      return
+    labels = numpy.asarray(labelArray).ravel()
+    values = numpy.asarray(grayscaleArray).ravel()
+    if labels.size != values.size:
+      raise ValueError("label and grayscale arrays have different sizes (%d, %d)" % (labels.size, values.size))
+    for start in range(0, labels.size, self.chunkVoxels):
+      self.merge(self.reduceChunk(labels[start:start+self.chunkVoxels], values[start:start+self.chunkVoxels]))
+
+  @classmethod
+  def fromArrays(cls, labelArray, grayscaleArray, **options):
+    """Return a new accumulator holding the sums of one block of voxels,
+    options are passed to the constructor.
+    """
+    accumulator = cls(**options)
+    accumulator.addChunk(labelArray, grayscaleArray)
+    return accumulator
+
+  def emptyCopy(self):
+    return self.__class__(self.extended, self.histogramRange, self.histogramBins)
+
+  def reduceChunk(self, labelArray, grayscaleArray, firstK=0):
+    """Return a new accumulator with the same options holding the
+    sums of one block of voxels.
+    """
+    labelArray = numpy.asarray(labelArray)
+    labels = labelArray.ravel()
+    values = numpy.asarray(grayscaleArray).ravel()
+    if labels.size != values.size:
+      raise ValueError("label and grayscale arrays have different sizes (%d, %d)" % (labels.size, values.size))
+    if self.extended and labelArray.ndim != 3:
+      raise ValueError("Extended label statistics need (k,j,i) shaped chunks")
+    accumulator = self.emptyCopy()
+    if labels.size == 0:
+      return accumulator
+
+    bins = labels.astype(numpy.int64)
+    lo = int(bins.min())
+    hi = int(bins.max())
+    if hi - lo + 1 > self.sparseRangeFactor * labels.size + 65536:
+      presentLabels, bins = numpy.unique(bins, return_inverse=True)
+    else:
+      presentLabels = None
+      bins -= lo
+
+    counts = numpy.bincount(bins)
+    present = numpy.flatnonzero(counts)
+    if presentLabels is None:
+      presentLabels = present + lo
+
+    accumulator.labels = presentLabels.astype(numpy.int64)
+    accumulator.count = counts[present].astype(numpy.int64)
+    accumulator.sum = numpy.bincount(bins, weights=values)[present]
+    squares = values.astype(numpy.float64)
+    squares *= squares
+    accumulator.sumSquares = numpy.bincount(bins, weights=squares)[present]
+    del squares
+
+    # group the values by label, sorted by value within each run for
+    # the percentiles, and reduce each run
+    if self.extended:
+      order = numpy.lexsort((values, bins))
+    else:
+      order = numpy.argsort(bins, kind='mergesort')
+    groupedValues = values[order]
+    starts = numpy.concatenate(([0], numpy.cumsum(accumulator.count)[:-1]))
+    accumulator.min = numpy.minimum.reduceat(groupedValues, starts).astype(numpy.float64)
+    accumulator.max = numpy.maximum.reduceat(groupedValues, starts).astype(numpy.float64)
+    if self.extended:
+      self.reduceExtended(accumulator, labelArray.shape, firstK, bins, present, order, groupedValues, starts)
+    return accumulator
+
+  def reduceExtended(self, accumulator, shape, firstK, bins, present, order, groupedValues, starts):
+    """Fill the centroid sums, bounding box, histogram and percentiles
+    of a chunk accumulator
+    """
+    # the voxel coordinates, in label order
+    sliceSize = shape[1] * shape[2]
+    k = order // sliceSize + firstK
+    j = (order % sliceSize) // shape[2]
+    i = order % shape[2]
+    labelIndex = numpy.repeat(numpy.arange(present.size), accumulator.count)
+    coordinates = (i, j, k)
+    accumulator.sumIJK = numpy.column_stack([paddedBincount(labelIndex, present.size, c) for c in coordinates])
+    accumulator.minIJK = numpy.column_stack([numpy.minimum.reduceat(c, starts) for c in coordinates])
+    accumulator.maxIJK = numpy.column_stack([numpy.maximum.reduceat(c, starts) for c in coordinates])
+
+    # fixed bins over histogramRange, values outside of the range
+    # are counted in the first or last bin
+    lo, hi = self.histogramRange
+    binWidth = float(hi - lo) / self.histogramBins
+    valueBins = numpy.floor((groupedValues.astype(numpy.float64) - lo) / binWidth).astype(numpy.int64)
+    numpy.clip(valueBins, 0, self.histogramBins - 1, out=valueBins)
+    accumulator.histogram = paddedBincount(labelIndex * self.histogramBins + valueBins,
+                                           present.size * self.histogramBins).reshape(present.size, self.histogramBins)
+
+    # values are sorted within each label: interpolate between order
+    # statistics like numpy.percentile
+    for percent, key in self.percentileKeys:
+      rank = (accumulator.count - 1) * (percent / 100.)
+      below = numpy.floor(rank).astype(numpy.int64)
+      above = numpy.minimum(below + 1, accumulator.count - 1)
+      fraction = rank - below
+      accumulator.exactPercentiles[percent] = (groupedValues[starts + below] * (1 - fraction) +
+                                               groupedValues[starts + above] * fraction)
+
+  def merge(self, other):
+    """Combine the sums of another accumulator into this one.
+    """
+    if other.labels.size == 0:
+      return
+    names = ['labels', 'count', 'sum', 'sumSquares', 'min', 'max']
+    if self.extended:
+      names += ['sumIJK', 'minIJK', 'maxIJK', 'histogram']
+    if self.labels.size == 0:
+      for name in names:
+        setattr(self, name, getattr(other, name).copy())
+      if self.extended:
+        self.exactPercentiles = dict(other.exactPercentiles)
+      return
+
+    labels = numpy.union1d(self.labels, other.labels)
+    mine = numpy.searchsorted(labels, self.labels)
+    theirs = numpy.searchsorted(labels, other.labels)
+
+    def combine(a, b, fill, op):
+      result = numpy.empty((labels.size,) + a.shape[1:], dtype=a.dtype)
+      result.fill(fill)
+      result[mine] = a
+      result[theirs] = op(result[theirs], b)
+      return result
+
+    self.count = combine(self.count, other.count, 0, numpy.add)
+    self.sum = combine(self.sum, other.sum, 0., numpy.add)
+    self.sumSquares = combine(self.sumSquares, other.sumSquares, 0., numpy.add)
+    self.min = combine(self.min, other.min, numpy.inf, numpy.minimum)
+    self.max = combine(self.max, other.max, -numpy.inf, numpy.maximum)
+    if self.extended:
+      self.sumIJK = combine(self.sumIJK, other.sumIJK, 0., numpy.add)
+      self.minIJK = combine(self.minIJK, other.minIJK, numpy.iinfo(numpy.int64).max, numpy.minimum)
+      self.maxIJK = combine(self.maxIJK, other.maxIJK, -1, numpy.maximum)
+      self.histogram = combine(self.histogram, other.histogram, 0, numpy.add)
+      # the voxels of the two accumulators are not sorted together anymore
+      self.exactPercentiles = {}
+    self.labels = labels
+
+  def mean(self):
+    return self.sum / self.count
+
+  def standardDeviation(self):
+    """Sample standard deviation, same convention as vtkImageAccumulate
+    (zero for labels with a single voxel).
+    """
+    count = self.count.astype(numpy.float64)
+    mean = self.mean()
+    variance = numpy.zeros(count.size, dtype=numpy.float64)
+    several = count > 1
+    variance[several] = (self.sumSquares[several] - mean[several] * self.sum[several]) / (count[several] - 1)
+    # round-off can make the variance of constant regions slightly negative
+    return numpy.sqrt(numpy.maximum(variance, 0.))
+
+  def percentile(self, percent):
+    """Per-label percentile of the grayscale values: exact for a
+    single chunk, otherwise linearly interpolated within the
+    histogram bin that contains it
+    """
+    if percent in self.exactPercentiles:
+      return self.exactPercentiles[percent]
+    lo, hi = self.histogramRange
+    binWidth = float(hi - lo) / self.histogramBins
+    result = numpy.zeros(self.labels.size, dtype=numpy.float64)
+    for n in range(self.labels.size):
+      cumulative = numpy.cumsum(self.histogram[n])
+      target = (percent / 100.) * self.count[n]
+      b = min(int(numpy.searchsorted(cumulative, target)), self.histogramBins - 1)
+      before = cumulative[b-1] if b > 0 else 0
+      fraction = (target - before) / float(max(self.histogram[n,b], 1))
+      result[n] = lo + (b + fraction) * binWidth
+    # the histogram cannot do better than the actual extremes
+    return numpy.clip(result, self.min, self.max)
+
+  def centroidRAS(self, ijkToRAS):
+    """Per-label centroid as rows of RAS coordinates, ijkToRAS is
+    a 4x4 matrix given as nested sequences
+    """
+    matrix = numpy.asarray(ijkToRAS, dtype=numpy.float64)
+    centroidIJK = self.sumIJK / self.count[:,numpy.newaxis]
+    return numpy.dot(centroidIJK, matrix[:3,:3].T) + matrix[:3,3]
+
+  def histogramBinEdges(self):
+    lo, hi = self.histogramRange
+    return numpy.linspace(lo, hi, self.histogramBins + 1)
+
+  def labelStats(self, cubicMMPerVoxel, ccPerCubicMM=0.001, ijkToRAS=None):
+    """Return the statistics as a dictionary with the layout of
+    LabelStatisticsLogic.labelStats: a 'Labels' list plus one
+    (label, key) entry per label and labelStatisticsKeys item.
+    Extended accumulators add the labelStatisticsExtendedKeys items,
+    a (label, 'Histogram') count array per label and the shared
+    'HistogramBinEdges'; the centroid is in IJK if ijkToRAS is None.
+    """
+    labelStats = {}
+    labelStats['Labels'] = []
+    means = self.mean()
+    standardDeviations = self.standardDeviation()
+    for n in range(self.labels.size):
+      i = int(self.labels[n])
+      labelStats["Labels"].append(i)
+      labelStats[i,"Index"] = i
+      labelStats[i,"Count"] = int(self.count[n])
+      labelStats[i,"Volume mm^3"] = labelStats[i,"Count"] * cubicMMPerVoxel
+      labelStats[i,"Volume cc"] = labelStats[i,"Volume mm^3"] * ccPerCubicMM
+      labelStats[i,"Min"] = float(self.min[n])
+      labelStats[i,"Max"] = float(self.max[n])
+      labelStats[i,"Mean"] = float(means[n])
+      labelStats[i,"StdDev"] = float(standardDeviations[n])
+
+    if not self.extended:
+      return labelStats
+
+    if ijkToRAS is None:
+      ijkToRAS = numpy.identity(4)
+    centroids = self.centroidRAS(ijkToRAS)
+    percentiles = [(key, self.percentile(percent)) for percent, key in self.percentileKeys]
+    labelStats['HistogramBinEdges'] = self.histogramBinEdges()
+    for n in range(self.labels.size):
+      i = int(self.labels[n])
+      for key, values in percentiles:
+        labelStats[i,key] = float(values[n])
+      for axis, name in enumerate("RAS"):
+        labelStats[i,"Centroid " + name] = float(centroids[n,axis])
+      for axis, name in enumerate("IJK"):
+        labelStats[i,name + " Min"] = int(self.minIJK[n,axis])
+        labelStats[i,name + " Max"] = int(self.maxIJK[n,axis])
+      labelStats[i,"Histogram"] = self.histogram[n].copy()
+    return labelStats
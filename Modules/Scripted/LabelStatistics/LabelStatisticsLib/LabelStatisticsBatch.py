@@ -0,0 +1,300 @@
+import csv
+import os
+import sys
+import time
+
+from LabelStatisticsAccumulator import LabelStatisticsAccumulator, labelStatisticsKeys, labelStatisticsExtendedKeys
+from LabelStatisticsStreaming import slabReader, accumulateSlabs
+
+__all__ = ['LabelStatisticsBatch', 'readManifest', 'computeSubjectStatistics']
+
+#
+# Headless batch computation of label statistics over many
+# grayscale/label file pairs.  Only numpy is needed, so the batch
+# can run in a plain python interpreter (or spread over worker
+# processes) as well as inside slicer:
+#
+#   python LabelStatisticsBatch.py manifest.csv stats.csv --processes 8
+#
+
+def readManifest(manifestPath):
+  """Return a list of (subject, grayscalePath, labelPath) read from a
+  csv file with 'grayscale' and 'label' columns and an optional
+  'subject' column (defaults to the label file name).
+  Relative paths are relative to the manifest directory.
+  """
+  manifestDirectory = os.path.dirname(os.path.abspath(manifestPath))
+  subjects = []
+  fp = open(manifestPath, 'r')
+  try:
+    for row in csv.DictReader(fp):
+      grayscalePath = os.path.join(manifestDirectory, row['grayscale'].strip())
+      labelPath = os.path.join(manifestDirectory, row['label'].strip())
+      subject = row.get('subject') or os.path.basename(labelPath)
+      subjects.append((subject.strip(), grayscalePath, labelPath))
+  finally:
+    fp.close()
+  return subjects
+
+def computeSubjectStatistics(task):
+  """Compute the statistics of one subject, task is a
+  (subject, grayscalePath, labelPath, slabThickness, histogramRange) tuple,
+  the statistics are extended when histogramRange is not None.
+  The files are read like LabelStatisticsLogic.fromFiles reads them,
+  see slabReader.
+  Returns (subject, labelStats, seconds, error) where error is None
+  on success.  Module level so that it can be sent to a process pool.
+  """
+  subject, grayscalePath, labelPath, slabThickness, histogramRange = task
+  startTime = time.time()
+  try:
+    labelReader = slabReader(labelPath)
+    grayscaleReader = slabReader(grayscalePath)
+    if labelReader.dimensions != grayscaleReader.dimensions:
+      raise ValueError("Volumes do not have the same dimensions: %s and %s" %
+                         (str(grayscaleReader.dimensions), str(labelReader.dimensions)))
+    if histogramRange is None:
+      accumulator = LabelStatisticsAccumulator()
+    else:
+      accumulator = LabelStatisticsAccumulator(extended=True, histogramRange=histogramRange)
+    accumulateSlabs(labelReader.slabs(slabThickness), grayscaleReader.slabs(slabThickness), accumulator)
+    cubicMMPerVoxel = 1.
+    for s in labelReader.spacing:
+      cubicMMPerVoxel *= s
+    labelStats = accumulator.labelStats(cubicMMPerVoxel, ijkToRAS=labelReader.ijkToRAS)
+    error = None
+  except (IOError, ValueError, KeyError) as e:
+    labelStats = None
+    error = str(e)
+  return subject, labelStats, time.time() - startTime, error
+
+#
+# LabelStatisticsBatch
+#
+
+class LabelStatisticsBatch(object):
+  """Compute the statistics of every subject of a manifest and write
+  them to one combined table: the columns of LabelStatisticsLogic.statsAsCSV
+  prefixed by a 'Subject' column.  The output format follows the
+  extension of outputPath: .csv, .npz (numpy column arrays) or
+  .parquet (needs pyarrow).  Giving a histogramRange adds the extended
+  statistics columns.
+
+  Progress is recorded in outputPath + '.progress.csv' with the time
+  spent and the status of every finished subject, so an interrupted
+  batch resumes with the subjects that are not done yet (or failed).
+  The progress file starts with the options of the statistics: a
+  batch does not resume the output of other options.
+  """
+
+  def __init__(self, manifestPath, outputPath, processes=None, slabThickness=16, histogramRange=None):
+    self.manifestPath = manifestPath
+    self.outputPath = outputPath
+    self.processes = processes
+    self.slabThickness = slabThickness
+    self.histogramRange = histogramRange
+    self.keys = ("Subject",) + labelStatisticsKeys
+    if histogramRange is not None:
+      self.keys += labelStatisticsExtendedKeys
+    base, extension = os.path.splitext(outputPath)
+    self.format = extension.lower().lstrip('.')
+    if self.format not in ('csv', 'npz', 'parquet'):
+      raise ValueError("Unsupported output format '%s', use .csv, .npz or .parquet" % extension)
+    self.csvPath = outputPath if self.format == 'csv' else outputPath + '.csv'
+    self.progressPath = outputPath + '.progress.csv'
+
+  def optionsLine(self):
+    """First line of the progress file"""
+    if self.histogramRange is None:
+      return "# basic statistics"
+    return "# extended statistics, histogram range %r %r" % tuple([float(v) for v in self.histogramRange])
+
+  def checkResume(self):
+    """Raise ValueError if the existing output was computed with
+    other options than this batch, its rows would not match
+    """
+    if not os.path.exists(self.progressPath):
+      return
+    fp = open(self.progressPath, 'r')
+    try:
+      options = fp.readline().rstrip('\r\n')
+    finally:
+      fp.close()
+    header = None
+    if os.path.exists(self.csvPath):
+      fp = open(self.csvPath, 'r')
+      try:
+        header = next(csv.reader(fp), None)
+      finally:
+        fp.close()
+    if options != self.optionsLine() or (header is not None and header != list(self.keys)):
+      raise ValueError("%s was computed with other options than '%s', remove it and %s to start over"
+                         % (self.outputPath, self.optionsLine()[2:], self.progressPath))
+
+  def completedSubjects(self):
+    """Return the subjects recorded as successful in the progress file,
+    failed subjects are tried again
+    """
+    completed = set()
+    if not os.path.exists(self.progressPath):
+      return completed
+    fp = open(self.progressPath, 'r')
+    try:
+      for row in csv.DictReader([line for line in fp if not line.startswith('#')]):
+        if not row['Error']:
+          completed.add(row['Subject'])
+    finally:
+      fp.close()
+    return completed
+
+  def prepareOutput(self, completed):
+    """Keep the rows of completed subjects in the csv (a row written
+    by an interrupted run is dropped) and make sure both the csv and
+    the progress file start with their header
+    """
+    rows = []
+    if os.path.exists(self.csvPath):
+      fp = open(self.csvPath, 'r')
+      try:
+        reader = csv.reader(fp)
+        next(reader, None)
+        rows = [row for row in reader if row and row[0] in completed]
+      finally:
+        fp.close()
+    fp = open(self.csvPath, 'w')
+    fp.write(",".join(["\"%s\"" % k for k in self.keys]) + "\n")
+    for row in rows:
+      fp.write(",".join(["\"%s\"" % row[0]] + row[1:]) + "\n")
+    fp.close()
+    if not os.path.exists(self.progressPath):
+      fp = open(self.progressPath, 'w')
+      fp.write(self.optionsLine() + "\n")
+      fp.write("Subject,Seconds,Labels,Error\n")
+      fp.close()
+
+  def subjectCSV(self, subject, labelStats):
+    """csv lines of one subject, same value formatting as statsAsCSV
+    """
+    lines = ""
+    for i in labelStats["Labels"]:
+      line = "\"%s\"" % subject
+      for k in self.keys[1:]:
+        line += "," + str(labelStats[i,k])
+      lines += line + "\n"
+    return lines
+
+  def recordSubject(self, subject, labelStats, seconds, error):
+    if labelStats is not None:
+      fp = open(self.csvPath, 'a')
+      fp.write(self.subjectCSV(subject, labelStats))
+      fp.close()
+    # the progress entry is written last: a subject counts as done
+    # only once its rows are on disk
+    labelCount = len(labelStats["Labels"]) if labelStats is not None else 0
+    fp = open(self.progressPath, 'a')
+    csv.writer(fp).writerow([subject, "%f" % seconds, labelCount, error or ""])
+    fp.close()
+
+  def run(self, progressCallback=None):
+    """Compute all the subjects not done yet.  progressCallback, if
+    given, is called as progressCallback(subject, done, total, seconds, error)
+    after every subject.  Returns the list of (subject, error) that failed.
+    """
+    subjects = readManifest(self.manifestPath)
+    if len(set([s[0] for s in subjects])) != len(subjects):
+      raise ValueError("Subject names in %s are not unique" % self.manifestPath)
+    self.checkResume()
+    completed = self.completedSubjects()
+    self.prepareOutput(completed)
+    tasks = [(subject, grayscalePath, labelPath, self.slabThickness, self.histogramRange)
+               for subject, grayscalePath, labelPath in subjects if subject not in completed]
+
+    if self.processes == 1:
+      results = (computeSubjectStatistics(task) for task in tasks)
+      pool = None
+    else:
+      import multiprocessing
+      pool = multiprocessing.Pool(self.processes)
+      results = pool.imap_unordered(computeSubjectStatistics, tasks)
+
+    failures = []
+    done = len(subjects) - len(tasks)
+    try:
+      for subject, labelStats, seconds, error in results:
+        self.recordSubject(subject, labelStats, seconds, error)
+        done += 1
+        if error:
+          failures.append((subject, error))
+        if progressCallback:
+          progressCallback(subject, done, len(subjects), seconds, error)
+    finally:
+      if pool:
+        pool.close()
+        pool.join()
+
+    if self.format != 'csv':
+      self.writeColumns()
+    return failures
+
+  def columns(self):
+    """Return the combined csv as a dictionary of numpy column arrays
+    """
+    import numpy
+    fp = open(self.csvPath, 'r')
+    try:
+      reader = csv.reader(fp)
+      next(reader, None)
+      rows = [row for row in reader if row]
+    finally:
+      fp.close()
+    columns = {}
+    for n, k in enumerate(self.keys):
+      values = [row[n] for row in rows]
+      if k == "Subject":
+        columns[k] = numpy.array(values)
+      elif k in ("Index", "Count") or k[1:] in (" Min", " Max"):
+        columns[k] = numpy.array(values, dtype=numpy.int64)
+      else:
+        columns[k] = numpy.array(values, dtype=numpy.float64)
+    return columns
+
+  def writeColumns(self):
+    columns = self.columns()
+    if self.format == 'npz':
+      import numpy
+      numpy.savez(self.outputPath, **columns)
+    elif self.format == 'parquet':
+      try:
+        import pyarrow
+        import pyarrow.parquet
+      except ImportError:
+        raise ImportError("Writing parquet files requires pyarrow, the statistics are available in %s" % self.csvPath)
+      table = pyarrow.Table.from_arrays([pyarrow.array(columns[k]) for k in self.keys], names=list(self.keys))
+      pyarrow.parquet.write_table(table, self.outputPath)
+
+#
+# command line entry point
+#
+
+def main(argv):
+  import argparse
+  parser = argparse.ArgumentParser(description="Compute label statistics for the grayscale/label pairs of a manifest")
+  parser.add_argument("manifest", help="csv file with 'grayscale', 'label' and optional 'subject' columns")
+  parser.add_argument("output", help="combined statistics file (.csv, .npz or .parquet)")
+  parser.add_argument("--processes", type=int, default=None, help="number of worker processes (default: one per cpu)")
+  parser.add_argument("--slab-thickness", type=int, default=16, help="number of slices read at a time")
+  parser.add_argument("--histogram-range", type=float, nargs=2, default=None, metavar=("LO", "HI"),
+                      help="grayscale range of the histogram, enables the extended statistics")
+  args = parser.parse_args(argv)
+
+  def progress(subject, done, total, seconds, error):
+    status = "failed: %s" % error if error else "%.2fs" % seconds
+    print("[%d/%d] %s %s" % (done, total, subject, status))
+
+  batch = LabelStatisticsBatch(args.manifest, args.output, processes=args.processes,
+                               slabThickness=args.slab_thickness, histogramRange=args.histogram_range)
+  failures = batch.run(progress)
+  return 1 if failures else 0
+
+if __name__ == "__main__":
+  sys.exit(main(sys.argv[1:]))
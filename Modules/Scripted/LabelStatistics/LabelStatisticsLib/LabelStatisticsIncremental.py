@@ -0,0 +1,149 @@
+import numpy
+
+from LabelStatisticsAccumulator import LabelStatisticsAccumulator, paddedBincount
+
+__all__ = ['IncrementalLabelStatistics']
+
+#
+# IncrementalLabelStatistics
+#
+
+class IncrementalLabelStatistics(object):
+  """Label statistics that follow edits of a label array.
+  The label and grayscale arrays are live (k,j,i) views of the
+  images; after the label array has been edited, update(extent)
+  subtracts the contribution of the changed voxels of that IJK extent
+  from the per-label sums and adds their new contribution.  The cost
+  is proportional to the extent, not to the volume.
+
+  A copy of the label array is kept to know the previous labels.
+  Min and max cannot be subtracted, so the number of voxels at the
+  extreme values is tracked: a label is only rescanned when the
+  last voxel holding its min or max is removed.
+  """
+
+  def __init__(self, labelArray, grayscaleArray):
+    if labelArray.shape != grayscaleArray.shape:
+      raise ValueError("label and grayscale arrays have different shapes %s %s" %
+                         (str(labelArray.shape), str(grayscaleArray.shape)))
+    self.labelArray = labelArray
+    self.grayscaleArray = grayscaleArray
+    self.recompute()
+
+  def recompute(self):
+    """Compute the statistics of the whole volume
+    """
+    self.previousLabels = self.labelArray.copy()
+    labels = self.labelArray.ravel().astype(numpy.int64)
+    values = self.grayscaleArray.ravel().astype(numpy.float64)
+    self.accumulator = LabelStatisticsAccumulator.fromArrays(labels, values)
+    self.minCount, self.maxCount = self.extremeCounts(labels, values)
+
+  def extremeCounts(self, labels, values):
+    """Number of voxels of each accumulated label at its min and max value
+    """
+    accumulator = self.accumulator
+    voxelIndex = numpy.searchsorted(accumulator.labels, labels)
+    size = accumulator.labels.size
+    minCount = paddedBincount(voxelIndex, size, values == accumulator.min[voxelIndex])
+    maxCount = paddedBincount(voxelIndex, size, values == accumulator.max[voxelIndex])
+    return minCount.astype(numpy.int64), maxCount.astype(numpy.int64)
+
+  def update(self, extent=None):
+    """Account for the edits within extent (iMin, iMax, jMin, jMax, kMin, kMax,
+    clamped to the volume) or recompute everything if extent is None
+    """
+    if extent is None:
+      self.recompute()
+      return
+    shape = self.labelArray.shape
+    region = (slice(max(extent[4], 0), min(extent[5], shape[0]-1) + 1),
+              slice(max(extent[2], 0), min(extent[3], shape[1]-1) + 1),
+              slice(max(extent[0], 0), min(extent[1], shape[2]-1) + 1))
+    previous = self.previousLabels[region]
+    current = self.labelArray[region]
+    changed = previous != current
+    if not changed.any():
+      return
+    oldLabels = previous[changed].astype(numpy.int64)
+    newLabels = current[changed].astype(numpy.int64)
+    values = self.grayscaleArray[region][changed].astype(numpy.float64)
+    stale = self.remove(oldLabels, values)
+    self.add(newLabels, values)
+    self.previousLabels[region] = current
+    if stale.size:
+      self.rescan(stale)
+
+  def remove(self, labels, values):
+    """Subtract voxels from the sums, return the labels whose min or
+    max may have been removed
+    """
+    accumulator = self.accumulator
+    removed = LabelStatisticsAccumulator.fromArrays(labels, values)
+    index = numpy.searchsorted(accumulator.labels, removed.labels)
+    accumulator.count[index] -= removed.count
+    accumulator.sum[index] -= removed.sum
+    accumulator.sumSquares[index] -= removed.sumSquares
+
+    voxelIndex = numpy.searchsorted(accumulator.labels, labels)
+    size = accumulator.labels.size
+    self.minCount -= paddedBincount(voxelIndex, size, values == accumulator.min[voxelIndex]).astype(numpy.int64)
+    self.maxCount -= paddedBincount(voxelIndex, size, values == accumulator.max[voxelIndex]).astype(numpy.int64)
+
+    keep = accumulator.count > 0
+    stale = accumulator.labels[keep & ((self.minCount <= 0) | (self.maxCount <= 0))]
+    if not keep.all():
+      for name in ('labels', 'count', 'sum', 'sumSquares', 'min', 'max'):
+        setattr(accumulator, name, getattr(accumulator, name)[keep])
+      self.minCount = self.minCount[keep]
+      self.maxCount = self.maxCount[keep]
+    return stale
+
+  def add(self, labels, values):
+    """Add voxels to the sums
+    """
+    accumulator = self.accumulator
+    previousLabels = accumulator.labels
+    previousMin = accumulator.min
+    previousMax = accumulator.max
+    accumulator.merge(LabelStatisticsAccumulator.fromArrays(labels, values))
+
+    # realign the extreme counts with the merged labels, an extreme
+    # that moved starts over from the added voxels
+    size = accumulator.labels.size
+    position = numpy.searchsorted(accumulator.labels, previousLabels)
+    minCount = numpy.zeros(size, dtype=numpy.int64)
+    maxCount = numpy.zeros(size, dtype=numpy.int64)
+    minCount[position] = self.minCount
+    maxCount[position] = self.maxCount
+    oldMin = numpy.empty(size)
+    oldMin.fill(numpy.inf)
+    oldMin[position] = previousMin
+    oldMax = numpy.empty(size)
+    oldMax.fill(-numpy.inf)
+    oldMax[position] = previousMax
+    minCount[accumulator.min < oldMin] = 0
+    maxCount[accumulator.max > oldMax] = 0
+    voxelIndex = numpy.searchsorted(accumulator.labels, labels)
+    minCount += paddedBincount(voxelIndex, size, values == accumulator.min[voxelIndex]).astype(numpy.int64)
+    maxCount += paddedBincount(voxelIndex, size, values == accumulator.max[voxelIndex]).astype(numpy.int64)
+    self.minCount = minCount
+    self.maxCount = maxCount
+
+  def rescan(self, labels):
+    """Recompute min and max of the given labels from the whole volume
+    """
+    accumulator = self.accumulator
+    for label in labels:
+      n = numpy.searchsorted(accumulator.labels, label)
+      if n >= accumulator.labels.size or accumulator.labels[n] != label:
+        # all the voxels of the label were removed
+        continue
+      values = self.grayscaleArray[self.labelArray == label]
+      accumulator.min[n] = values.min()
+      accumulator.max[n] = values.max()
+      self.minCount[n] = (values == accumulator.min[n]).sum()
+      self.maxCount[n] = (values == accumulator.max[n]).sum()
+
+  def labelStats(self, cubicMMPerVoxel, ccPerCubicMM=0.001):
+    return self.accumulator.labelStats(cubicMMPerVoxel, ccPerCubicMM)
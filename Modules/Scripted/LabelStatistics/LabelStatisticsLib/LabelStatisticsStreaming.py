@@ -0,0 +1,365 @@
+import os
+import zlib
+import numpy
+
+try:
+  from itertools import izip
+except ImportError:
+  izip = zip
+
+from LabelStatisticsAccumulator import LabelStatisticsAccumulator
+
+__all__ = ['SlabFileReader', 'NRRDSlabReader', 'MetaImageSlabReader', 'slabReader',
+           'readNRRDHeader', 'readMetaImageHeader', 'metaImageIJKToRAS', 'accumulateSlabs']
+
+#
+# SlabFileReader
+#
+
+class SlabFileReader(object):
+  """Access to the voxels of a 3D volume file a slab of slices along
+  K at a time, without loading the volume.  Uncompressed data is
+  memory mapped: pages of a slab are only read when the slab is used
+  and can be dropped by the operating system afterwards.  Compressed
+  data is decompressed a slab at a time.  Either way memory use is
+  bounded by the slab size.
+  Subclasses read the header and set dimensions (i, j, k), dtype,
+  spacing and ijkToRAS, then call openData.
+  """
+
+  def openData(self, dataPath, offset, compression=None, byteSkip=0):
+    """Locate the voxels at offset bytes into dataPath.  compression
+    is None, 'gzip' or 'zlib', byteSkip bytes of the decompressed
+    data are skipped
+    """
+    self.dataPath = dataPath
+    self.offset = offset
+    self.compression = compression
+    self.byteSkip = byteSkip
+    self.array = None
+    if compression is None:
+      # numpy lists the slowest axis first
+      shape = tuple(reversed(self.dimensions))
+      self.array = numpy.memmap(dataPath, dtype=self.dtype, mode='r', offset=offset + byteSkip, shape=shape)
+
+  def slabs(self, slabThickness):
+    """Yield (firstK, array) for consecutive slabs of slabThickness
+    slices, the arrays are (k,j,i) views of the mapped file or
+    decompressed copies
+    """
+    if self.array is not None:
+      for k in range(0, self.dimensions[2], slabThickness):
+        yield k, self.array[k:k+slabThickness]
+      return
+    sliceBytes = self.dimensions[0] * self.dimensions[1] * self.dtype.itemsize
+    fp = open(self.dataPath, 'rb')
+    try:
+      fp.seek(self.offset)
+      stream = DecompressingReader(fp, self.compression)
+      stream.read(self.byteSkip)
+      for k in range(0, self.dimensions[2], slabThickness):
+        thickness = min(slabThickness, self.dimensions[2] - k)
+        data = stream.read(thickness * sliceBytes)
+        if len(data) != thickness * sliceBytes:
+          raise ValueError("%s: the compressed data ends at slice %d" % (self.path, k))
+        yield k, numpy.frombuffer(data, dtype=self.dtype).reshape(thickness, self.dimensions[1], self.dimensions[0])
+    finally:
+      fp.close()
+
+class DecompressingReader(object):
+  """read() of the zlib or gzip compressed data of an open file,
+  decompressing no more than asked for
+  """
+
+  blockSize = 1 << 20
+
+  def __init__(self, fp, compression):
+    self.fp = fp
+    windowBits = zlib.MAX_WBITS
+    if compression == 'gzip':
+      windowBits += 16
+    self.decompressor = zlib.decompressobj(windowBits)
+
+  def read(self, size):
+    chunks = []
+    available = 0
+    while available < size:
+      data = self.decompressor.unconsumed_tail
+      if not data:
+        data = self.fp.read(self.blockSize)
+        if not data:
+          break
+      chunk = self.decompressor.decompress(data, size - available)
+      chunks.append(chunk)
+      available += len(chunk)
+    return b''.join(chunks)
+
+#
+# NRRDSlabReader
+#
+
+class NRRDSlabReader(SlabFileReader):
+  """Slab access to a raw or gzip encoded 3D nrrd file (attached
+  .nrrd or detached .nhdr header)
+  """
+
+  types = {
+    'int8' : ('signed char', 'int8', 'int8_t'),
+    'uint8' : ('uchar', 'unsigned char', 'uint8', 'uint8_t'),
+    'int16' : ('short', 'short int', 'signed short', 'signed short int', 'int16', 'int16_t'),
+    'uint16' : ('ushort', 'unsigned short', 'unsigned short int', 'uint16', 'uint16_t'),
+    'int32' : ('int', 'signed int', 'int32', 'int32_t'),
+    'uint32' : ('uint', 'unsigned int', 'uint32', 'uint32_t'),
+    'int64' : ('longlong', 'long long', 'long long int', 'signed long long', 'signed long long int', 'int64', 'int64_t'),
+    'uint64' : ('ulonglong', 'unsigned long long', 'unsigned long long int', 'uint64', 'uint64_t'),
+    'float32' : ('float',),
+    'float64' : ('double',),
+    }
+
+  encodings = {'raw' : None, 'gzip' : 'gzip', 'gz' : 'gzip'}
+
+  def __init__(self, path):
+    self.path = path
+    self.fields, headerSize = readNRRDHeader(path)
+
+    if int(self.fields.get('dimension', 0)) != 3:
+      raise ValueError("%s: only 3 dimensional nrrd files can be streamed" % path)
+    encoding = self.fields.get('encoding', '')
+    if encoding not in self.encodings:
+      raise ValueError("%s: only raw and gzip encoded nrrd files can be streamed (encoding is '%s')"
+                         % (path, encoding))
+
+    self.dimensions = tuple([int(s) for s in self.fields['sizes'].split()])
+    self.dtype = self.scalarType(self.fields['type'])
+    if self.dtype.itemsize > 1:
+      byteOrder = '>' if self.fields.get('endian', 'little') == 'big' else '<'
+      self.dtype = self.dtype.newbyteorder(byteOrder)
+    self.spacing = self.readSpacing()
+    self.ijkToRAS = self.readIJKToRAS()
+
+    dataPath, offset = self.dataLocation(headerSize)
+    byteSkip = int(self.fields.get('byte skip', self.fields.get('byteskip', 0)))
+    compression = self.encodings[encoding]
+    if byteSkip == -1:
+      if compression:
+        raise ValueError("%s: byte skip -1 is only allowed with raw encoding" % path)
+      dataSize = self.dtype.itemsize
+      for d in self.dimensions:
+        dataSize *= d
+      offset = os.path.getsize(dataPath) - dataSize
+      byteSkip = 0
+    self.openData(dataPath, offset, compression, byteSkip)
+
+  def scalarType(self, nrrdType):
+    for dtype, names in self.types.items():
+      if nrrdType in names:
+        return numpy.dtype(dtype)
+    raise ValueError("%s: unsupported nrrd type '%s'" % (self.path, nrrdType))
+
+  def readSpacing(self):
+    if 'spacings' in self.fields:
+      return tuple([float(s) for s in self.fields['spacings'].split()])
+    if 'space directions' in self.fields:
+      spacing = []
+      for direction in self.fields['space directions'].split():
+        if direction == 'none':
+          continue
+        vector = [float(v) for v in direction.strip('()').split(',')]
+        spacing.append(sum([v*v for v in vector]) ** 0.5)
+      return tuple(spacing)
+    return (1., 1., 1.)
+
+  def readIJKToRAS(self):
+    """Return the 4x4 IJK to RAS matrix as nested lists
+    """
+    matrix = [[0., 0., 0., 0.], [0., 0., 0., 0.], [0., 0., 0., 0.], [0., 0., 0., 1.]]
+    if 'space directions' not in self.fields:
+      for axis in range(3):
+        matrix[axis][axis] = self.spacing[axis]
+      return matrix
+    directions = [d for d in self.fields['space directions'].split() if d != 'none']
+    for column, direction in enumerate(directions):
+      for row, v in enumerate(direction.strip('()').split(',')):
+        matrix[row][column] = float(v)
+    if 'space origin' in self.fields:
+      for row, v in enumerate(self.fields['space origin'].strip('()').split(',')):
+        matrix[row][3] = float(v)
+    if self.fields.get('space', '').lower() in ('left-posterior-superior', 'lps'):
+      for row in (0, 1):
+        matrix[row] = [-v for v in matrix[row]]
+    return matrix
+
+  def dataLocation(self, headerSize):
+    """Return the path of the data and the byte offset where it
+    starts, before the byte skip
+    """
+    dataFile = self.fields.get('data file', self.fields.get('datafile'))
+    if dataFile:
+      if len(dataFile.split()) > 1:
+        raise ValueError("%s: multi file nrrd data is not supported" % self.path)
+      dataPath = os.path.join(os.path.dirname(self.path), dataFile)
+      offset = 0
+      lineSkip = int(self.fields.get('line skip', self.fields.get('lineskip', 0)))
+      if lineSkip:
+        fp = open(dataPath, 'rb')
+        for n in range(lineSkip):
+          fp.readline()
+        offset = fp.tell()
+        fp.close()
+    else:
+      dataPath = self.path
+      offset = headerSize
+    return dataPath, offset
+
+#
+# MetaImageSlabReader
+#
+
+class MetaImageSlabReader(SlabFileReader):
+  """Slab access to a single channel 3D MetaImage file (.mha or
+  .mhd with a single data file), uncompressed or compressed
+  """
+
+  types = {
+    'MET_CHAR' : 'int8', 'MET_UCHAR' : 'uint8',
+    'MET_SHORT' : 'int16', 'MET_USHORT' : 'uint16',
+    'MET_INT' : 'int32', 'MET_UINT' : 'uint32',
+    'MET_LONG' : 'int32', 'MET_ULONG' : 'uint32',
+    'MET_LONG_LONG' : 'int64', 'MET_ULONG_LONG' : 'uint64',
+    'MET_FLOAT' : 'float32', 'MET_DOUBLE' : 'float64',
+    }
+
+  def __init__(self, path):
+    self.path = path
+    self.fields, headerSize = readMetaImageHeader(path)
+    fields = self.fields
+
+    if int(fields.get('NDims', 0)) != 3:
+      raise ValueError("%s: only 3 dimensional MetaImage files can be streamed" % path)
+    if int(fields.get('ElementNumberOfChannels', 1)) != 1:
+      raise ValueError("%s: only single channel MetaImage files can be streamed" % path)
+    if fields.get('ElementType') not in self.types:
+      raise ValueError("%s: unsupported MetaImage element type '%s'" % (path, fields.get('ElementType')))
+
+    self.dimensions = tuple([int(s) for s in fields['DimSize'].split()])
+    self.dtype = numpy.dtype(self.types[fields['ElementType']])
+    if self.dtype.itemsize > 1:
+      bigEndian = fields.get('BinaryDataByteOrderMSB', fields.get('ElementByteOrderMSB', 'False'))
+      self.dtype = self.dtype.newbyteorder('>' if bigEndian.lower() == 'true' else '<')
+    self.spacing = tuple([float(v) for v in fields.get('ElementSpacing', '1 1 1').split()])
+    self.ijkToRAS = metaImageIJKToRAS(fields)
+
+    compression = 'zlib' if fields.get('CompressedData', 'False').lower() == 'true' else None
+    dataFile = fields.get('ElementDataFile', '')
+    if dataFile == 'LOCAL':
+      dataPath = path
+      offset = headerSize
+    else:
+      if len(dataFile.split()) != 1:
+        raise ValueError("%s: multi file MetaImage data is not supported" % path)
+      dataPath = os.path.join(os.path.dirname(path), dataFile)
+      offset = int(fields.get('HeaderSize', 0))
+      if offset == -1:
+        if compression:
+          raise ValueError("%s: HeaderSize -1 is only allowed for uncompressed data" % path)
+        dataSize = self.dtype.itemsize
+        for d in self.dimensions:
+          dataSize *= d
+        offset = os.path.getsize(dataPath) - dataSize
+    self.openData(dataPath, offset, compression)
+
+def slabReader(path):
+  """Return the slab reader of a nrrd (.nrrd, .nhdr) or MetaImage
+  (.mha, .mhd) file
+  """
+  if path.lower().endswith(('.nrrd', '.nhdr')):
+    return NRRDSlabReader(path)
+  if path.lower().endswith(('.mha', '.mhd')):
+    return MetaImageSlabReader(path)
+  raise ValueError("Cannot stream %s: use nrrd or MetaImage files" % path)
+
+#
+# slab helpers
+#
+
+def readNRRDHeader(path):
+  """Return the fields of a nrrd header (keys in lower case) and
+  the size in bytes of the header
+  """
+  fields = {}
+  fp = open(path, 'rb')
+  try:
+    magic = fp.readline()
+    if not magic.startswith(b'NRRD'):
+      raise ValueError("%s is not a nrrd file" % path)
+    while True:
+      line = fp.readline()
+      if not line:
+        break
+      line = line.decode('latin-1').rstrip('\r\n')
+      if line == '':
+        break
+      if line.startswith('#') or ':=' in line:
+        continue
+      key, value = line.split(':', 1)
+      fields[key.strip().lower()] = value.strip()
+    return fields, fp.tell()
+  finally:
+    fp.close()
+
+def readMetaImageHeader(path):
+  """Return the fields of a MetaImage (.mha or .mhd) header, keys as
+  written in the file, and the size in bytes of the header
+  """
+  fields = {}
+  fp = open(path, 'rb')
+  try:
+    while True:
+      line = fp.readline()
+      if not line:
+        break
+      line = line.decode('latin-1').strip()
+      if '=' not in line:
+        continue
+      key, value = line.split('=', 1)
+      fields[key.strip()] = value.strip()
+      if key.strip() == 'ElementDataFile':
+        # the data (or its file name) follows
+        break
+    return fields, fp.tell()
+  finally:
+    fp.close()
+
+def metaImageIJKToRAS(fields):
+  """Return the 4x4 IJK to RAS matrix of a MetaImage header as nested
+  lists.  The TransformMatrix lists the LPS direction of each axis in
+  turn, as itk writes it
+  """
+  spacing = [float(v) for v in fields.get('ElementSpacing', '1 1 1').split()]
+  origin = fields.get('Offset', fields.get('Position', fields.get('Origin', '0 0 0')))
+  origin = [float(v) for v in origin.split()]
+  directions = [float(v) for v in fields.get('TransformMatrix', '1 0 0 0 1 0 0 0 1').split()]
+  matrix = [[0., 0., 0., 0.], [0., 0., 0., 0.], [0., 0., 0., 0.], [0., 0., 0., 1.]]
+  for axis in range(3):
+    for row in range(3):
+      matrix[row][axis] = directions[axis*3 + row] * spacing[axis]
+  for row in range(3):
+    matrix[row][3] = origin[row]
+  # lps to ras
+  for row in (0, 1):
+    matrix[row] = [-v for v in matrix[row]]
+  return matrix
+
+def accumulateSlabs(labelSlabs, grayscaleSlabs, accumulator=None):
+  """Accumulate per-label sums over matching sequences of
+  (firstK, array) slabs and return the merged accumulator
+  (a new basic accumulator if none is given).  The slabs are read
+  in step, one pair at a time.
+  """
+  if accumulator is None:
+    accumulator = LabelStatisticsAccumulator()
+  for (labelK, labelSlab), (grayscaleK, grayscaleSlab) in izip(labelSlabs, grayscaleSlabs):
+    if labelK != grayscaleK or labelSlab.size != grayscaleSlab.size:
+      raise ValueError("label and grayscale slabs do not match at slice %d" % labelK)
+    accumulator.addChunk(labelSlab, grayscaleSlab, labelK)
+  return accumulator
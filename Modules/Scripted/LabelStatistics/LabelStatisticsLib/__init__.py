@@ -0,0 +1,4 @@
+from LabelStatisticsAccumulator import *
+from LabelStatisticsStreaming import *
+from LabelStatisticsBatch import *
+from LabelStatisticsIncremental import *